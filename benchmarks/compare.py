@@ -0,0 +1,68 @@
+"""
+Compares two benchmark result files, for example of two revisions.
+
+    python benchmarks/compare.py before.json after.json --threshold 1.2
+
+Prints the time and peak memory of every case in both files with their
+ratio, and exits with status 1 when a case got slower than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(r['case'], r['size']): r for r in report['results']}
+
+
+def ratio(new, old):
+    if new is None or not old:
+        return None
+    return new / old
+
+
+def cell(value, template):
+    return template.format(value) if value is not None else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='time ratio above which a case counts as slower')
+    args = parser.parse_args()
+
+    before_report, before = load(args.before)
+    after_report, after = load(args.after)
+    print('before: {}\nafter:  {}\n'.format(before_report.get('revision'),
+                                          after_report.get('revision')))
+    row = '{:<30} {:>8} {:>10} {:>10} {:>7} {:>9} {:>9} {:>7}'
+    print(row.format('case', 'size', 'before s', 'after s', 'ratio',
+                     'before MB', 'after MB', 'ratio'))
+    slower = []
+    for key in sorted(set(before) | set(after)):
+        old = before.get(key, {})
+        new = after.get(key, {})
+        time_ratio = ratio(new.get('seconds'), old.get('seconds'))
+        memory_ratio = ratio(new.get('peak_rss_mb'), old.get('peak_rss_mb'))
+        print(row.format(
+            key[0], key[1],
+            cell(old.get('seconds'), '{:.2f}') if old.get('status') != 'timeout' else 'timeout',
+            cell(new.get('seconds'), '{:.2f}') if new.get('status') != 'timeout' else 'timeout',
+            cell(time_ratio, '{:.2f}'),
+            cell(old.get('peak_rss_mb'), '{:.0f}'), cell(new.get('peak_rss_mb'), '{:.0f}'),
+            cell(memory_ratio, '{:.2f}')))
+        if (time_ratio is not None and time_ratio > args.threshold) or \
+                (old.get('status') == 'ok' and new.get('status') in ('failed', 'timeout')):
+            slower.append(key)
+    if slower:
+        print('\nSlower than {}x or no longer completing: {}'.format(
+            args.threshold, ', '.join('{} ({})'.format(*key) for key in slower)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+A local stand-in for the OSRM match service used by Snap to Roads.
+
+It answers /match/v1/<profile>/<coordinates> requests with a matching which
+follows the trace points themselves, so Snap to Roads can be benchmarked
+without network access or an OSRM server. The response only has the parts
+of the OSRM format the script reads.
+"""
+import json
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+# Trace points further north are treated as off the road network
+MAX_LATITUDE = 85.0
+
+
+class MatchHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        parts = path.strip('/').split('/')
+        if len(parts) != 4 or parts[0] != 'match':
+            self.reply(400, {'code': 'InvalidUrl', 'message': 'Unsupported path'})
+            return
+        try:
+            coordinates = [[float(value) for value in pair.split(',')]
+                           for pair in unquote(parts[3]).split(';')]
+        except ValueError:
+            self.reply(400, {'code': 'InvalidQuery', 'message': 'Invalid coordinates'})
+            return
+        self.reply(200, match(coordinates))
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def match(coordinates):
+    """
+    Matchings through the trace points themselves, at 10 meters per second.
+    Points north of MAX_LATITUDE are not matched and split the matchings, and
+    a request without any matched point gets a NoMatch response.
+    """
+    runs = []
+    previous = None
+    for i, point in enumerate(coordinates):
+        if point[1] > MAX_LATITUDE:
+            previous = None
+            continue
+        if previous is None:
+            runs.append([])
+        runs[-1].append(i)
+        previous = i
+    if not runs:
+        return {'code': 'NoMatch', 'message': 'Could not match the trace.'}
+
+    matchings = []
+    tracepoints = [None] * len(coordinates)
+    for index, run in enumerate(runs):
+        line = [coordinates[i] for i in run]
+        distance = sum(haversine(a, b) for a, b in zip(line[:-1], line[1:]))
+        matchings.append({
+            'confidence': 1.0,
+            'distance': distance,
+            'duration': distance / 10,
+            'geometry': {'type': 'LineString', 'coordinates': line},
+        })
+        for waypoint, i in enumerate(run):
+            tracepoints[i] = {'location': coordinates[i], 'matchings_index': index,
+                              'waypoint_index': waypoint}
+    return {'code': 'Ok', 'matchings': matchings, 'tracepoints': tracepoints}
+
+
+def haversine(a, b):
+    lon1, lat1, lon2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(h))
+
+
+def start():
+    """Starts the stub on a free local port in a background thread, returning the server and its URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MatchHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
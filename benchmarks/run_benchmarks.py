@@ -0,0 +1,280 @@
+"""
+Benchmarks for the processing scripts of the collection.
+
+Runs every processing script on synthetic layers of increasing size, each
+run in its own Python process with QGIS in offscreen mode, and records the
+wall time, peak resident memory and features per second in a JSON file.
+Snap to Roads uses a local OSRM stub, so no network access is needed.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --cases split_polygons --sizes 10000
+    python benchmarks/compare.py before.json after.json
+"""
+import argparse
+import datetime
+import importlib.util
+import inspect
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+SCRIPTS_DIR = os.path.join(REPOSITORY_DIR, 'collections', 'spatialthoughts', 'processing')
+SIZES = [10000, 100000, 1000000]
+
+
+def output(directory, name='output'):
+    return os.path.join(directory, name + '.gpkg')
+
+
+# Every case names the script, the synthetic layers it reads as
+# (layer, size divisor) and a function returning the algorithm parameters
+# from the layer paths, an output directory, the OSRM stub URL and the size.
+CASES = {
+    'attribute_iterator': (
+        'attribute_iterator.py', {'INPUT': ('points', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'SPATIAL_INDEX': True, 'STATISTICS': True}),
+    'conditional_spatial_join': (
+        'conditional_spatial_join.py', {'INPUT': ('polygons', 10), 'JOIN': ('points', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'JOIN': layers['JOIN'], 'PREDICATE': 0,
+            'JOINFIELD': 'name', 'CONDITION': 0, 'CONDITION_FIELD': 'value',
+            'AGGREGATES': [0, 1, 2], 'OUTPUT': output(out)}),
+    'connect_to_nearest_node': (
+        'connect_to_nearest_node.py', {'INPUT': ('polygons', 1), 'NODES': ('lines', 10)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'NODES': layers['NODES'], 'NEIGHBORS': 1,
+            'OUTPUT': output(out)}),
+    'constrained_kmeans': (
+        'constrainted_kmeans.py', {'INPUT': ('points', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'CLUSTERS': 20, 'MINPOINTS': size // 40,
+            'SOLVER': 1, 'SEED': 1, 'OUTPUT': output(out)}),
+    'equidistance_buffer': (
+        'equidistance_buffer.py', {'INPUT': ('geopoints', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'DISTANCE': 1000, 'OUTPUT': output(out)}),
+    'fix_line_transects': (
+        'fix_line_transects.py', {'INPUT': ('transects', 1), 'CENTERLINE': ('centerline', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'CENTERLINE': layers['CENTERLINE'],
+            'REQUIRED_LENGTH': 500, 'MAXIMUM_VARIATION': 20, 'OUTPUT': output(out)}),
+    'recursive_neighbor_selection': (
+        'recursive_neighbours_selection.py', {'INPUT': ('polygons', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'MODE': 1, 'OUTPUT': output(out)}),
+    'smooth_polygons': (
+        'smooth_polygons.py', {'INPUT': ('polygons', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'VERTICES': 5, 'TOLERANCE': 5, 'SEED': 1,
+            'OUTPUT': output(out)}),
+    'snap_to_roads': (
+        'snap_to_roads.py', {'INPUT': ('tracks', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'TRACK_FIELD': 'track_id',
+            'TIMESTAMP_FIELD': 'timestamp', 'SERVICE': service, 'THREADS': 4,
+            'CACHE_SIZE': 0, 'OUTPUT': output(out)}),
+    'spatial_homogeneity_test': (
+        'spatial_homogeneity_test.py', {'INPUT': ('stations', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'NAME_FIELD': 'name',
+            'VALUE_FIELD': 'precipitation', 'NEIGHBORS_FIELD': 'neighbors',
+            'PERMUTATIONS': 99, 'SEED': 1, 'OUTPUT': output(out)}),
+    'split_polygons': (
+        'split_polygons.py', {'INPUT': ('polygons', 1)},
+        lambda layers, out, service, size: {
+            'INPUT': layers['INPUT'], 'PARTS': 3, 'POINTS': 200, 'SEED': 1,
+            'OUTPUT': output(out)}),
+}
+
+
+def start_qgis():
+    """Starts QGIS without a display and initializes Processing with the native algorithms"""
+    from qgis.core import QgsApplication
+    application = QgsApplication([], False)
+    application.initQgis()
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins'))
+    from processing.core.Processing import Processing
+    Processing.initialize()
+    from qgis.analysis import QgsNativeAlgorithms
+    if QgsApplication.processingRegistry().providerById('native') is None:
+        QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
+    return application
+
+
+def load_algorithm(script):
+    """Imports the script file and returns a new instance of the algorithm it defines"""
+    from qgis.core import QgsProcessingAlgorithm
+    name = os.path.splitext(script)[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS_DIR, script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for value in vars(module).values():
+        if inspect.isclass(value) and issubclass(value, QgsProcessingAlgorithm) and \
+                value.__module__ == name:
+            return value()
+    raise RuntimeError('No processing algorithm in {}'.format(script))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_case(case, size, data_dir, service):
+    """Runs one benchmark in this process and returns its measurements"""
+    application = start_qgis()
+    from qgis.core import (QgsApplication, QgsProcessingFeedback,
+                           QgsProcessingProvider, QgsVectorLayer)
+    import processing
+    import synthetic
+
+    script, roles, parameters = CASES[case]
+    algorithm = load_algorithm(script)
+
+    class BenchmarkProvider(QgsProcessingProvider):
+
+        def id(self):
+            return 'benchmarks'
+
+        def name(self):
+            return 'Benchmarks'
+
+        def loadAlgorithms(self):
+            self.addAlgorithm(algorithm.createInstance())
+
+    QgsApplication.processingRegistry().addProvider(BenchmarkProvider())
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        layers = {}
+        for role, (name, divisor) in roles.items():
+            path = synthetic.layer_path(data_dir, name, max(1, size // divisor))
+            # Work on a copy, as some algorithms change their input layer
+            layers[role] = shutil.copy(path, work_dir)
+        features = QgsVectorLayer(layers['INPUT'], 'input', 'ogr').featureCount()
+
+        baseline = peak_rss_mb()
+        start = time.perf_counter()
+        processing.run('benchmarks:' + algorithm.name(),
+                       parameters(layers, work_dir, service, size),
+                       feedback=QgsProcessingFeedback())
+        seconds = time.perf_counter() - start
+        return {
+            'features': features,
+            'seconds': seconds,
+            'features_per_second': features / seconds if seconds else None,
+            'baseline_rss_mb': baseline,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        application.exitQgis()
+
+
+def generate_layers(cases, sizes, data_dir):
+    """Writes the synthetic layers the cases need which are not in the data directory yet"""
+    import synthetic
+    needed = sorted({(name, max(1, size // divisor)) for case in cases for size in sizes
+                     for name, divisor in CASES[case][1].values()})
+    missing = [layer for layer in needed if not os.path.exists(synthetic.layer_path(data_dir, *layer))]
+    if not missing:
+        return
+    application = start_qgis()
+    try:
+        for name, size in missing:
+            print('Generating {} layer of {} features'.format(name, size), flush=True)
+            synthetic.generate(data_dir, name, size)
+    finally:
+        application.exitQgis()
+
+
+def revision():
+    """The checked out git commit, with a + when there are local changes"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--', 'collections'],
+                               cwd=REPOSITORY_DIR, capture_output=True, text=True).stdout.strip()
+        return commit + ('+' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def qgis_version():
+    script = 'from qgis.core import Qgis; print(Qgis.QGIS_VERSION)'
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=sorted(CASES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--data-dir', default=os.path.join(BENCHMARKS_DIR, 'data'),
+                        help='directory of the synthetic layers, which are reused between runs')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--timeout', type=float, default=1800,
+                        help='seconds after which a run is stopped')
+    parser.add_argument('--worker', nargs=2, metavar=('CASE', 'SIZE'), help=argparse.SUPPRESS)
+    parser.add_argument('--service', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+    if args.worker:
+        result = run_case(args.worker[0], int(args.worker[1]), args.data_dir, args.service)
+        print(json.dumps(result))
+        return
+
+    generate_layers(args.cases, args.sizes, args.data_dir)
+    import osrm_stub
+    server, service = osrm_stub.start()
+    report = {
+        'revision': revision(),
+        'qgis_version': qgis_version(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'results': [],
+    }
+    try:
+        for size in args.sizes:
+            for case in args.cases:
+                print('{} at {} features'.format(case, size), end=' ', flush=True)
+                result = {'case': case, 'size': size}
+                command = [sys.executable, os.path.abspath(__file__), '--worker', case, str(size),
+                           '--data-dir', args.data_dir, '--service', service]
+                try:
+                    completed = subprocess.run(command, capture_output=True, text=True,
+                                               timeout=args.timeout)
+                    if completed.returncode == 0:
+                        result.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+                        result['status'] = 'ok'
+                    else:
+                        result['status'] = 'failed'
+                        result['error'] = '\n'.join(completed.stderr.strip().splitlines()[-5:])
+                except subprocess.TimeoutExpired:
+                    result['status'] = 'timeout'
+                print(result['status'] if result['status'] != 'ok' else
+                      '{:.2f} s, {:.0f} MB'.format(result['seconds'], result['peak_rss_mb']),
+                      flush=True)
+                report['results'].append(result)
+                # Written after every run, so a long session keeps what it measured
+                with open(args.output, 'w') as f:
+                    json.dump(report, f, indent=2)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""
+Synthetic layers for the benchmarks.
+
+Every generator writes a GeoPackage with a fixed random seed, so the same
+size always gives the same layer and results of different revisions can be
+compared. Layers are cached in the data directory and only written once.
+Projected layers use EPSG:3857 with about one feature per hectare, so the
+density stays the same at every size. The GPS tracks and the geographic
+points, for the scripts which need geographic coordinates, use EPSG:4326.
+"""
+import math
+import os
+
+import numpy as np
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransformContext,
+                       QgsFeature,
+                       QgsField,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsLineString,
+                       QgsPoint,
+                       QgsPolygon,
+                       QgsVectorFileWriter,
+                       QgsWkbTypes)
+
+# Distance between neighboring features, in meters
+SPACING = 100.0
+# Points per GPS track
+TRACK_POINTS = 1000
+# Length of a degree of latitude, in meters
+METERS_PER_DEGREE = 111320.0
+
+
+def layer_path(data_dir, name, size):
+    return os.path.join(data_dir, '{}_{}.gpkg'.format(name, size))
+
+
+def generate(data_dir, name, size):
+    """Returns the path of the named layer of the given size, writing it first if needed"""
+    path = layer_path(data_dir, name, size)
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        # Written under another name first, so an interrupted run leaves no partial layer
+        partial = path.replace('.gpkg', '.part.gpkg')
+        GENERATORS[name](partial, size, np.random.default_rng(size))
+        os.replace(partial, path)
+    return path
+
+
+def create_writer(path, fields, wkb_type, epsg=3857):
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = os.path.basename(path).split('.')[0]
+    writer = QgsVectorFileWriter.create(
+        path, fields, wkb_type, QgsCoordinateReferenceSystem('EPSG:{}'.format(epsg)),
+        QgsCoordinateTransformContext(), options)
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise RuntimeError('Cannot write {}: {}'.format(path, writer.errorMessage()))
+    return writer
+
+
+def write_features(path, fields, wkb_type, geometries, attributes, epsg=3857):
+    writer = create_writer(path, fields, wkb_type, epsg)
+    for geometry, values in zip(geometries, attributes):
+        feature = QgsFeature(fields)
+        feature.setGeometry(geometry)
+        feature.setAttributes(values)
+        writer.addFeature(feature)
+    # Deleting the writer flushes and closes the file
+    del writer
+
+
+def common_fields():
+    fields = QgsFields()
+    fields.append(QgsField('name', QVariant.String))
+    fields.append(QgsField('value', QVariant.Double))
+    fields.append(QgsField('category', QVariant.Int))
+    return fields
+
+
+def common_attributes(size, rng):
+    values = rng.gamma(2.0, 50.0, size)
+    categories = rng.integers(0, 100, size)
+    return (['F{}'.format(i), values[i].item(), categories[i].item()] for i in range(size))
+
+
+def grid_shape(size):
+    columns = math.ceil(math.sqrt(size))
+    return columns, math.ceil(size / columns)
+
+
+def points(path, size, rng):
+    """Points spread uniformly over a square"""
+    side = math.sqrt(size) * SPACING
+    xy = rng.random((size, 2)) * side
+    fields = common_fields()
+    fields.append(QgsField('weight', QVariant.Double))
+    weights = rng.random(size) + 0.5
+    attributes = (values + [weights[i].item()]
+                  for i, values in enumerate(common_attributes(size, rng)))
+    geometries = (QgsGeometry(QgsPoint(x, y)) for x, y in xy.tolist())
+    write_features(path, fields, QgsWkbTypes.Point,
+                   geometries, attributes)
+
+
+def geopoints(path, size, rng):
+    """Points in EPSG:4326 spread uniformly over a square around London, at the density of points"""
+    side = math.sqrt(size) * SPACING / METERS_PER_DEGREE
+    lat = rng.uniform(51.5 - side / 2, 51.5 + side / 2, size)
+    lon = rng.uniform(-side / 2, side / 2, size) / math.cos(math.radians(51.5))
+    geometries = (QgsGeometry(QgsPoint(x, y)) for x, y in zip(lon.tolist(), lat.tolist()))
+    write_features(path, common_fields(), QgsWkbTypes.Point,
+                   geometries, common_attributes(size, rng), 4326)
+
+
+def lines(path, size, rng):
+    """Short random walks of 4 vertices, about 150 meters long"""
+    side = math.sqrt(size) * SPACING
+    starts = rng.random((size, 1, 2)) * side
+    steps = rng.normal(0, SPACING / 2, (size, 3, 2))
+    vertices = np.concatenate([starts, starts + np.cumsum(steps, axis=1)], axis=1)
+    fields = common_fields()
+    geometries = (QgsGeometry(QgsLineString(line[:, 0].tolist(), line[:, 1].tolist()))
+                  for line in vertices)
+    write_features(path, fields, QgsWkbTypes.LineString,
+                   geometries, common_attributes(size, rng))
+
+
+def polygons(path, size, rng):
+    """Quadrilaterals on a jittered grid, so neighboring polygons share their edges"""
+    columns, rows = grid_shape(size)
+    lattice = np.stack(np.meshgrid(np.arange(columns + 1), np.arange(rows + 1)), axis=-1)
+    lattice = (lattice + rng.uniform(-0.3, 0.3, lattice.shape)) * SPACING
+
+    def cells():
+        for i in range(size):
+            row, column = divmod(i, columns)
+            corners = lattice[[row, row, row + 1, row + 1, row],
+                              [column, column + 1, column + 1, column, column]]
+            yield QgsGeometry(QgsPolygon(QgsLineString(corners[:, 0].tolist(),
+                                                       corners[:, 1].tolist())))
+
+    fields = common_fields()
+    write_features(path, fields, QgsWkbTypes.Polygon,
+                   cells(), common_attributes(size, rng))
+
+
+def stations(path, size, rng):
+    """Raingauges on a jittered grid, listing the stations of the surrounding grid cells as neighbors"""
+    columns, rows = grid_shape(size)
+    index = np.arange(size)
+    row, column = np.divmod(index, columns)
+    xy = (np.column_stack([column, row]) + rng.uniform(-0.3, 0.3, (size, 2))) * SPACING
+    precipitation = rng.gamma(4.0, 200.0, size)
+    # A few stations with values far from their neighbors
+    outliers = rng.choice(size, max(1, size // 100), replace=False)
+    precipitation[outliers] *= 3
+
+    def attributes():
+        for i in range(size):
+            neighbors = []
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    r, c = row[i] + dr, column[i] + dc
+                    j = r * columns + c
+                    if (dr or dc) and 0 <= r < rows and 0 <= c < columns and j < size:
+                        neighbors.append('S{}'.format(j))
+            yield ['S{}'.format(i), precipitation[i].item(), ','.join(neighbors)]
+
+    fields = QgsFields()
+    fields.append(QgsField('name', QVariant.String))
+    fields.append(QgsField('precipitation', QVariant.Double))
+    fields.append(QgsField('neighbors', QVariant.String))
+    geometries = (QgsGeometry(QgsPoint(x, y)) for x, y in xy.tolist())
+    write_features(path, fields, QgsWkbTypes.Point,
+                   geometries, attributes())
+
+
+def tracks(path, size, rng):
+    """GPS points in EPSG:4326, as random walks of TRACK_POINTS points taken every 5 seconds"""
+    track_ids = np.arange(size) // TRACK_POINTS
+    starts = rng.uniform([-0.5, 51.3], [0.3, 51.7], (track_ids[-1] + 1, 2))
+    steps = rng.normal(0, 0.0003, (size, 2))
+    # Cumulative sum of the steps, restarted at the first point of every track
+    walked = np.cumsum(steps, axis=0)
+    first = track_ids * TRACK_POINTS
+    xy = starts[track_ids] + walked - walked[first] + steps[first]
+    timestamps = 1600000000 + 5 * (np.arange(size) % TRACK_POINTS)
+
+    fields = QgsFields()
+    fields.append(QgsField('track_id', QVariant.Int))
+    fields.append(QgsField('timestamp', QVariant.LongLong))
+    attributes = ([track_ids[i].item(), timestamps[i].item()] for i in range(size))
+    geometries = (QgsGeometry(QgsPoint(x, y)) for x, y in xy.tolist())
+    write_features(path, fields, QgsWkbTypes.Point,
+                   geometries, attributes, 4326)
+
+
+def transects(path, size, rng):
+    """Transects of 500 meters, give or take 15, crossing the centerline off their middle"""
+    x = np.arange(size) * SPACING / 10
+    center = centerline_y(x)
+    length = 500 + rng.uniform(-15, 15, size)
+    offset = rng.uniform(-15, 15, size)
+    fields = QgsFields()
+    fields.append(QgsField('name', QVariant.String))
+    geometries = (QgsGeometry(QgsLineString(
+        [x[i].item(), x[i].item()],
+        [(center[i] - length[i] / 2 + offset[i]).item(),
+         (center[i] + length[i] / 2 + offset[i]).item()])) for i in range(size))
+    attributes = (['T{}'.format(i)] for i in range(size))
+    write_features(path, fields, QgsWkbTypes.LineString,
+                   geometries, attributes)
+
+
+def centerline(path, size, rng):
+    """The centerline of the transects, as one feature per 100 transects"""
+    x = np.arange(0, size * SPACING / 10 + SPACING, SPACING / 10)
+    y = centerline_y(x)
+    fields = QgsFields()
+    fields.append(QgsField('name', QVariant.String))
+    pieces = range(0, len(x) - 1, 100)
+    geometries = (QgsGeometry(QgsLineString(x[i:i + 101].tolist(), y[i:i + 101].tolist()))
+                  for i in pieces)
+    attributes = (['C{}'.format(i)] for i in pieces)
+    write_features(path, fields, QgsWkbTypes.LineString,
+                   geometries, attributes)
+
+
+def centerline_y(x):
+    return 50 * np.sin(x / 1000)
+
+
+GENERATORS = {
+    'points': points,
+    'geopoints': geopoints,
+    'lines': lines,
+    'polygons': polygons,
+    'stations': stations,
+    'tracks': tracks,
+    'transects': transects,
+    'centerline': centerline,
+}
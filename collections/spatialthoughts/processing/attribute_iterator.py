@@ -1,21 +1,42 @@
-from qgis.PyQt.QtCore import QCoreApplication
+import sqlite3
+import time
+
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
 from qgis.core import (QgsProcessing,
                        QgsFeatureSink,
                        QgsProcessingException,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterFeatureSource,
-                       QgsProcessingOutputVectorLayer)
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingOutputVectorLayer,
+                       QgsProviderRegistry,
+                       QgsDataSourceUri,
+                       QgsExpression,
+                       QgsFeature,
+                       QgsFeatureSource,
+                       QgsField,
+                       QgsFields,
+                       QgsWkbTypes)
 from qgis import processing
 
 
 class AttributeIterator(QgsProcessingAlgorithm):
     """
     This algorithm takes a vector layer and iterates through its attributes to
-    create attribute indices.
+    create attribute indices. It can also create the spatial index and collect
+    statistics, so that layers are prepared for analysis in one step.
     """
 
     INPUT = 'INPUT'
+    FIELDS = 'FIELDS'
+    MIN_DISTINCT_RATIO = 'MIN_DISTINCT_RATIO'
+    SPATIAL_INDEX = 'SPATIAL_INDEX'
+    STATISTICS = 'STATISTICS'
     OUTPUT = 'OUTPUT'
+    REPORT = 'REPORT'
 
     def tr(self, string):
 
@@ -37,7 +58,18 @@ class AttributeIterator(QgsProcessingAlgorithm):
         return ''
 
     def shortHelpString(self):
-        return self.tr("Create Attribute Indices on All Attributes of the Layer")
+        return self.tr("Create Attribute Indices on the Attributes of the Layer.\n"
+                       "Only the selected fields are indexed. Without a selection, "
+                       "fields are indexed when their number of distinct values is "
+                       "at least the given ratio of the number of features, and "
+                       "fields used in the layer filter are always indexed. Fields "
+                       "which already have an index are skipped. GeoPackage and "
+                       "SpatiaLite indexes are all created in one transaction.\n"
+                       "The spatial index is created too unless the layer already "
+                       "has one, and statistics can be collected for the query "
+                       "planner of GeoPackage, SpatiaLite and PostgreSQL layers. "
+                       "The report table lists every index with its status and "
+                       "the time it took.")
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -48,6 +80,50 @@ class AttributeIterator(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.FIELDS,
+                self.tr('Fields to index (all matching fields if none selected)'),
+                parentLayerParameterName=self.INPUT,
+                allowMultiple=True,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_DISTINCT_RATIO,
+                self.tr('Minimum ratio of distinct values to features'),
+                QgsProcessingParameterNumber.Double,
+                0.0, False, 0.0, 1.0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SPATIAL_INDEX,
+                self.tr('Create spatial index'),
+                True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.STATISTICS,
+                self.tr('Collect statistics (ANALYZE)'),
+                False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.REPORT,
+                self.tr('Report'),
+                QgsProcessing.TypeVector,
+                optional=True
+            )
+        )
+
         self.addOutput(
             QgsProcessingOutputVectorLayer(
                 self.OUTPUT,
@@ -64,12 +140,170 @@ class AttributeIterator(QgsProcessingAlgorithm):
 
         if source is None:
             raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
-        
+
+        # Rows of (index, type, status, seconds) for the report
+        self.report = []
+        fields = self.parameterAsFields(parameters, self.FIELDS, context)
+        if not fields:
+            ratio = self.parameterAsDouble(parameters, self.MIN_DISTINCT_RATIO, context)
+            fields = self.selectFields(source, ratio, feedback)
+
+        target = self.sqliteTable(source)
+        if target is not None:
+            self.createSqliteIndexes(target[0], target[1], fields, feedback)
+        else:
+            for current, field in enumerate(fields):
+                if feedback.isCanceled():
+                    break
+                feedback.pushInfo('Indexing field {}'.format(field))
+                start = time.perf_counter()
+                params = {'INPUT': source, 'FIELD': field}
+                processing.run("native:createattributeindex", params,
+                               context=context, feedback=feedback,
+                               is_child_algorithm=True)
+                self.report.append((field, 'attribute', 'created', time.perf_counter() - start))
+                feedback.setProgress(100 * (current + 1) / len(fields))
+
+        if self.parameterAsBool(parameters, self.SPATIAL_INDEX, context) and \
+                not feedback.isCanceled():
+            self.createSpatialIndex(source, context, feedback)
+
+        if self.parameterAsBool(parameters, self.STATISTICS, context) and \
+                not feedback.isCanceled():
+            self.collectStatistics(source, target, feedback)
+
+        results = {self.OUTPUT: source.id()}
+        report_fields = QgsFields()
+        report_fields.append(QgsField('index', QVariant.String))
+        report_fields.append(QgsField('type', QVariant.String))
+        report_fields.append(QgsField('status', QVariant.String))
+        report_fields.append(QgsField('seconds', QVariant.Double))
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.REPORT, context, report_fields, QgsWkbTypes.NoGeometry)
+        if sink is not None:
+            for row in self.report:
+                feature = QgsFeature(report_fields)
+                feature.setAttributes(list(row))
+                sink.addFeature(feature, QgsFeatureSink.FastInsert)
+            results[self.REPORT] = dest_id
+        return results
+
+    def createSpatialIndex(self, source, context, feedback):
+        if source.hasSpatialIndex() == QgsFeatureSource.SpatialIndexPresent:
+            feedback.pushInfo('The layer already has a spatial index')
+            self.report.append(('geometry', 'spatial', 'exists', 0.0))
+            return
+        feedback.pushInfo('Creating spatial index')
+        start = time.perf_counter()
+        processing.run("native:createspatialindex", {'INPUT': source},
+                       context=context, feedback=feedback,
+                       is_child_algorithm=True)
+        self.report.append(('geometry', 'spatial', 'created', time.perf_counter() - start))
+
+    def collectStatistics(self, source, target, feedback):
+        """Runs ANALYZE on the table of database layers so their query planner can use the indexes"""
+        start = time.perf_counter()
+        if target is not None:
+            connection = sqlite3.connect(target[0], isolation_level=None)
+            try:
+                connection.execute('ANALYZE {}'.format(self.quote(target[1])))
+            finally:
+                connection.close()
+        elif source.providerType() == 'postgres':
+            uri = QgsDataSourceUri(source.source())
+            metadata = QgsProviderRegistry.instance().providerMetadata('postgres')
+            connection = metadata.createConnection(source.source(), {})
+            connection.executeSql('ANALYZE {}.{}'.format(
+                self.quote(uri.schema() or 'public'), self.quote(uri.table())))
+        else:
+            feedback.pushInfo('Statistics are not supported for {} layers'.format(source.providerType()))
+            self.report.append(('statistics', 'statistics', 'skipped', 0.0))
+            return
+        feedback.pushInfo('Statistics collected')
+        self.report.append(('statistics', 'statistics', 'created', time.perf_counter() - start))
+
+    def selectFields(self, source, ratio, feedback):
+        """
+        Returns the fields of the data source with at least ratio * feature
+        count distinct values, plus the fields referenced by the layer filter
+        """
+        filtered = set()
+        if source.subsetString():
+            filtered = set(QgsExpression(source.subsetString()).referencedColumns())
+        count = source.featureCount()
+        limit = int(ratio * count)
+        selected = []
         fields = source.fields()
-        for field in fields.names():
-            feedback.pushInfo('Indexing field {}'.format(field))
-            params = {'INPUT': source,'FIELD': field}
-            processing.run("native:createattributeindex", params)
-        
-        return {self.OUTPUT: source.id()}
+        for index, field in enumerate(fields):
+            if feedback.isCanceled():
+                break
+            # Joined and virtual fields are not stored in the data source
+            if fields.fieldOrigin(index) != QgsFields.OriginProvider:
+                continue
+            if field.name() in filtered or limit <= 1:
+                selected.append(field.name())
+            # Reading distinct values stops as soon as the limit is reached.
+            # The layer maps its field index to the one of the provider.
+            elif len(source.uniqueValues(index, limit)) >= limit:
+                selected.append(field.name())
+            else:
+                feedback.pushInfo('Skipping low cardinality field {}'.format(field.name()))
+                self.report.append((field.name(), 'attribute', 'skipped', 0.0))
+        return selected
+
+    def sqliteTable(self, source):
+        """Returns the (database path, table name) of GeoPackage and SpatiaLite layers, or None"""
+        provider = source.providerType()
+        if provider == 'ogr' and source.dataProvider().storageType() == 'GPKG':
+            parts = QgsProviderRegistry.instance().decodeUri(provider, source.source())
+            if parts.get('path') and parts.get('layerName'):
+                return parts['path'], parts['layerName']
+        elif provider == 'spatialite':
+            uri = QgsDataSourceUri(source.source())
+            return uri.database(), uri.table()
+        return None
+
+    def createSqliteIndexes(self, path, table, fields, feedback):
+        """Creates the missing indexes over one connection, in a single transaction"""
+        connection = sqlite3.connect(path, isolation_level=None)
+        try:
+            indexed = self.indexedColumns(connection, table)
+            connection.execute('BEGIN')
+            try:
+                for current, field in enumerate(fields):
+                    if feedback.isCanceled():
+                        raise QgsProcessingException(self.tr('Cancelled, no index was created'))
+                    if field in indexed:
+                        feedback.pushInfo('Field {} is already indexed'.format(field))
+                        self.report.append((field, 'attribute', 'exists', 0.0))
+                        continue
+                    feedback.pushInfo('Indexing field {}'.format(field))
+                    start = time.perf_counter()
+                    connection.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                        self.quote('idx_{}_{}'.format(table, field)),
+                        self.quote(table), self.quote(field)))
+                    self.report.append((field, 'attribute', 'created', time.perf_counter() - start))
+                    feedback.setProgress(100 * (current + 1) / len(fields))
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        finally:
+            connection.close()
+
+    def indexedColumns(self, connection, table):
+        """
+        Returns the columns which are the first column of an index on the
+        table, or of its primary key. An INTEGER PRIMARY KEY (like the fid of
+        GeoPackages) is the rowid itself and has no entry in the index list.
+        """
+        columns = {row[1] for row in connection.execute(
+            'PRAGMA table_info({})'.format(self.quote(table))).fetchall() if row[5] == 1}
+        for row in connection.execute('PRAGMA index_list({})'.format(self.quote(table))).fetchall():
+            info = connection.execute('PRAGMA index_info({})'.format(self.quote(row[1]))).fetchall()
+            if info:
+                columns.add(min(info)[2])
+        return columns
 
+    def quote(self, identifier):
+        return '"{}"'.format(identifier.replace('"', '""'))
@@ -1,3 +1,6 @@
+import heapq
+import math
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtCore import QCoreApplication, QVariant
 from qgis.core import (QgsProcessing,
                        QgsProcessingFeatureBasedAlgorithm, 
@@ -6,27 +9,53 @@ from qgis.core import (QgsProcessing,
                        QgsFeatureRequest,
                        QgsFields,
                        QgsField,
-                       QgsFeatureSource,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterBoolean,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingException,
                        QgsFeature, 
-                       QgsWkbTypes)
+                       QgsFeatureSink,
+                       QgsGeometry,
+                       QgsRectangle,
+                       QgsSpatialIndex,
+                       NULL)
     
 
 class ConditionalSpatialJoin(QgsProcessingFeatureBasedAlgorithm):
     """
     This processing algorithm does a spatial join between an input polygon
-    layer and a point join layer. It finds all intersecting points within each 
-    polygon and transfer the chosen attribute based on values of another 
-    attribute. 
+    layer and a join layer of any geometry type. It finds all join features
+    matching each polygon with the chosen spatial predicate and transfer the
+    chosen attribute based on values of another attribute. 
     
     Example: Given a layer of urban areas and populated places, it can add the 
     name of the populated place having the highest population within each
     urban area.
     
     We are using QgsProcessingFeatureBasedAlgorithm which processes each
-    feature independently and can result in faster processing.
+    feature independently and can result in faster processing. The join layer
+    is read only once, into an in-memory spatial index, so each polygon is
+    matched against the index instead of issuing a new request to the join
+    layer's provider.
+
+    Optionally, several aggregates (count, sum, mean, top N and nearest to
+    the polygon centroid) can be computed from the same matching features and
+    appended as extra fields, so a single run serves every statistic.
+
+    With more than one thread, input polygons are read in batches, grouped
+    into spatial tiles and joined in a thread pool. All threads query the
+    same join index, which is only read once built, and the results are
+    written to the sink in input order.
     """
+    PREDICATES = ['Intersects', 'Contains', 'Within', 'Overlaps',
+                  'Largest Overlap Area']
+    INTERSECTS, CONTAINS, WITHIN, OVERLAPS, LARGEST_OVERLAP = range(5)
+    AGGREGATES = ['Count', 'Sum', 'Mean', 'Top N', 'Nearest to Centroid']
+    COUNT, SUM, MEAN, TOP_N, NEAREST = range(5)
+    # Number of input features read before dispatching tiles to the pool
+    BATCH_SIZE = 10000
+    # Number of tiles created per thread for each batch
+    TILES_PER_THREAD = 4
     
     def tr(self, string):
         return QCoreApplication.translate('Processing', string)
@@ -51,9 +80,15 @@ class ConditionalSpatialJoin(QgsProcessingFeatureBasedAlgorithm):
         
     def shortHelpString(self):
         return self.tr(
-            'This algorithm joins a vector polygon layer with a point layer '
-            'and adds an attribute from intersecting points based on value of '
-            'values of another attribute.')
+            'This algorithm joins a vector polygon layer with a point, line or '
+            'polygon layer and adds an attribute from the matching features '
+            'based on value of values of another attribute. Matching features '
+            'are those that intersect, are contained by, contain or overlap '
+            'each polygon. Additional aggregates of the matching features can '
+            'be added as extra fields in the same pass. With Largest Overlap '
+            'Area the attribute is taken from the intersecting feature with '
+            'the largest overlap instead of by the condition, and the '
+            'aggregates are computed over all intersecting features.')
     
     def __init__(self):
         super().__init__()
@@ -62,7 +97,7 @@ class ConditionalSpatialJoin(QgsProcessingFeatureBasedAlgorithm):
         return [QgsProcessing.TypeVectorPolygon]
         
     def outputWkbType(self, input_wkb_type):
-        return QgsWkbTypes.Polygon
+        return input_wkb_type
         
     def initParameters(self, config=None):
         # An input feature source named INPUT
@@ -74,8 +109,17 @@ class ConditionalSpatialJoin(QgsProcessingFeatureBasedAlgorithm):
             QgsProcessingParameterFeatureSource(
                 'JOIN',
                 'Join Layer',
-                [QgsProcessing.TypeVectorPoint]
+                [QgsProcessing.TypeVectorAnyGeometry]
                 ))        
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                'PREDICATE',
+                'Spatial Predicate',
+                self.PREDICATES,
+                False,
+                self.INTERSECTS
+                ))
                 
         self.addParameter(
             QgsProcessingParameterField(
@@ -101,22 +145,82 @@ class ConditionalSpatialJoin(QgsProcessingFeatureBasedAlgorithm):
                 None,
                 'JOIN'
                 ))
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                'AGGREGATES',
+                'Additional Aggregates',
+                self.AGGREGATES,
+                True,
+                optional=True
+                ))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'TOPN',
+                'Number of Values for Top N',
+                QgsProcessingParameterNumber.Integer,
+                3, False, 1
+                ))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'THREADS',
+                'Number of Threads',
+                QgsProcessingParameterNumber.Integer,
+                1, False, 1
+                ))
                 
                 
     def prepareAlgorithm(self, parameters, context, feedback):
         self.input_layer = self.parameterAsSource(parameters, 'INPUT', context)
         self.join_layer = self.parameterAsSource(parameters, 'JOIN', context)
         self.join_field = self.parameterAsString(parameters, 'JOINFIELD', context)
+        self.predicate = self.parameterAsEnum(parameters, 'PREDICATE', context)
         self.condition = self.parameterAsEnum(parameters, 'CONDITION', context)
         self.condition_field = self.parameterAsString(
             parameters, 'CONDITION_FIELD', context)
+        self.aggregates = sorted(
+            self.parameterAsEnums(parameters, 'AGGREGATES', context))
+        self.top_n = self.parameterAsInt(parameters, 'TOPN', context)
+        self.threads = self.parameterAsInt(parameters, 'THREADS', context)
+
+        join_fields = self.join_layer.fields()
+        condition_field = join_fields.at(
+            join_fields.lookupField(self.condition_field))
+        if (self.SUM in self.aggregates or self.MEAN in self.aggregates) \
+                and not condition_field.isNumeric():
+            raise QgsProcessingException(self.tr(
+                'Sum and Mean aggregates require a numeric condition attribute'))
         
-        # Warn if there is no spatial index
-        if self.join_layer.hasSpatialIndex() == QgsFeatureSource.SpatialIndexNotPresent:
-            feedback.pushWarning(self.tr(
-                'No spatial index exists for input layer, '
-                'performance will be severely degraded' ) )
+        self.buildJoinIndex(feedback)
         return super().prepareAlgorithm(parameters, context, feedback)
+
+    def buildJoinIndex(self, feedback):
+        """
+        Reads the join layer once, fetching only the join and condition
+        attributes, and keeps the geometry and values of each join feature
+        in memory alongside a spatial index of their bounding boxes.
+        """
+        feedback.pushInfo(self.tr('Indexing join layer'))
+        request = QgsFeatureRequest().setSubsetOfAttributes(
+            [self.join_field, self.condition_field], self.join_layer.fields())
+        total = self.join_layer.featureCount()
+        step = 100.0 / total if total else 0
+
+        self.join_index = QgsSpatialIndex()
+        self.join_records = {}
+        for current, f in enumerate(self.join_layer.getFeatures(request)):
+            if feedback.isCanceled():
+                break
+            if not f.hasGeometry():
+                continue
+            self.join_index.addFeature(f)
+            self.join_records[f.id()] = (
+                f.geometry(), f[self.join_field], f[self.condition_field])
+            feedback.setProgress(int(current * step))
+        feedback.pushInfo(self.tr(
+            'Indexed {} join features').format(len(self.join_records)))
     
     def outputFields(self, fields):
         join_layer_fields = self.join_layer.fields()
@@ -125,37 +229,235 @@ class ConditionalSpatialJoin(QgsProcessingFeatureBasedAlgorithm):
                 new_field = f
 
         fields.append(new_field)
+
+        for aggregate in self.aggregates:
+            if aggregate == self.COUNT:
+                fields.append(QgsField('join_count', QVariant.Int))
+            elif aggregate == self.SUM:
+                fields.append(QgsField(
+                    'sum_{}'.format(self.condition_field), QVariant.Double))
+            elif aggregate == self.MEAN:
+                fields.append(QgsField(
+                    'mean_{}'.format(self.condition_field), QVariant.Double))
+            elif aggregate == self.TOP_N:
+                fields.append(QgsField(
+                    'top{}_{}'.format(self.top_n, self.join_field),
+                    QVariant.String))
+            elif aggregate == self.NEAREST:
+                nearest_field = QgsField(new_field)
+                nearest_field.setName('nearest_{}'.format(self.join_field))
+                fields.append(nearest_field)
         return fields
         
     def processFeature(self, feature, context, feedback):
         geometry = feature.geometry()
-
-        # Get all intersecting point features
-        request = QgsFeatureRequest().setFilterRect(geometry.boundingBox())
-        intersecting_features = [
-          p
-          for p in self.join_layer.getFeatures(request) 
-          if p.geometry().intersects(geometry)
-        ]
-        if self.condition == 0:
-            intersecting_features.sort(
-                key=lambda x: x[self.condition_field], reverse=True)
-        elif self.condition == 1:
-            intersecting_features.sort(
-                key=lambda x: x[self.condition_field], reverse=False)
-        
-        if intersecting_features:
-            selected = intersecting_features[0]
-            new_attribute_value = selected[self.join_field]
-        else:
-            new_attribute_value = None
-        
         
         attributes = feature.attributes()
-        attributes.append(new_attribute_value)
+        attributes.extend(self.joinAttributes(geometry))
         
         # Create a new feature and set its attributes
         new_f = QgsFeature()
         new_f.setGeometry(geometry)
         new_f.setAttributes(attributes)
-        return [new_f]
\ No newline at end of file
+        return [new_f]
+
+    def processAlgorithm(self, parameters, context, feedback):
+        if self.threads <= 1:
+            return super().processAlgorithm(parameters, context, feedback)
+
+        source = self.parameterAsSource(parameters, 'INPUT', context)
+        sink, dest_id = self.parameterAsSink(
+            parameters,
+            'OUTPUT',
+            context,
+            self.outputFields(source.fields()),
+            self.outputWkbType(source.wkbType()),
+            source.sourceCrs()
+            )
+        feedback.pushInfo(self.tr(
+            'Joining tiles using {} threads').format(self.threads))
+
+        total = source.featureCount()
+        step = 100.0 / total if total else 0
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for current, feature in enumerate(source.getFeatures()):
+                if feedback.isCanceled():
+                    break
+                batch.append(feature)
+                if len(batch) == self.BATCH_SIZE:
+                    self.joinBatch(batch, executor, sink)
+                    batch = []
+                    feedback.setProgress(int((current + 1) * step))
+            if batch and not feedback.isCanceled():
+                self.joinBatch(batch, executor, sink)
+        return {'OUTPUT': dest_id}
+
+    def joinBatch(self, features, executor, sink):
+        """
+        Joins a batch of input features tile by tile in the executor and
+        writes them to the sink in their original order.
+        """
+        tiles = self.partition(features)
+        futures = [
+            executor.submit(self.joinTile, [features[i] for i in tile])
+            for tile in tiles
+            ]
+
+        results = [None] * len(features)
+        for tile, future in zip(tiles, futures):
+            for position, values in zip(tile, future.result()):
+                results[position] = values
+
+        for feature, values in zip(features, results):
+            attributes = feature.attributes()
+            attributes.extend(values)
+            new_f = QgsFeature()
+            new_f.setGeometry(feature.geometry())
+            new_f.setAttributes(attributes)
+            sink.addFeature(new_f, QgsFeatureSink.FastInsert)
+
+    def partition(self, features):
+        """
+        Groups the positions of the features in a regular grid over the extent
+        of the batch, based on the center of each feature's bounding box.
+        Returns the non-empty tiles as lists of positions.
+        """
+        extent = QgsRectangle()
+        extent.setMinimal()
+        centers = []
+        for feature in features:
+            if feature.hasGeometry():
+                center = feature.geometry().boundingBox().center()
+                extent.combineExtentWith(center.x(), center.y())
+            else:
+                center = None
+            centers.append(center)
+
+        cells = max(1, math.ceil(math.sqrt(
+            self.threads * self.TILES_PER_THREAD)))
+        width = extent.width() / cells or 1
+        height = extent.height() / cells or 1
+        tiles = {}
+        for position, center in enumerate(centers):
+            if center is None:
+                key = (0, 0)
+            else:
+                key = (min(int((center.x() - extent.xMinimum()) / width), cells - 1),
+                       min(int((center.y() - extent.yMinimum()) / height), cells - 1))
+            tiles.setdefault(key, []).append(position)
+        return list(tiles.values())
+
+    def joinTile(self, features):
+        """Joins the features of one tile against the shared join index"""
+        return [self.joinAttributes(f.geometry()) for f in features]
+
+    def joinAttributes(self, geometry):
+        """
+        Returns the join attribute of the matching feature with the highest
+        (or lowest) condition value, or of the feature with the largest
+        overlap, followed by the requested aggregates in the order of the
+        fields added by outputFields().
+        """
+        if geometry.isNull():
+            return [None] * (1 + len(self.aggregates))
+
+        highest = self.condition == 0
+        want_total = self.SUM in self.aggregates or self.MEAN in self.aggregates
+        want_top = self.TOP_N in self.aggregates
+        want_nearest = self.NEAREST in self.aggregates
+        if want_nearest:
+            centroid = geometry.centroid()
+
+        selected_value = None
+        selected_condition = None
+        count = 0
+        valid = 0
+        total = 0
+        ranked = []
+        nearest_value = None
+        nearest_distance = None
+        matches, largest = self.matchingRecords(geometry)
+        if largest is not None:
+            selected_value = largest[1]
+        for join_geometry, value, condition_value in matches:
+            count += 1
+            if want_nearest:
+                distance = centroid.distance(join_geometry)
+                if nearest_distance is None or distance < nearest_distance:
+                    nearest_distance = distance
+                    nearest_value = value
+            if condition_value == NULL:
+                continue
+            valid += 1
+            if want_total:
+                total += condition_value
+            if want_top:
+                ranked.append((condition_value, value))
+            if largest is None and (selected_condition is None
+                    or (highest and condition_value > selected_condition)
+                    or (not highest and condition_value < selected_condition)):
+                selected_condition = condition_value
+                selected_value = value
+
+        attributes = [selected_value]
+        for aggregate in self.aggregates:
+            if aggregate == self.COUNT:
+                attributes.append(count)
+            elif aggregate == self.SUM:
+                attributes.append(total if valid else None)
+            elif aggregate == self.MEAN:
+                attributes.append(total / valid if valid else None)
+            elif aggregate == self.TOP_N:
+                select = heapq.nlargest if highest else heapq.nsmallest
+                top = select(self.top_n, ranked, key=lambda x: x[0])
+                attributes.append(
+                    ','.join(str(v) for c, v in top) if top else None)
+            elif aggregate == self.NEAREST:
+                attributes.append(nearest_value)
+        return attributes
+
+    def matchingRecords(self, geometry):
+        """
+        Returns the records of the join features that match the polygon with
+        the chosen spatial predicate, and for the largest overlap predicate
+        the record with the largest overlap among all intersecting ones,
+        which are the matches. Otherwise the second value is None.
+        """
+        # Prepare the polygon once, then test every candidate from the index.
+        # Candidates are visited in feature id order so that ties resolve to
+        # the same feature as a sorted scan of the join layer would.
+        engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+        engine.prepareGeometry()
+        bbox = geometry.boundingBox()
+
+        matches = []
+        largest = None
+        largest_overlap = None
+        for fid in sorted(self.join_index.intersects(bbox)):
+            record = self.join_records[fid]
+            join_geometry = record[0]
+            candidate = join_geometry.constGet()
+            # Bounding box checks reject most candidates before GEOS is used
+            if self.predicate == self.CONTAINS:
+                if bbox.contains(join_geometry.boundingBox()) \
+                        and engine.contains(candidate):
+                    matches.append(record)
+            elif self.predicate == self.WITHIN:
+                if join_geometry.boundingBox().contains(bbox) \
+                        and engine.within(candidate):
+                    matches.append(record)
+            elif self.predicate == self.OVERLAPS:
+                if engine.overlaps(candidate):
+                    matches.append(record)
+            elif engine.intersects(candidate):
+                matches.append(record)
+                if self.predicate == self.LARGEST_OVERLAP:
+                    overlap = engine.intersection(candidate)
+                    if overlap is None:
+                        continue
+                    measure = overlap.area() or overlap.length()
+                    if largest_overlap is None or measure > largest_overlap:
+                        largest_overlap = measure
+                        largest = record
+        return matches, largest
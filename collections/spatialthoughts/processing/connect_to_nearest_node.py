@@ -0,0 +1,185 @@
+from PyQt5.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsProcessingFeatureBasedAlgorithm,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterDistance,
+                       QgsProcessingUtils,
+                       QgsFeatureRequest,
+                       QgsFields,
+                       QgsField,
+                       QgsFeature,
+                       QgsGeometry,
+                       QgsPointXY,
+                       QgsSpatialIndex,
+                       QgsWkbTypes)
+
+
+class ConnectToNearestNode(QgsProcessingFeatureBasedAlgorithm):
+    """
+    This processing algorithm connects every input feature to its nearest
+    features of a node layer (typically roads) with straight connector lines.
+
+    Polygons and lines are connected from the midpoint of their edge which
+    is closest to the node, points from the point itself. This replaces the
+    Connect to Nearest Node model (polygons to lines, explode lines,
+    centroids, shortest line, rank and extract) with a single pass which
+    writes no intermediate layers.
+
+    The node layer is read only once, into a spatial index which also stores
+    the geometries, so the nearest neighbor search uses the exact distance
+    to the node geometries.
+    """
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ConnectToNearestNode()
+
+    def name(self):
+        return 'connect_to_nearest_node'
+
+    def displayName(self):
+        return self.tr('Connect to Nearest Node')
+
+    def group(self):
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        return ''
+
+    def outputName(self):
+        return self.tr('Connectors')
+
+    def shortHelpString(self):
+        return self.tr('Connects every input feature to the nearest features '
+                       'of the node layer with a straight line. Polygons and '
+                       'lines are connected from the midpoint of their edge '
+                       'closest to the node. Each connector gets the attributes '
+                       'of the input feature and of the node, the node feature '
+                       'id, the rank of the node and the length of the line.')
+
+    def inputLayerTypes(self):
+        return [QgsProcessing.TypeVectorAnyGeometry]
+
+    def outputWkbType(self, input_wkb_type):
+        return QgsWkbTypes.LineString
+
+    def initParameters(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                'NODES',
+                self.tr('Node layer'),
+                [QgsProcessing.TypeVectorAnyGeometry]))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'NEIGHBORS',
+                self.tr('Number of nearest nodes'),
+                QgsProcessingParameterNumber.Integer,
+                1, False, 1))
+
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'MAX_DISTANCE',
+                self.tr('Maximum distance (0 for no limit)'),
+                0.0, 'INPUT', False, 0.0))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, 'INPUT', context)
+        self.nodes = self.parameterAsSource(parameters, 'NODES', context)
+        self.neighbors = self.parameterAsInt(parameters, 'NEIGHBORS', context)
+        self.max_distance = self.parameterAsDouble(parameters, 'MAX_DISTANCE', context)
+        self.buildNodeIndex(source.sourceCrs(), context, feedback)
+        return super().prepareAlgorithm(parameters, context, feedback)
+
+    def buildNodeIndex(self, crs, context, feedback):
+        """
+        Reads the node layer once, in the CRS of the input layer, into a
+        spatial index keeping the geometries, and keeps the node attributes.
+        """
+        feedback.pushInfo(self.tr('Indexing node layer'))
+        request = QgsFeatureRequest().setDestinationCrs(crs, context.transformContext())
+        total = self.nodes.featureCount()
+        step = 100.0 / total if total else 0
+
+        self.node_index = QgsSpatialIndex(QgsSpatialIndex.FlagStoreFeatureGeometries)
+        self.node_attributes = {}
+        for current, f in enumerate(self.nodes.getFeatures(request)):
+            if feedback.isCanceled():
+                break
+            if not f.hasGeometry():
+                continue
+            self.node_index.addFeature(f)
+            self.node_attributes[f.id()] = f.attributes()
+            feedback.setProgress(int(current * step))
+        feedback.pushInfo(self.tr(
+            'Indexed {} nodes').format(len(self.node_attributes)))
+
+    def outputFields(self, fields):
+        new_fields = QgsFields()
+        new_fields.append(QgsField('node_id', QVariant.LongLong))
+        new_fields.append(QgsField('rank', QVariant.Int))
+        new_fields.append(QgsField('distance', QVariant.Double))
+        return QgsProcessingUtils.combineFields(
+            QgsProcessingUtils.combineFields(fields, self.nodes.fields()), new_fields)
+
+    def processFeature(self, feature, context, feedback):
+        geometry = feature.geometry()
+        if geometry.isEmpty():
+            return []
+        starts = [QgsGeometry.fromPointXY(point) for point in self.startPoints(geometry)]
+        # The index ranks nodes by their distance to the whole feature, which
+        # is never more than the length of their connector from an edge
+        # midpoint. So once the nearest nodes give a k-th best connector
+        # length, every node with a shorter connector lies within that length
+        # of the feature and a second search over that distance finds them all.
+        connectors = self.connectors(
+            starts, self.node_index.nearestNeighbor(geometry, self.neighbors, self.max_distance))
+        if len(connectors) >= self.neighbors:
+            limit = connectors[self.neighbors - 1][0]
+        else:
+            limit = self.max_distance
+        if limit:
+            candidates = self.node_index.intersects(geometry.boundingBox().buffered(limit))
+            connectors = self.connectors(starts, candidates)
+
+        out_features = []
+        for rank, (distance, fid, line) in enumerate(connectors[:self.neighbors]):
+            out_f = QgsFeature()
+            out_f.setGeometry(line)
+            out_f.setAttributes(feature.attributes() + self.node_attributes[fid] +
+                                [fid, rank + 1, distance])
+            out_features.append(out_f)
+        return out_features
+
+    def connectors(self, starts, candidates):
+        """
+        Returns the (length, node id, line) of the shortest line from the
+        closest start point to every candidate node, ordered by length.
+        """
+        connectors = []
+        for fid in candidates:
+            node_geometry = self.node_index.geometry(fid)
+            line = min((start.shortestLine(node_geometry) for start in starts),
+                       key=lambda line: line.length())
+            if self.max_distance and line.length() > self.max_distance:
+                continue
+            connectors.append((line.length(), fid, line))
+        connectors.sort(key=lambda connector: connector[:2])
+        return connectors
+
+    def startPoints(self, geometry):
+        """The points of point geometries, or the midpoints of the edges of lines and polygons"""
+        if QgsWkbTypes.isCurvedType(geometry.wkbType()):
+            geometry = QgsGeometry(geometry.constGet().segmentize())
+        if geometry.type() == QgsWkbTypes.PointGeometry:
+            return [QgsPointXY(vertex) for vertex in geometry.vertices()]
+        if geometry.type() == QgsWkbTypes.PolygonGeometry:
+            geometry = QgsGeometry(geometry.constGet().boundary())
+        points = []
+        for part in geometry.constParts():
+            vertices = [QgsPointXY(vertex) for vertex in part.vertices()]
+            for a, b in zip(vertices[:-1], vertices[1:]):
+                points.append(QgsPointXY((a.x() + b.x()) / 2, (a.y() + b.y()) / 2))
+        return points or [geometry.centroid().asPoint()]
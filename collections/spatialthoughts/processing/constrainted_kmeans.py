@@ -1,12 +1,16 @@
 import networkx as nx
 import numpy as np
-from itertools import groupby
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PyQt5.QtCore import QCoreApplication, QVariant
 
 from qgis.core import (QgsProcessing, QgsProcessingAlgorithm, 
     QgsProcessingParameterFeatureSource, QgsProcessingParameterNumber,
-    QgsProcessingParameterFeatureSink,QgsFields, QgsField, QgsWkbTypes,
-    QgsFeatureSink, QgsProcessingUtils)
+    QgsProcessingParameterFeatureSink, QgsProcessingParameterEnum,
+    QgsProcessingParameterField,
+    QgsFields, QgsField, QgsWkbTypes, QgsFeatureSink, QgsProcessingUtils,
+    QgsProcessingException, QgsProcessingMultiStepFeedback, QgsFeatureRequest,
+    NULL)
 
 
 class ConstrainedKMeansAlgorithm(QgsProcessingAlgorithm):
@@ -14,7 +18,18 @@ class ConstrainedKMeansAlgorithm(QgsProcessingAlgorithm):
     INPUT = 'INPUT'
     CLUSTERS = 'CLUSTERS'
     MINPOINTS = 'MINPOINTS'
+    MAXPOINTS = 'MAXPOINTS'
+    WEIGHT_FIELD = 'WEIGHT_FIELD'
+    CAPACITY = 'CAPACITY'
+    SOLVER = 'SOLVER'
+    MAX_ITERATIONS = 'MAX_ITERATIONS'
+    TOLERANCE = 'TOLERANCE'
+    RESTARTS = 'RESTARTS'
+    THREADS = 'THREADS'
+    SEED = 'SEED'
     OUTPUT = 'OUTPUT'
+    SOLVERS = ['Minimum Cost Flow (exact, small inputs)',
+               'Price Based Assignment (scalable)']
 
     
     def initAlgorithm(self, config=None):
@@ -43,6 +58,90 @@ class ConstrainedKMeansAlgorithm(QgsProcessingAlgorithm):
                 1, False, 1
             )
         )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAXPOINTS,
+                self.tr('Maximum Number of Points per Cluster (0 for no limit)'),
+                QgsProcessingParameterNumber.Integer,
+                0, False, 0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.WEIGHT_FIELD,
+                self.tr('Weight Field'),
+                parentLayerParameterName=self.INPUT,
+                type=QgsProcessingParameterField.Numeric,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CAPACITY,
+                self.tr('Maximum Total Weight per Cluster (0 for no limit)'),
+                QgsProcessingParameterNumber.Double,
+                0, False, 0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.SOLVER,
+                self.tr('Assignment Solver'),
+                self.SOLVERS,
+                False,
+                0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_ITERATIONS,
+                self.tr('Maximum Number of Iterations'),
+                QgsProcessingParameterNumber.Integer,
+                5, False, 1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.TOLERANCE,
+                self.tr('Stop When Centers Move Less Than (layer units)'),
+                QgsProcessingParameterNumber.Double,
+                0, False, 0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.RESTARTS,
+                self.tr('Number of Restarts'),
+                QgsProcessingParameterNumber.Integer,
+                1, False, 1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.THREADS,
+                self.tr('Number of Threads'),
+                QgsProcessingParameterNumber.Integer,
+                1, False, 1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SEED,
+                self.tr('Random Seed'),
+                QgsProcessingParameterNumber.Integer,
+                optional=True,
+                minValue=0
+            )
+        )
         
         
         self.addParameter(
@@ -57,11 +156,25 @@ class ConstrainedKMeansAlgorithm(QgsProcessingAlgorithm):
         source= self.parameterAsSource(parameters, self.INPUT, context)
         k = self.parameterAsInt(parameters, self.CLUSTERS, context)
         minpoints = self.parameterAsInt(parameters, self.MINPOINTS, context)
+        maxpoints = self.parameterAsInt(parameters, self.MAXPOINTS, context)
+        weight_field = self.parameterAsString(parameters, self.WEIGHT_FIELD, context)
+        capacity = self.parameterAsDouble(parameters, self.CAPACITY, context)
+        solver = ('flow', 'prices')[
+            self.parameterAsEnum(parameters, self.SOLVER, context)]
+        maxiter = self.parameterAsInt(parameters, self.MAX_ITERATIONS, context)
+        tolerance = self.parameterAsDouble(parameters, self.TOLERANCE, context)
+        restarts = self.parameterAsInt(parameters, self.RESTARTS, context)
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        seed = None
+        if parameters.get(self.SEED) is not None:
+            seed = self.parameterAsInt(parameters, self.SEED, context)
         
         outputFields = source.fields()
         newFields = QgsFields()
         newFields.append(QgsField('CLUSTER_ID', QVariant.Int))
         newFields.append(QgsField('CLUSTER_SIZE', QVariant.Int))
+        if weight_field:
+            newFields.append(QgsField('CLUSTER_WEIGHT', QVariant.Double))
 
         outputFields = QgsProcessingUtils.combineFields(outputFields, newFields)
         sink, dest_id = self.parameterAsSink(
@@ -72,41 +185,153 @@ class ConstrainedKMeansAlgorithm(QgsProcessingAlgorithm):
             source.wkbType(),
             source.sourceCrs()
             )
+        steps = QgsProcessingMultiStepFeedback(3, feedback)
         feedback.pushInfo(self.tr( "Collecting input points"))
         
-        features = [f for f in source.getFeatures()]
-        data = []
-        for f in features:
+        # First pass: only ids, centroid coordinates and weights are kept, in
+        # compact typed arrays, so memory does not grow with the attributes
+        request = QgsFeatureRequest()
+        if weight_field:
+            request.setSubsetOfAttributes([weight_field], source.fields())
+        else:
+            request.setNoAttributes()
+        ids = array('q')
+        coords = array('d')
+        weights = array('d')
+        total = 100.0 / source.featureCount() if source.featureCount() else 0
+        for current, f in enumerate(source.getFeatures(request)):
+            if feedback.isCanceled():
+                return {}
             geometry = f.geometry()
-            if geometry.wkbType() == QgsWkbTypes.Point:
-                point = geometry
+            if geometry.isEmpty():
+                continue
+            if QgsWkbTypes.flatType(geometry.wkbType()) == QgsWkbTypes.Point:
+                point = geometry.asPoint()
             else:
-                point = geometry.centroid()
-            
-            data.append([point.asPoint().x(), point.asPoint().y()])
+                point = geometry.centroid().asPoint()
+            ids.append(f.id())
+            coords.append(point.x())
+            coords.append(point.y())
+            if weight_field:
+                weight = f[weight_field]
+                weights.append(0.0 if weight == NULL else float(weight))
+            steps.setProgress(int(current * total))
+        ids = np.frombuffer(ids, dtype=np.int64)
+        data = np.frombuffer(coords, dtype=float).reshape(-1, 2)
+        weights = np.frombuffer(weights, dtype=float)
         
         feedback.pushInfo(self.tr( "Input ready"))
+        if k * minpoints > len(data):
+            raise QgsProcessingException(self.tr(
+                'Cannot create {} clusters of at least {} points from {} '
+                'features').format(k, minpoints, len(data)))
+        if maxpoints and maxpoints < minpoints:
+            raise QgsProcessingException(self.tr(
+                'The maximum number of points per cluster is smaller than the minimum'))
+        if maxpoints and k * maxpoints < len(data):
+            raise QgsProcessingException(self.tr(
+                'Cannot split {} features into {} clusters of at most {} '
+                'points').format(len(data), k, maxpoints))
+        if capacity and not weight_field:
+            raise QgsProcessingException(self.tr(
+                'A weight field is required for the maximum total weight'))
+        if capacity:
+            if weights.min() < 0:
+                raise QgsProcessingException(self.tr('Weights cannot be negative'))
+            if weights.max() > capacity:
+                raise QgsProcessingException(self.tr(
+                    'A feature weighs {} which is more than the maximum total '
+                    'weight per cluster').format(weights.max()))
+            if weights.sum() > k * capacity:
+                raise QgsProcessingException(self.tr(
+                    'The total weight {} does not fit in {} clusters of at most '
+                    '{}').format(weights.sum(), k, capacity))
+            if solver == 'flow':
+                raise QgsProcessingException(self.tr(
+                    'The maximum total weight per cluster requires the price '
+                    'based solver'))
         feedback.pushInfo(self.tr( "Computing clusters"))
 
+        steps.setCurrentStep(1)
         demand = [minpoints] * k
-        C, M, f = constrained_kmeans(data, demand, maxiter=5)
+        limit = [maxpoints] * k if maxpoints else None
+        # Independent random streams per restart, reproducible from the seed
+        seeds = np.random.SeedSequence(seed).spawn(restarts)
+        best = None
+        with ThreadPoolExecutor(max_workers=min(threads, restarts)) as pool:
+            futures = [pool.submit(
+                constrained_kmeans, data, demand, maxiter=maxiter, solver=solver,
+                limit=limit, weights=weights if capacity else None,
+                capacity=[capacity] * k if capacity else None,
+                tol=tolerance, seed=restart_seed, feedback=steps)
+                for restart_seed in seeds]
+            for done, future in enumerate(as_completed(futures)):
+                C, M, f = future.result()
+                cost = clustering_cost(data, C, M)
+                feedback.pushInfo(self.tr('Restart {} of {}: total distance {:.6f}')
+                                  .format(done + 1, restarts, cost))
+                if best is None or cost < best[0]:
+                    best = (cost, M)
+                steps.setProgress(100 * (done + 1) / restarts)
+        if feedback.isCanceled():
+            return {}
+        M = best[1]
         feedback.pushInfo(self.tr( "Clusters ready"))
 
         # M is the cluster assignment for the data points
         # Compute cluster sizes
-        sorted_M = np.sort(M)
-        sizes = [len(list(group)) for key, group in groupby(sorted_M)]
-    
-        
-        for index, out_f in enumerate(features):
+        sizes = np.bincount(M, minlength=k)
+        if weight_field:
+            loads = np.bincount(M, weights=weights, minlength=k)
+        # The repair step can run out of points to move, so check the limits
+        violations = []
+        if (sizes < minpoints).any():
+            violations.append(self.tr('{} clusters have less than {} points').format(
+                np.count_nonzero(sizes < minpoints), minpoints))
+        if maxpoints and (sizes > maxpoints).any():
+            violations.append(self.tr('{} clusters have more than {} points').format(
+                np.count_nonzero(sizes > maxpoints), maxpoints))
+        if capacity and (loads > capacity * (1 + 1e-9)).any():
+            violations.append(self.tr('{} clusters weigh more than {}').format(
+                np.count_nonzero(loads > capacity * (1 + 1e-9)), capacity))
+        if violations:
+            raise QgsProcessingException(self.tr('Cluster limits not met: {}').format(
+                '; '.join(violations)))
+
+        # Second pass: features are read again and written one at a time.
+        # Providers normally return them in the same order as the first pass,
+        # otherwise the position of the id is looked up in the sorted ids.
+        steps.setCurrentStep(2)
+        order = np.argsort(ids, kind='stable')
+        sorted_ids = ids[order]
+        position = 0
+        for current, out_f in enumerate(source.getFeatures()):
+            if feedback.isCanceled():
+                break
             attributes = out_f.attributes()
-            cluster_id = M[index].item()
-            attributes.append(cluster_id + 1)
-            attributes.append(sizes[cluster_id])
+            if position < len(ids) and ids[position] == out_f.id():
+                index = position
+            else:
+                found = np.searchsorted(sorted_ids, out_f.id())
+                if found < len(ids) and sorted_ids[found] == out_f.id():
+                    index = order[found]
+                else:
+                    index = None
+            if index is None:
+                # Features without geometry are not clustered
+                attributes.extend([NULL] * newFields.count())
+            else:
+                position = index + 1
+                cluster_id = M[index].item()
+                attributes.append(cluster_id + 1)
+                attributes.append(sizes[cluster_id].item())
+                if weight_field:
+                    attributes.append(loads[cluster_id].item())
 
             out_f.setAttributes(attributes)
             sink.addFeature(out_f, QgsFeatureSink.FastInsert)
-        return {self.OUTPUT: sink} 
+            steps.setProgress(int(current * total))
+        return {self.OUTPUT: dest_id}
 
     def name(self):
         return 'constrained_kmeans'
@@ -115,7 +340,22 @@ class ConstrainedKMeansAlgorithm(QgsProcessingAlgorithm):
         return self.tr('Constrained K-Means Clustering')
         
     def shortHelpString(self):
-        return self.tr('Constrained K-Means Clustering algorithm PyQGIS implementation')
+        return self.tr('Constrained K-Means Clustering algorithm PyQGIS implementation. '
+                       'The minimum cost flow solver is exact but builds a graph '
+                       'with an edge between every point and every cluster, so it '
+                       'is only practical for a few thousand points. The price '
+                       'based solver computes distances in chunks and scales to '
+                       'hundreds of thousands of points, while still guaranteeing '
+                       'the minimum cluster size.\n'
+                       'Clusters can also be limited to a maximum number of '
+                       'points and, with the price based solver, to a maximum '
+                       'total of a weight field such as the number of visits. '
+                       'When the clusters cannot be made to meet these limits, '
+                       'the algorithm fails instead of writing them.\n'
+                       'Initial centers are chosen with k-means++. Several restarts '
+                       'can run in parallel threads and the one with the smallest '
+                       'total distance is kept. Set a random seed for repeatable '
+                       'results.')
 
     def group(self):
         return self.tr(self.groupId())
@@ -130,50 +370,22 @@ class ConstrainedKMeansAlgorithm(QgsProcessingAlgorithm):
         return ConstrainedKMeansAlgorithm()
 
 # Code adapted from https://adared.ch/constrained-k-means-implementation-in-python/
-def constrained_kmeans(data, demand, maxiter=None, fixedprec=1e9):
-  data = np.array(data)
-  
-  min_ = np.min(data, axis = 0)
-  max_ = np.max(data, axis = 0)
+def constrained_kmeans(data, demand, maxiter=None, fixedprec=1e9, solver='flow',
+                       limit=None, weights=None, capacity=None, tol=0, seed=None,
+                       feedback=None):
+  data = np.asarray(data, dtype=float)
   
-  C = min_ + np.random.random((len(demand), data.shape[1])) * (max_ - min_)
-  M = np.array([-1] * len(data), dtype=np.int)
+  C = kmeans_plusplus(data, len(demand), np.random.default_rng(seed))
+  M = np.array([-1] * len(data), dtype=int)
   
   itercnt = 0
   while True:
     itercnt += 1
-    print(data)
-    print(itercnt)
     # memberships
-    g = nx.DiGraph()
-    g.add_nodes_from(range(0, data.shape[0]), demand=-1) # points
-    for i in range(0, len(C)):
-      g.add_node(len(data) + i, demand=demand[i])
-    # Calculating cost...
-    print('Cost')
-    cost = np.array([np.linalg.norm(np.tile(data.T, len(C)).T - np.tile(C, len(data)).reshape(len(C) * len(data), C.shape[1]), axis=1)])
-    # Preparing data_to_C_edges...
-    data_to_C_edges = np.concatenate((np.tile([range(0, data.shape[0])],
-    len(C)).T, np.tile(np.array([range(data.shape[0], data.shape[0] +
-    C.shape[0])]).T, len(data)).reshape(len(C) * len(data), 1), cost.T *
-    fixedprec), axis=1).astype(np.uint64) # Adding to graph
-    g.add_weighted_edges_from(data_to_C_edges)
-    
-
-    a = len(data) + len(C)
-    g.add_node(a, demand=len(data)-np.sum(demand))
-    C_to_a_edges = np.concatenate((np.array([range(len(data), len(data) + len(C))]).T, np.tile([[a]], len(C)).T), axis=1)
-    g.add_edges_from(C_to_a_edges)
-    
-    print('Flow')
-    # Calculating min cost flow...
-    f = nx.min_cost_flow(g)
-    print('Flow Done')
-    # assign
-    M_new = np.ones(len(data), dtype=np.int) * -1
-    for i in range(len(data)):
-      p = sorted(f[i].items(), key=lambda x: x[1])[-1][0]
-      M_new[i] = p - len(data)
+    if solver == 'prices':
+      M_new, f = price_assignment(data, C, demand, limit, weights, capacity)
+    else:
+      M_new, f = flow_assignment(data, C, demand, fixedprec, limit)
       
     # stop condition
     if np.all(M_new == M):
@@ -183,9 +395,415 @@ def constrained_kmeans(data, demand, maxiter=None, fixedprec=1e9):
     M = M_new
       
     # compute new centers
-    for i in range(len(C)):
+    previous = C.copy()
+    sizes = np.bincount(M, minlength=len(C))
+    for i in np.flatnonzero(sizes):
       C[i, :] = np.mean(data[M==i, :], axis=0)
+    # Empty clusters restart from the points farthest from their centers
+    if (sizes == 0).any():
+      distance = np.linalg.norm(data - C[M], axis=1)
+      for i in np.flatnonzero(sizes == 0):
+        farthest = np.argmax(distance)
+        C[i, :] = data[farthest]
+        distance[farthest] = -1
+    shift = np.max(np.linalg.norm(C - previous, axis=1))
+    if feedback is not None:
+      feedback.pushDebugInfo('Iteration {}: centers moved up to {:.6f}'.format(itercnt, shift))
+      
+    if shift <= tol:
+      # Converged
+      return (C, M, f)
       
     if maxiter is not None and itercnt >= maxiter:
       # Max iterations reached
-      return (C, M, f)
\ No newline at end of file
+      return (C, M, f)
+
+    if feedback is not None and feedback.isCanceled():
+      return (C, M, f)
+
+
+def kmeans_plusplus(data, k, rng):
+  """Picks k initial centers, each with probability proportional to its squared distance to the centers picked before"""
+  C = np.empty((k, data.shape[1]))
+  C[0] = data[rng.integers(len(data))]
+  closest = ((data - C[0]) ** 2).sum(axis=1)
+  for i in range(1, k):
+    total = closest.sum()
+    if total > 0:
+      C[i] = data[rng.choice(len(data), p=closest / total)]
+    else:
+      C[i] = data[rng.integers(len(data))]
+    closest = np.minimum(closest, ((data - C[i]) ** 2).sum(axis=1))
+  return C
+
+
+def clustering_cost(data, C, M):
+  """Total distance between the points and their assigned centers"""
+  return np.linalg.norm(data - C[M], axis=1).sum()
+
+
+def flow_assignment(data, C, demand, fixedprec=1e9, limit=None):
+  """Assigns points to centers by solving a min cost flow over all point-center edges.
+  Sizes above the demand flow on to the artificial sink, so an upper limit is
+  the capacity of the edge from the center to the sink."""
+  g = nx.DiGraph()
+  g.add_nodes_from(range(0, data.shape[0]), demand=-1) # points
+  for i in range(0, len(C)):
+    g.add_node(len(data) + i, demand=demand[i])
+  # Calculating cost...
+  cost = np.array([np.linalg.norm(np.tile(data.T, len(C)).T - np.tile(C, len(data)).reshape(len(C) * len(data), C.shape[1]), axis=1)])
+  # Preparing data_to_C_edges...
+  data_to_C_edges = np.concatenate((np.tile([range(0, data.shape[0])],
+  len(C)).T, np.tile(np.array([range(data.shape[0], data.shape[0] +
+  C.shape[0])]).T, len(data)).reshape(len(C) * len(data), 1), cost.T *
+  fixedprec), axis=1).astype(np.int64) # Adding to graph
+  g.add_weighted_edges_from(data_to_C_edges)
+  
+
+  a = len(data) + len(C)
+  g.add_node(a, demand=int(len(data) - np.sum(demand)))
+  C_to_a_edges = np.concatenate((np.array([range(len(data), len(data) + len(C))]).T, np.tile([[a]], len(C)).T), axis=1)
+  g.add_edges_from(C_to_a_edges)
+  if limit is not None:
+    for i in range(len(C)):
+      g[len(data) + i][a]['capacity'] = limit[i] - demand[i]
+  
+  # Calculating min cost flow...
+  f = nx.min_cost_flow(g)
+  # assign
+  M = np.ones(len(data), dtype=int) * -1
+  for i in range(len(data)):
+    p = sorted(f[i].items(), key=lambda x: x[1])[-1][0]
+    M[i] = p - len(data)
+  return (M, f)
+
+
+# Number of point-center distances computed at once by the price solver
+CHUNK_ELEMENTS = 2 ** 22
+
+def center_distances(data, C):
+  """Yields (start, distances) blocks of rows of the point-center distance matrix"""
+  chunk = max(1, CHUNK_ELEMENTS // len(C))
+  for start in range(0, len(data), chunk):
+    block = data[start:start + chunk]
+    yield start, np.sqrt(((block[:, np.newaxis, :] - C[np.newaxis, :, :]) ** 2).sum(axis=2))
+
+
+def candidate_centers(data, C, m):
+  """Returns the indices and distances of the m nearest centers of every point"""
+  n, k = len(data), len(C)
+  m = min(m, k)
+  index = np.empty((n, m), dtype=int)
+  dist = np.empty((n, m))
+  for start, d in center_distances(data, C):
+    stop = start + len(d)
+    if m < k:
+      nearest = np.argpartition(d, m - 1, axis=1)[:, :m]
+    else:
+      nearest = np.tile(np.arange(k), (len(d), 1))
+    index[start:stop] = nearest
+    dist[start:stop] = np.take_along_axis(d, nearest, axis=1)
+  return index, dist
+
+
+def price_assignment(data, C, demand, limit=None, weights=None, capacity=None,
+                     candidates=8, levels=6, final=1e-3, maxiter=50):
+  """
+  Assigns points to centers with minimum cluster sizes by pricing the centers.
+  Every point goes to the center minimizing distance minus price, so only k
+  prices have to be found instead of a flow over n * k edges. Each point is
+  only connected to its nearest candidate centers, and more candidates are
+  taken when a point would prefer a center outside them at the current
+  prices.
+  The prices maximize the entropy regularized dual of the assignment, at
+  temperatures lowered from the median nearest center distance down to
+  `final` times that distance. At every temperature the dual is smooth and
+  concave in the k prices, so Newton's method runs until its decrement is
+  negligible, starting from the prices of the previous temperature.
+  A center short of its demand gets a positive price, a center above its
+  size limit a negative one, and any other center a price of zero. Weight
+  capacities get a second price per center, charged per unit of weight.
+  Clusters still outside their bounds afterwards are repaired greedily, so
+  the minimum sizes are always guaranteed.
+  """
+  n, k = len(data), len(C)
+  demand = np.asarray(demand)
+  # Point weights only matter with capacities
+  point_weights = np.asarray(weights, dtype=float) if capacity is not None else None
+  # Bounds of the dual terms min(low * price, high * price): the demand and
+  # the limit for the size prices, and minus the capacity and zero for the
+  # weight prices, which are only positive at full capacity
+  low = np.asarray(demand, dtype=float)
+  high = np.asarray(limit, dtype=float) if limit is not None else np.full(k, np.inf)
+  if capacity is not None:
+    low = np.concatenate([low, -np.asarray(capacity, dtype=float)])
+    high = np.concatenate([high, np.zeros(k)])
+  prices = np.zeros(len(low))
+  m = min(candidates, k)
+  index, dist = candidate_centers(data, C, m)
+  scale = np.median(dist.min(axis=1))
+  if scale <= 0:
+    scale = 1.0
+  temperatures = scale * np.geomspace(1.0, final, levels)
+  level = 0
+  while level < levels:
+    solved, converged = newton_prices(
+      dist, index, point_weights, prices, low, high, temperatures[level], maxiter)
+    # Without enough candidates the bounds cannot be met and the prices do
+    # not converge, and at the last temperature no point may prefer a center
+    # outside its candidates. Otherwise the temperatures are lowered again
+    # from the start with twice as many candidates.
+    if m < k and (not converged or level == levels - 1 and outside_candidates(
+        data, C, index, dist, solved, point_weights)):
+      m = min(2 * m, k)
+      index, dist = candidate_centers(data, C, m)
+      level = 0
+      continue
+    prices = solved
+    level += 1
+
+  reduced = reduced_costs(dist, index, point_weights, prices)
+  M = index[np.arange(n), reduced.argmin(axis=1)]
+  return (repair_assignment(data, C, M, demand, limit, weights, capacity), prices[:k])
+
+
+def reduced_costs(dist, index, weights, prices):
+  """Distance minus the size price, plus the weight price times the weight, of every candidate"""
+  k = len(prices) // 2 if weights is not None else len(prices)
+  reduced = dist - prices[:k][index]
+  if weights is not None:
+    reduced += prices[k:][index] * weights[:, np.newaxis]
+  return reduced
+
+
+def dual_value(dist, index, weights, prices, tau, derivatives=False):
+  """
+  The sum over the points of the soft minimum of their reduced costs at the
+  temperature tau, the smooth part of the regularized dual, and optionally
+  its gradient and its negated Hessian with respect to the prices
+  """
+  reduced = reduced_costs(dist, index, weights, prices)
+  nearest = reduced.min(axis=1, keepdims=True)
+  e = np.exp(-(reduced - nearest) / tau)
+  total = e.sum(axis=1, keepdims=True)
+  objective = (nearest[:, 0] - tau * np.log(total[:, 0])).sum()
+  if not derivatives:
+    return objective
+
+  # Soft assignment of every point to its candidate centers, scattered to
+  # dense rows in chunks so that the outer products of the Hessian add up
+  # in a matrix product
+  w = e / total
+  n, dim = len(dist), len(prices)
+  k = dim // 2 if weights is not None else dim
+  sizes = np.zeros(k)
+  loads = np.zeros(k)
+  squares = np.zeros(k)
+  outer = np.zeros((dim, dim))
+  chunk = max(1, CHUNK_ELEMENTS // dim)
+  for start in range(0, n, chunk):
+    block = w[start:start + chunk]
+    V = np.zeros((len(block), dim))
+    V[np.arange(len(block))[:, np.newaxis], index[start:start + chunk]] = block
+    sizes += V[:, :k].sum(axis=0)
+    if weights is not None:
+      # The reduced costs fall with the size prices and rise with the
+      # weight prices, in proportion to the weight of the point
+      V[:, k:] = -V[:, :k] * weights[start:start + chunk, np.newaxis]
+      loads -= V[:, k:].sum(axis=0)
+      squares -= (V[:, k:] * weights[start:start + chunk, np.newaxis]).sum(axis=0)
+    outer += V.T @ V
+
+  gradient = np.concatenate([-sizes, loads]) if weights is not None else -sizes
+  hessian = -outer
+  hessian[np.arange(k), np.arange(k)] += sizes
+  if weights is not None:
+    hessian[np.arange(k), k + np.arange(k)] -= loads
+    hessian[k + np.arange(k), np.arange(k)] -= loads
+    hessian[k + np.arange(k), k + np.arange(k)] += squares
+  return objective, gradient, hessian / tau
+
+
+def bound_value(prices, low, high):
+  """
+  The dual terms min(low * price, high * price) of the cluster bounds, where
+  a missing upper bound is infinite
+  """
+  # Prices without an upper bound never become negative
+  high = np.where(np.isfinite(high), high, 0.0)
+  return (low * np.maximum(prices, 0) + high * np.minimum(prices, 0)).sum()
+
+
+def newton_prices(dist, index, weights, prices, low, high, tau, maxiter=50):
+  """
+  Maximizes the regularized dual with projected Newton steps and a
+  backtracking line search. The bound terms have a kink at zero, so every
+  price keeps its sign during a step and a price at zero only moves when
+  the sizes or weights of its center are outside the bounds. Returns the
+  prices and whether they converged, that is whether the soft cluster
+  sizes are within a hundredth of a point of their bounds and the soft
+  cluster weights within a hundredth of the mean weight.
+  """
+  tolerance = np.full(len(prices), 0.01)
+  if weights is not None:
+    tolerance[len(prices) // 2:] *= max(weights.mean(), 1e-12)
+  k = len(prices) // 2 if weights is not None else len(prices)
+  for _ in range(maxiter):
+    # Raising all size prices together changes no assignment and costs one
+    # per point, and raising all weight prices together costs the weight of
+    # every point, so the Hessian is singular along these directions. The
+    # best such shifts are found exactly instead.
+    prices = prices.copy()
+    prices[:k] += best_shift(prices[:k], low[:k], high[:k], -len(dist))
+    if weights is not None:
+      prices[k:] += best_shift(prices[k:], low[k:], high[k:], weights.sum())
+    objective, gradient, hessian = dual_value(
+      dist, index, weights, prices, tau, derivatives=True)
+    objective += bound_value(prices, low, high)
+    rising = (prices > 0) | ((prices == 0) & (gradient + low > tolerance))
+    falling = (prices < 0) | ((prices == 0) & (gradient + high < -tolerance))
+    free = rising | falling
+    gradient = np.where(rising, gradient + low, np.where(falling, gradient + high, 0.0))
+    if (np.abs(gradient) <= tolerance).all():
+      return prices, True
+    step = newton_step(hessian, gradient, free, prices == 0, rising,
+                       [np.arange(k), np.arange(k, len(prices))])
+    # Groups of centers which hardly share any points make the Hessian
+    # nearly singular, so no price moves by more than ten temperatures
+    t = min(1.0, 10 * tau / np.abs(step).max())
+    while True:
+      moved = prices + t * step
+      moved = np.where(rising, np.maximum(moved, 0), np.where(falling, np.minimum(moved, 0), 0.0))
+      value = dual_value(dist, index, weights, moved, tau) + bound_value(moved, low, high)
+      if value >= objective + 1e-4 * gradient @ (moved - prices):
+        break
+      t /= 2
+      if t * np.abs(step).max() < 1e-9 * tau:
+        # No further progress within the rounding of the objective
+        return prices, False
+    prices = moved
+  return prices, False
+
+
+def newton_step(hessian, gradient, free, zero, rising, blocks):
+  """
+  Returns the Newton step of the free prices. A price at zero which the
+  step would move across zero stays at zero, and the step is solved again
+  without it. When all prices of a block are free, the step keeps their
+  sum, as the shifts along this singular direction are already the best.
+  """
+  while True:
+    columns = np.flatnonzero(free)
+    sums = [np.isin(columns, block) for block in blocks
+            if len(block) and free[block].all()]
+    size = len(columns) + len(sums)
+    system = np.zeros((size, size))
+    system[:len(columns), :len(columns)] = hessian[np.ix_(columns, columns)]
+    for row, block in enumerate(sums):
+      system[len(columns) + row, :len(columns)] = block
+      system[:len(columns), len(columns) + row] = block
+    # A tiny ridge keeps the system solvable when a center has no points nearby
+    ridge = 1e-12 * max(np.trace(hessian), 1.0)
+    system[np.arange(len(columns)), np.arange(len(columns))] += ridge
+    step = np.zeros(len(free))
+    step[columns] = np.linalg.solve(
+      system, np.append(gradient[columns], np.zeros(len(sums))))[:len(columns)]
+    outward = free & zero & np.where(rising, step < 0, step > 0)
+    if not outward.any():
+      return step
+    free = free & ~outward
+
+
+def best_shift(prices, low, high, slope):
+  """
+  Returns the shift c maximizing slope * c plus the sum of the bound terms
+  min(low * (price + c), high * (price + c)). The bound terms turn from the
+  high to the low slope where their price crosses zero, so the total slope
+  falls at every crossing, and the best shift is the first crossing where it
+  is not positive anymore.
+  """
+  order = np.argsort(-prices)
+  crossings = -prices[order]
+  # Total slope just after every crossing, from below all crossings upwards,
+  # adding up the high slopes separately as they can be infinite
+  remaining = np.append(np.cumsum(high[order][::-1])[::-1][1:], 0.0)
+  total = slope + np.cumsum(low[order]) + remaining
+  after = np.flatnonzero(total <= 0)
+  if len(after) == 0:
+    # Cannot happen when the bounds are feasible
+    return 0.0
+  return crossings[after[0]]
+
+
+def outside_candidates(data, C, index, dist, prices, weights):
+  """Whether any point would prefer a center outside its candidates at these prices"""
+  best = reduced_costs(dist, index, weights, prices).min(axis=1)
+  scale = max(np.abs(best).max(), 1.0)
+  k = len(C)
+  for start, d in center_distances(data, C):
+    reduced = d - prices[:k]
+    if weights is not None:
+      reduced += prices[k:] * weights[start:start + len(d), np.newaxis]
+    # Only differences beyond rounding count
+    if (reduced.min(axis=1) < best[start:start + len(d)] - 1e-9 * scale).any():
+      return True
+  return False
+
+
+def repair_assignment(data, C, M, demand, limit=None, weights=None, capacity=None):
+  """
+  Moves the cheapest points out of clusters above their size limit or weight
+  capacity, then from clusters above their demand to clusters below it
+  """
+  k = len(C)
+  limit = np.asarray(limit) if limit is not None else np.full(k, np.inf)
+  capacity = np.asarray(capacity) if capacity is not None else np.full(k, np.inf)
+  weights = np.asarray(weights, dtype=float) if weights is not None else np.ones(len(data))
+  sizes = np.bincount(M, minlength=k)
+  loads = np.bincount(M, weights=weights, minlength=k)
+
+  for j in np.flatnonzero((sizes > limit) | (loads > capacity)):
+    members = np.flatnonzero(M == j)
+    d = np.sqrt(((data[members, np.newaxis, :] - C[np.newaxis, :, :]) ** 2).sum(axis=2))
+    gap = d - d[:, j, np.newaxis]
+    gap[:, j] = np.inf
+    for i in np.argsort(gap.min(axis=1), kind='stable'):
+      if (sizes[j] <= limit[j] and loads[j] <= capacity[j]) or sizes[j] <= demand[j]:
+        break
+      point = members[i]
+      room = (sizes < limit) & (loads + weights[point] <= capacity)
+      room[j] = False
+      if not room.any():
+        continue
+      target = np.argmin(np.where(room, gap[i], np.inf))
+      M[point] = target
+      sizes[j] -= 1
+      sizes[target] += 1
+      loads[j] -= weights[point]
+      loads[target] += weights[point]
+
+  for j in np.flatnonzero(sizes < demand):
+    need = demand[j] - sizes[j]
+    surplus = sizes - demand
+    eligible = np.flatnonzero(surplus[M] > 0)
+    points = data[eligible]
+    gap = np.sqrt(((points - C[j]) ** 2).sum(axis=1)) - \
+      np.sqrt(((points - C[M[eligible]]) ** 2).sum(axis=1))
+    order = np.argsort(gap, kind='stable')
+    donors = M[eligible[order]]
+    # Rank of every candidate among the candidates taken from the same donor,
+    # so that no donor gives away more than its surplus
+    by_donor = np.argsort(donors, kind='stable')
+    first = np.searchsorted(donors[by_donor], donors[by_donor])
+    rank = np.empty(len(order), dtype=int)
+    rank[by_donor] = np.arange(len(order)) - first
+    moved = eligible[order[rank < surplus[donors]]]
+    # Stop before the point that would push the cluster over its weight capacity
+    moved = moved[np.cumsum(weights[moved]) <= capacity[j] - loads[j]][:need] \
+      if np.isfinite(capacity[j]) else moved[:need]
+    sizes -= np.bincount(M[moved], minlength=k)
+    loads -= np.bincount(M[moved], weights=weights[moved], minlength=k)
+    M[moved] = j
+    sizes[j] += len(moved)
+    loads[j] += weights[moved].sum()
+  return M
@@ -1,18 +1,46 @@
-from PyQt5.QtCore import QCoreApplication
+import numpy as np
+from collections import OrderedDict
+from PyQt5.QtCore import QCoreApplication, QVariant
 from qgis.core import (QgsProcessing, QgsProcessingFeatureBasedAlgorithm, 
-    QgsProcessingParameterDistance, QgsPoint, QgsFeature, QgsGeometry, 
+    QgsProcessingParameterDistance, QgsProcessingParameterNumber,
+    QgsProcessingParameterBoolean, QgsProcessingParameterString,
+    QgsProcessingException, QgsPoint, QgsFeature, QgsGeometry, 
+    QgsLineString, QgsPolygon, QgsFeatureSink, QgsField, QgsFields, NULL,
     QgsWkbTypes, QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject)
     
 
 class EquidistanceBuffer(QgsProcessingFeatureBasedAlgorithm ):
     """
     This algorithm takes a vectorlayer and creates equidistance bufers.
+
+    Features whose centroids fall in the same cell of a grid of TOLERANCE
+    degrees share one Azimuthal Equidistant projection centered on that cell.
+    The transforms are kept in a least recently used cache of CACHE_SIZE
+    entries, since creating the CRS and transform dominates the runtime.
+
+    Point layers skip projections entirely: the buffer vertices are computed
+    directly on the WGS84 ellipsoid by solving the direct geodesic problem
+    for all points of a batch at once with NumPy.
+
+    Several distances can be buffered in one run. The projection (or the
+    geodesic setup) is done once per feature and reused for every distance.
     """
     DISTANCE = 'DISTANCE'
-    SEGMENTS = 5   
+    DISTANCES = 'DISTANCES'
+    RINGS = 'RINGS'
+    DISSOLVE = 'DISSOLVE'
+    TOLERANCE = 'TOLERANCE'
+    SEGMENTS = 'SEGMENTS'
+    GEODESIC = 'GEODESIC'
+    CACHE_SIZE = 1024
+    BATCH_SIZE = 10000
     END_CAP_STYLE = QgsGeometry.CapRound 
     JOIN_STYLE = QgsGeometry.JoinStyleRound
     MITER_LIMIT = 2.0
+    # Set in prepareAlgorithm, the output type and fields are also asked for
+    # before the algorithm is prepared
+    dissolve = False
+    multiple = False
     
     def tr(self, string):
         return QCoreApplication.translate('Processing', string)
@@ -40,7 +68,16 @@ class EquidistanceBuffer(QgsProcessingFeatureBasedAlgorithm ):
             'This algorithm creates equidistant buffers for vector layers. \
             Each geometry is transformed to a Azimuthal Equidistant projection \
             centered at that geometry, buffered and transformed back to the \
-            original projection.')
+            original projection. Nearby features reuse the same projection: \
+            centroids are snapped to a grid of the given tolerance (in \
+            degrees) to pick the projection center. Use a tolerance of 0 to \
+            center the projection exactly on every feature. For point layers \
+            the buffers can instead be computed directly on the ellipsoid, \
+            which is much faster. Segments sets the number of vertices used \
+            per quarter circle. When a comma separated list of distances is \
+            given, one buffer is created per distance with the distance \
+            stored in a new field, optionally as non-overlapping rings and \
+            dissolved by distance.')
 
     def __init__(self):
         super().__init__()
@@ -49,7 +86,15 @@ class EquidistanceBuffer(QgsProcessingFeatureBasedAlgorithm ):
         return [QgsProcessing.TypeVector]
         
     def outputWkbType(self, input_wkb_type):
+        if self.dissolve:
+            return QgsWkbTypes.MultiPolygon
         return QgsWkbTypes.Polygon
+
+    def outputFields(self, fields):
+        fields = QgsFields(fields)
+        if self.multiple:
+            fields.append(QgsField('distance', QVariant.Double))
+        return fields
         
     def initParameters(self, config=None):
         self.addParameter(
@@ -58,30 +103,377 @@ class EquidistanceBuffer(QgsProcessingFeatureBasedAlgorithm ):
                 'Buffer Distance (meters)',
                 defaultValue=10000
                 ))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.TOLERANCE,
+                'Projection Center Tolerance (degrees)',
+                QgsProcessingParameterNumber.Double,
+                0.01, False, 0
+                ))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SEGMENTS,
+                'Segments',
+                QgsProcessingParameterNumber.Integer,
+                5, False, 1
+                ))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.GEODESIC,
+                'Compute point buffers directly on the ellipsoid',
+                True
+                ))
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.DISTANCES,
+                'Multiple Buffer Distances (comma separated meters)',
+                optional=True
+                ))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.RINGS,
+                'Create rings between consecutive distances',
+                False
+                ))
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.DISSOLVE,
+                'Dissolve buffers by distance',
+                False
+                ))
                 
     def prepareAlgorithm(self, parameters, context, feedback):
         self.distance = self.parameterAsDouble(
             parameters,
             self.DISTANCE,
             context)
+        self.tolerance = self.parameterAsDouble(
+            parameters,
+            self.TOLERANCE,
+            context)
+        self.segments = self.parameterAsInt(
+            parameters,
+            self.SEGMENTS,
+            context)
+        distances = self.parameterAsString(
+            parameters,
+            self.DISTANCES,
+            context)
+        self.multiple = bool(distances.strip())
+        if self.multiple:
+            try:
+                self.distances = sorted(set(
+                    float(d) for d in distances.split(',') if d.strip()))
+            except ValueError:
+                raise QgsProcessingException(
+                    'Buffer distances must be a comma separated list of numbers')
+        else:
+            self.distances = [self.distance]
+        self.rings = self.parameterAsBool(parameters, self.RINGS, context)
+        self.dissolve = self.parameterAsBool(parameters, self.DISSOLVE, context)
+        self.transforms = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.accuracy_checked = False
         source = self.parameterAsSource(parameters, 'INPUT', context)
         self.source_crs = source.sourceCrs()
         if not self.source_crs.isGeographic():
             feedback.reportError('Layer CRS must be a Geograhpic CRS for this algorithm')
             return False
+        self.geodesic_points = self.parameterAsBool(
+            parameters, self.GEODESIC, context) and \
+            QgsWkbTypes.flatType(source.wkbType()) == QgsWkbTypes.Point
         return super().prepareAlgorithm(parameters, context, feedback)
 
+    def processAlgorithm(self, parameters, context, feedback):
+        if not self.geodesic_points and not self.dissolve:
+            return super().processAlgorithm(parameters, context, feedback)
+
+        source = self.parameterAsSource(parameters, 'INPUT', context)
+        sink, dest_id = self.parameterAsSink(
+            parameters,
+            'OUTPUT',
+            context,
+            self.outputFields(source.fields()),
+            self.outputWkbType(source.wkbType()),
+            source.sourceCrs()
+            )
+        if self.geodesic_points:
+            feedback.pushInfo(self.tr('Computing geodesic buffers for points'))
+
+        # With dissolve, the buffers of each distance are merged batch by
+        # batch and the attributes of the first feature are kept
+        self.dissolved = [[] for d in self.distances]
+        self.first_attributes = None
+
+        total = source.featureCount()
+        step = 100.0 / total if total else 0
+        batch = []
+        for current, feature in enumerate(source.getFeatures()):
+            if feedback.isCanceled():
+                break
+            batch.append(feature)
+            if len(batch) == self.BATCH_SIZE:
+                self.writeBatch(batch, sink, feedback)
+                batch = []
+                feedback.setProgress(int((current + 1) * step))
+        if batch and not feedback.isCanceled():
+            self.writeBatch(batch, sink, feedback)
+
+        if self.dissolve and self.first_attributes is not None \
+                and not feedback.isCanceled():
+            feature = QgsFeature()
+            feature.setAttributes(self.first_attributes)
+            dissolved = [QgsGeometry.unaryUnion(g) for g in self.dissolved]
+            if self.rings:
+                dissolved = [dissolved[0]] + [
+                    outer.difference(inner)
+                    for inner, outer in zip(dissolved, dissolved[1:])]
+            sink.addFeatures(
+                self.bufferFeatures(feature, dissolved),
+                QgsFeatureSink.FastInsert)
+        return {'OUTPUT': dest_id}
+
+    def writeBatch(self, features, sink, feedback):
+        """
+        Buffers a batch of features and either writes the buffers to the sink
+        or merges them into the dissolved buffers of each distance.
+        """
+        buffered = self.bufferBatch(features, feedback)
+        if not self.dissolve:
+            for f, buffers in buffered:
+                sink.addFeatures(
+                    self.bufferFeatures(f, buffers), QgsFeatureSink.FastInsert)
+            return
+
+        if self.first_attributes is None:
+            self.first_attributes = features[0].attributes()
+        for i, merged in enumerate(self.dissolved):
+            geometries = merged + [b[i] for f, b in buffered if b is not None]
+            self.dissolved[i] = [QgsGeometry.unaryUnion(geometries)]
+
     def processFeature(self, feature, context, feedback):
-        geometry = feature.geometry()
-        # For point features, centroid() returns the point itself
-        centroid = geometry.centroid()
-        x = centroid.asPoint().x()
-        y = centroid.asPoint().y()
+        return self.bufferFeatures(
+            feature, self.projectedBuffers(feature.geometry(), rings=self.rings))
+
+    def bufferFeatures(self, feature, buffers):
+        """
+        Returns one copy of the feature per buffer distance, with the distance
+        appended to the attributes when multiple distances are used. Features
+        without geometry are kept once, with a NULL distance.
+        """
+        if buffers is None:
+            out_f = QgsFeature(feature)
+            if self.multiple:
+                out_f.setAttributes(feature.attributes() + [NULL])
+            return [out_f]
+        features = []
+        for distance, buffer in zip(self.distances, buffers):
+            out_f = QgsFeature(feature)
+            out_f.setGeometry(buffer)
+            if self.multiple:
+                attributes = feature.attributes()
+                attributes.append(distance)
+                out_f.setAttributes(attributes)
+            features.append(out_f)
+        return features
+
+    def bufferBatch(self, features, feedback):
+        """
+        Returns a list of (feature, buffers) pairs for a batch of features,
+        with the buffers ordered as self.distances, or None for features
+        without geometry. Rings are only created here when not dissolving,
+        since dissolved rings are made from the dissolved buffers.
+        """
+        rings = self.rings and not self.dissolve
+        if self.geodesic_points:
+            return self.bufferPoints(features, rings, feedback)
+        return [
+            (f, self.projectedBuffers(f.geometry(), rings=rings)
+             if f.hasGeometry() else None)
+            for f in features]
+
+    def projectedBuffers(self, geometry, xform=None, rings=False):
+        """
+        Buffers the geometry in an Azimuthal Equidistant projection centered
+        near its centroid for every distance, and returns the buffers in the
+        source CRS. The geometry is only projected once for all distances.
+        """
+        if xform is None:
+            # For point features, centroid() returns the point itself
+            centroid = geometry.centroid().asPoint()
+            xform = self.transform(centroid.x(), centroid.y())
+        geometry = QgsGeometry(geometry)
+        geometry.transform(xform)
+        buffers = []
+        previous = None
+        for distance in self.distances:
+            buffer = geometry.buffer(distance, self.segments, self.END_CAP_STYLE, self.JOIN_STYLE, self.MITER_LIMIT)
+            if rings and previous is not None:
+                output = buffer.difference(previous)
+            else:
+                output = buffer
+            previous = buffer
+            output.transform(xform, QgsCoordinateTransform.ReverseTransform)
+            buffers.append(output)
+        return buffers
+
+    def bufferPoints(self, features, rings, feedback):
+        """
+        Computes the geodesic buffers of a batch of point features at once and
+        returns them as (feature, buffers) pairs. The buffers are matched to
+        the features by position, as feature ids need not be unique.
+        """
+        located = [f for f in features if f.hasGeometry()]
+        points = [f.geometry().asPoint() for f in located]
+        lons = np.array([p.x() for p in points])
+        lats = np.array([p.y() for p in points])
+        coordinates = [
+            geodesic_rings(lons, lats, distance, 4 * self.segments)
+            for distance in self.distances]
+
+        if not self.accuracy_checked and located:
+            self.checkAccuracy(
+                located[0].geometry(), coordinates[0][0][0], coordinates[0][1][0],
+                feedback)
+            self.accuracy_checked = True
+
+        buffers = []
+        for index in range(len(located)):
+            polygons = []
+            inner = None
+            for ring_lons, ring_lats in coordinates:
+                outer = QgsLineString(
+                    ring_lons[index].tolist(), ring_lats[index].tolist())
+                polygon = QgsPolygon(outer)
+                if rings and inner is not None:
+                    polygon.addInteriorRing(inner.reversed())
+                polygons.append(QgsGeometry(polygon))
+                inner = outer
+            buffers.append(polygons)
+        buffers = iter(buffers)
+        return [(f, next(buffers) if f.hasGeometry() else None) for f in features]
+
+    def checkAccuracy(self, point, ring_lons, ring_lats, feedback):
+        """
+        Compares the geodesic buffer of a point with the buffer obtained from
+        an Azimuthal Equidistant projection centered exactly on that point and
+        reports the differences in the log.
+        """
+        location = point.asPoint()
+        xform = self.aeqdTransform(location.x(), location.y())
+        reference = self.projectedBuffers(point, xform)[0]
+        geodesic = QgsGeometry(QgsPolygon(
+            QgsLineString(ring_lons.tolist(), ring_lats.tolist())))
+        area_difference = abs(geodesic.area() - reference.area()) / reference.area()
+        feedback.pushInfo(self.tr(
+            'Accuracy check against the projected buffer: area differs by '
+            '{:.4f}%, Hausdorff distance {:.2e} degrees').format(
+            100.0 * area_difference, geodesic.hausdorffDistance(reference)))
+
+    def transform(self, x, y):
+        """
+        Returns the transform to an Azimuthal Equidistant projection centered
+        on the grid cell containing x, y, reusing a cached one if possible.
+        """
+        if self.tolerance > 0:
+            key = (round(x / self.tolerance), round(y / self.tolerance))
+            x = key[0] * self.tolerance
+            y = key[1] * self.tolerance
+        else:
+            key = (x, y)
+
+        xform = self.transforms.get(key)
+        if xform is not None:
+            self.transforms.move_to_end(key)
+            self.cache_hits += 1
+            return xform
+
+        self.cache_misses += 1
+        xform = self.aeqdTransform(x, y)
+        self.transforms[key] = xform
+        if len(self.transforms) > self.CACHE_SIZE:
+            self.transforms.popitem(last=False)
+        return xform
+
+    def aeqdTransform(self, x, y):
+        """
+        Creates the transform to an Azimuthal Equidistant projection centered
+        at x, y.
+        """
         proj_string = 'PROJ4:+proj=aeqd +ellps=WGS84 +lat_0={} +lon_0={} +x_0=0 +y_0=0'.format(y, x)
         dest_crs = QgsCoordinateReferenceSystem(proj_string)
-        xform = QgsCoordinateTransform(self.source_crs, dest_crs, QgsProject.instance())
-        geometry.transform(xform)
-        buffer = geometry.buffer(self.distance, self.SEGMENTS, self.END_CAP_STYLE, self.JOIN_STYLE, self.MITER_LIMIT)
-        buffer.transform(xform, QgsCoordinateTransform.ReverseTransform)
-        feature.setGeometry(buffer)
-        return [feature]
\ No newline at end of file
+        return QgsCoordinateTransform(self.source_crs, dest_crs, QgsProject.instance())
+
+    def postProcessAlgorithm(self, context, feedback):
+        lookups = self.cache_hits + self.cache_misses
+        if lookups:
+            feedback.pushInfo(self.tr(
+                'Projection cache: {} hits, {} misses ({:.1f}% hit rate)').format(
+                self.cache_hits, self.cache_misses,
+                100.0 * self.cache_hits / lookups))
+        return super().postProcessAlgorithm(context, feedback)
+
+
+def geodesic_rings(lons, lats, distance, vertices, a=6378137.0, f=1 / 298.257223563):
+    """
+    Solves the direct geodesic problem (Vincenty's formulae) on the ellipsoid
+    for every point and `vertices` equally spaced azimuths. Returns two arrays
+    of shape (points, vertices + 1) with the longitudes and latitudes of the
+    closed rings, in degrees. Longitudes are not wrapped, so rings crossing
+    the antimeridian stay continuous.
+    """
+    b = (1 - f) * a
+    azimuths = np.radians(np.linspace(0, 360, vertices, endpoint=False))
+    sin_alpha1 = np.sin(azimuths)[np.newaxis, :]
+    cos_alpha1 = np.cos(azimuths)[np.newaxis, :]
+
+    tan_u1 = (1 - f) * np.tan(np.radians(lats))[:, np.newaxis]
+    cos_u1 = 1 / np.sqrt(1 + tan_u1 ** 2)
+    sin_u1 = tan_u1 * cos_u1
+    sigma1 = np.arctan2(tan_u1, cos_alpha1)
+    sin_alpha = cos_u1 * sin_alpha1
+    cos_sq_alpha = 1 - sin_alpha ** 2
+    u_sq = cos_sq_alpha * (a ** 2 - b ** 2) / b ** 2
+    A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+
+    sigma = distance / (b * A)
+    for _ in range(100):
+        cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+        sin_sigma = np.sin(sigma)
+        cos_sigma = np.cos(sigma)
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - B / 6 * cos_2sigma_m *
+            (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        previous = sigma
+        sigma = distance / (b * A) + delta_sigma
+        if np.max(np.abs(sigma - previous), initial=0) < 1e-12:
+            break
+
+    cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+    sin_sigma = np.sin(sigma)
+    cos_sigma = np.cos(sigma)
+    tmp = sin_u1 * sin_sigma - cos_u1 * cos_sigma * cos_alpha1
+    lat2 = np.arctan2(
+        sin_u1 * cos_sigma + cos_u1 * sin_sigma * cos_alpha1,
+        (1 - f) * np.sqrt(sin_alpha ** 2 + tmp ** 2))
+    lam = np.arctan2(
+        sin_sigma * sin_alpha1,
+        cos_u1 * cos_sigma - sin_u1 * sin_sigma * cos_alpha1)
+    C = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+    L = lam - (1 - C) * f * sin_alpha * (sigma + C * sin_sigma * (
+        cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+
+    ring_lons = np.asarray(lons)[:, np.newaxis] + np.degrees(L)
+    ring_lats = np.degrees(lat2)
+    # Close the rings
+    ring_lons = np.concatenate((ring_lons, ring_lons[:, :1]), axis=1)
+    ring_lats = np.concatenate((ring_lats, ring_lats[:, :1]), axis=1)
+    return ring_lons, ring_lats
@@ -0,0 +1,170 @@
+from PyQt5.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsProcessingFeatureBasedAlgorithm,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterDistance,
+                       QgsProcessingUtils,
+                       QgsFeatureRequest,
+                       QgsFields,
+                       QgsField,
+                       QgsGeometry,
+                       QgsSpatialIndex,
+                       QgsWkbTypes)
+
+
+class FixLineTransects(QgsProcessingFeatureBasedAlgorithm):
+    """
+    This processing algorithm fixes the length of transects crossing a
+    centerline, so that each side of the centerline is exactly half of the
+    required length.
+
+    This is the chain of the Fix Transects model (split with lines, dissolve,
+    extend lines, split lines by length, multipart to singleparts, dissolve
+    and refactor fields), applied to one transect at a time in memory. The
+    centerline is read only once, into a spatial index which also stores the
+    geometries, so every transect is only intersected with the centerlines
+    it can cross.
+    """
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return FixLineTransects()
+
+    def name(self):
+        return 'fix_line_transects'
+
+    def displayName(self):
+        return self.tr('Fix Line Transects')
+
+    def group(self):
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        return ''
+
+    def outputName(self):
+        return self.tr('Fixed')
+
+    def shortHelpString(self):
+        return self.tr('Fixes the length of transects crossing a centerline. '
+                       'Each side of a transect, measured from where it crosses '
+                       'the centerline, is extended or trimmed to half of the '
+                       'required length when it differs from it by at most the '
+                       'maximum variation, and is left as it is otherwise. '
+                       'Transects which do not cross the centerline are not '
+                       'changed. The old_length and new_length fields hold the '
+                       'length of each transect before and after.')
+
+    def inputLayerTypes(self):
+        return [QgsProcessing.TypeVectorLine]
+
+    def outputWkbType(self, input_wkb_type):
+        # Multipart transects which do not join up are written unchanged, and
+        # curved transects are fixed as straight segments
+        return QgsWkbTypes.multiType(QgsWkbTypes.linearType(input_wkb_type))
+
+    def initParameters(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                'CENTERLINE',
+                self.tr('Centerline'),
+                [QgsProcessing.TypeVectorLine]))
+
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'REQUIRED_LENGTH',
+                self.tr('Required length'),
+                500.0, 'INPUT', False, 0.0))
+
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'MAXIMUM_VARIATION',
+                self.tr('Maximum variation'),
+                10.0, 'INPUT', False, 0.0))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, 'INPUT', context)
+        centerline = self.parameterAsSource(parameters, 'CENTERLINE', context)
+        self.half_length = self.parameterAsDouble(parameters, 'REQUIRED_LENGTH', context) / 2
+        self.variation = self.parameterAsDouble(parameters, 'MAXIMUM_VARIATION', context)
+        self.buildCenterlineIndex(centerline, source.sourceCrs(), context, feedback)
+        return super().prepareAlgorithm(parameters, context, feedback)
+
+    def buildCenterlineIndex(self, centerline, crs, context, feedback):
+        """Reads the centerline once, in the CRS of the transects, into a spatial index keeping the geometries"""
+        feedback.pushInfo(self.tr('Indexing centerline'))
+        request = QgsFeatureRequest().setNoAttributes().setDestinationCrs(
+            crs, context.transformContext())
+        self.centerline_index = QgsSpatialIndex(
+            centerline.getFeatures(request), feedback,
+            QgsSpatialIndex.FlagStoreFeatureGeometries)
+
+    def outputFields(self, fields):
+        new_fields = QgsFields()
+        new_fields.append(QgsField('old_length', QVariant.Double))
+        new_fields.append(QgsField('new_length', QVariant.Double))
+        return QgsProcessingUtils.combineFields(fields, new_fields)
+
+    def processFeature(self, feature, context, feedback):
+        geometry = feature.geometry()
+        old_length = geometry.length()
+        line = self.singleLine(geometry)
+        crossing = self.crossing(line) if line is not None else None
+        if crossing is not None:
+            # Both sides start at the crossing and run towards the transect ends
+            before = line.curveSubstring(0, crossing).reversed()
+            after = line.curveSubstring(crossing, line.length())
+            before = self.fixSide(before)
+            after = self.fixSide(after)
+            fixed = before.reversed()
+            fixed.append(after)
+            fixed.removeDuplicateNodes()
+            geometry = QgsGeometry(fixed)
+        elif QgsWkbTypes.isCurvedType(geometry.wkbType()):
+            geometry = QgsGeometry(geometry.constGet().segmentize())
+        geometry.convertToMultiType()
+        feature.setGeometry(geometry)
+        feature.setAttributes(feature.attributes() + [old_length, round(geometry.length())])
+        return [feature]
+
+    def singleLine(self, geometry):
+        """Returns the transect as one line string, or None when its parts do not join up"""
+        if geometry.isEmpty():
+            return None
+        if geometry.isMultipart():
+            geometry = geometry.mergeLines()
+            if geometry.isMultipart():
+                return None
+        if QgsWkbTypes.isCurvedType(geometry.wkbType()):
+            return geometry.constGet().curveToLine()
+        return geometry.constGet().clone()
+
+    def crossing(self, line):
+        """
+        Returns the distance along the transect at which it crosses the
+        centerline, the crossing closest to the middle of the transect if
+        there are several, or None
+        """
+        geometry = QgsGeometry(line.clone())
+        middle = line.length() / 2
+        best = None
+        for fid in self.centerline_index.intersects(geometry.boundingBox()):
+            intersection = geometry.intersection(self.centerline_index.geometry(fid))
+            for vertex in intersection.vertices():
+                distance = geometry.lineLocatePoint(QgsGeometry(vertex.clone()))
+                if 0 < distance < line.length() and \
+                        (best is None or abs(distance - middle) < abs(best - middle)):
+                    best = distance
+        return best
+
+    def fixSide(self, side):
+        """Extends or trims one side of the transect to half of the required length"""
+        difference = self.half_length - side.length()
+        if abs(difference) > self.variation:
+            return side
+        if difference > 0:
+            extended = QgsGeometry(side).extendLine(0, difference)
+            return extended.constGet().clone()
+        return side.curveSubstring(0, self.half_length)
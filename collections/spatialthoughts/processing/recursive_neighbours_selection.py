@@ -1,14 +1,43 @@
+import math
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PyQt5.QtCore import QVariant
 from qgis.core import (
     QgsProcessing,
     QgsProcessingAlgorithm,
     QgsProcessingParameterVectorLayer,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterDistance,
+    QgsProcessingParameterExpression,
     QgsProcessingException,
-    QgsFeatureRequest
+    QgsFeatureRequest,
+    QgsFeatureSink,
+    QgsExpressionContext,
+    QgsExpressionContextUtils,
+    QgsField,
+    QgsGeometry,
+    QgsRectangle,
+    QgsSpatialIndex,
+    NULL
 )
 
 
 class RecursiveNeighborSelection(QgsProcessingAlgorithm):
     INPUT = 'INPUT'
+    MODE = 'MODE'
+    THREADS = 'THREADS'
+    MAX_HOPS = 'MAX_HOPS'
+    TOLERANCE = 'TOLERANCE'
+    FILTER = 'FILTER'
+    OUTPUT = 'OUTPUT'
+    MODES = ['Grow selection from selected features',
+             'Label all connected components']
+    SELECT, LABEL = range(2)
+    # Tiles per thread when generating neighbor pairs, to balance the load
+    TILES_PER_THREAD = 4
 
     def initAlgorithm(self, config=None):
         self.addParameter(
@@ -20,6 +49,53 @@ class RecursiveNeighborSelection(QgsProcessingAlgorithm):
                 ]
             )
         )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.MODE,
+                'Mode',
+                self.MODES,
+                defaultValue=self.SELECT
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_HOPS,
+                'Maximum Number of Hops (0 for no limit)',
+                QgsProcessingParameterNumber.Integer,
+                0, False, 0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                self.TOLERANCE,
+                'Touching Tolerance',
+                0.0, self.INPUT, False, 0.0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterExpression(
+                self.FILTER,
+                'Only Traverse Features Matching',
+                parentLayerParameterName=self.INPUT,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.THREADS,
+                'Number of Threads',
+                QgsProcessingParameterNumber.Integer,
+                1, False, 1
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                'Selected Features or Connected Components',
+                optional=True,
+                createByDefault=False
+            )
+        )
 
     def processAlgorithm(self, parameters, context, feedback):
         layer = self.parameterAsVectorLayer(parameters, self.INPUT, context)
@@ -27,35 +103,248 @@ class RecursiveNeighborSelection(QgsProcessingAlgorithm):
         if not layer or not layer.isValid():
             raise QgsProcessingException("Invalid input layer.")
 
+        self.tolerance = self.parameterAsDouble(parameters, self.TOLERANCE, context)
+        max_hops = self.parameterAsInt(parameters, self.MAX_HOPS, context)
+        expression = self.parameterAsExpression(parameters, self.FILTER, context)
+        expression_context = QgsExpressionContext(
+            QgsExpressionContextUtils.globalProjectLayerScopes(layer))
+        if self.parameterAsEnum(parameters, self.MODE, context) == self.LABEL:
+            if max_hops:
+                feedback.reportError(
+                    "The maximum number of hops is ignored when labelling connected components.")
+            return self.labelComponents(layer, expression, expression_context,
+                                        parameters, context, feedback)
+
         selected_ids = layer.selectedFeatureIds()
         if not selected_ids:
             raise QgsProcessingException("No features selected. Please select one or more seed features.")
 
-        visited = set()
-        to_visit = set(selected_ids)
-
-        def get_neighbors(feature):
-            bbox = feature.geometry().boundingBox()
-            neighbors = []
-            request = QgsFeatureRequest(bbox)
-            for f in layer.getFeatures(request):
-                if f.id() != feature.id() and f.geometry().intersects(feature.geometry()):
-                    neighbors.append(f.id())
-            return neighbors
-
-        while to_visit:
-            current_id = to_visit.pop()
-            if current_id in visited:
+        if max_hops or expression:
+            # A bounded search only reads the features around the ones it reaches
+            geometries, candidates = self.layerReader(
+                layer, selected_ids, expression, expression_context)
+        else:
+            feedback.pushInfo("Building spatial index...")
+            index = self.buildIndex(layer, feedback)
+            if feedback.isCanceled():
+                return {}
+            geometries, candidates = index.geometry, index.intersects
+
+        feedback.pushInfo("Selecting neighbors...")
+        hops = self.floodFill(selected_ids, geometries, candidates, max_hops,
+                              layer.featureCount(), feedback)
+        if feedback.isCanceled():
+            return {}
+
+        layer.selectByIds(list(hops))
+        feedback.pushInfo(f"{len(hops)} features selected from {len(selected_ids)} seed(s).")
+
+        fields = layer.fields()
+        fields.append(QgsField('HOPS', QVariant.Int))
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields, layer.wkbType(), layer.sourceCrs())
+        if sink is None:
+            return {}
+        for feature in layer.getFeatures(QgsFeatureRequest().setFilterFids(list(hops))):
+            if feedback.isCanceled():
+                return {}
+            feature.setFields(fields, False)
+            feature.setAttributes(feature.attributes() + [hops[feature.id()]])
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+        return {self.OUTPUT: dest_id}
+
+    def buildIndex(self, layer, feedback):
+        """Reads every geometry once into a spatial index which also keeps the geometries"""
+        request = QgsFeatureRequest().setNoAttributes()
+        return QgsSpatialIndex(layer.getFeatures(request), feedback,
+                               QgsSpatialIndex.FlagStoreFeatureGeometries)
+
+    def layerReader(self, layer, seeds, expression, expression_context):
+        """
+        Returns geometry and candidate lookups which query the layer on demand.
+        Only features matching the expression are returned as candidates, and
+        the geometries read are cached so that reached features are not read
+        again by id.
+        """
+        cache = {}
+        request = QgsFeatureRequest().setFilterFids(list(seeds)).setNoAttributes()
+        for feature in layer.getFeatures(request):
+            cache[feature.id()] = feature.geometry()
+
+        def candidates(rectangle):
+            request = QgsFeatureRequest(rectangle).setNoAttributes()
+            if expression:
+                request.setFilterExpression(expression)
+                request.setExpressionContext(expression_context)
+            found = []
+            for feature in layer.getFeatures(request):
+                cache.setdefault(feature.id(), feature.geometry())
+                found.append(feature.id())
+            return found
+
+        return (lambda fid: cache.get(fid, QgsGeometry())), candidates
+
+    def floodFill(self, seeds, geometries, candidates, max_hops, count, feedback):
+        """
+        Breadth first search from the seeds over touching features, returning
+        the number of hops to every reached feature. Every feature is dequeued
+        once, so its prepared geometry is built once, and candidates which were
+        already reached are not tested again.
+        """
+        hops = {fid: 0 for fid in seeds}
+        queue = deque(hops)
+        total = 100.0 / count if count else 0
+        done = 0
+        while queue:
+            if feedback.isCanceled():
+                break
+            current_id = queue.popleft()
+            done += 1
+            if max_hops and hops[current_id] >= max_hops:
+                continue
+            geometry = geometries(current_id)
+            if geometry.isEmpty():
+                continue
+            engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+            engine.prepareGeometry()
+            for candidate in candidates(geometry.boundingBox().buffered(self.tolerance)):
+                if candidate in hops:
+                    continue
+                if self.touches(engine, geometries(candidate)):
+                    hops[candidate] = hops[current_id] + 1
+                    queue.append(candidate)
+            feedback.setProgress(int(done * total))
+        return hops
+
+    def touches(self, engine, geometry):
+        """Whether the geometry intersects the prepared one or lies within the tolerance"""
+        if self.tolerance > 0:
+            return engine.distance(geometry.constGet()) <= self.tolerance
+        return engine.intersects(geometry.constGet())
+
+    def labelComponents(self, layer, expression, expression_context, parameters, context, feedback):
+        """
+        Labels every connected component of the layer with union-find over the
+        touching pairs, which are generated in parallel per spatial tile. Only
+        features matching the expression are part of the components, the
+        others get no label.
+        """
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        fields = layer.fields()
+        fields.append(QgsField('COMPONENT_ID', QVariant.Int))
+        fields.append(QgsField('COMPONENT_SIZE', QVariant.Int))
+        sink, dest_id = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields, layer.wkbType(), layer.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException("An output layer is required to label connected components.")
+
+        feedback.pushInfo("Building spatial index...")
+        index = QgsSpatialIndex(QgsSpatialIndex.FlagStoreFeatureGeometries)
+        ids = []
+        centers = []
+        request = QgsFeatureRequest().setNoAttributes()
+        if expression:
+            request.setFilterExpression(expression)
+            request.setExpressionContext(expression_context)
+        for feature in layer.getFeatures(request):
+            if feedback.isCanceled():
+                return {}
+            ids.append(feature.id())
+            if feature.hasGeometry():
+                index.addFeature(feature)
+                centers.append(feature.geometry().boundingBox().center())
+            else:
+                centers.append(None)
+        position = {fid: i for i, fid in enumerate(ids)}
+
+        feedback.pushInfo("Finding neighbors...")
+        parent = list(range(len(ids)))
+        tiles = self.partition(centers, threads)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            futures = [executor.submit(self.tilePairs, index, [ids[i] for i in tile], feedback)
+                       for tile in tiles]
+            for done, future in enumerate(as_completed(futures)):
+                for a, b in future.result():
+                    self.union(parent, position[a], position[b])
+                feedback.setProgress(int(100 * (done + 1) / len(futures)))
+        if feedback.isCanceled():
+            return {}
+
+        roots = [self.find(parent, i) for i in range(len(ids))]
+        sizes = Counter(roots)
+        labels = {}
+        for root in roots:
+            labels.setdefault(root, len(labels) + 1)
+
+        feedback.pushInfo("Writing components...")
+        for feature in layer.getFeatures():
+            if feedback.isCanceled():
+                return {}
+            feature.setFields(fields, False)
+            if feature.id() in position:
+                root = roots[position[feature.id()]]
+                feature.setAttributes(feature.attributes() + [labels[root], sizes[root]])
+            else:
+                feature.setAttributes(feature.attributes() + [NULL, NULL])
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+
+        feedback.pushInfo(f"{len(labels)} connected components found in {len(ids)} features.")
+        return {self.OUTPUT: dest_id}
+
+    def partition(self, centers, threads):
+        """Groups the positions of the features in a regular grid by their bounding box centers"""
+        extent = QgsRectangle()
+        extent.setMinimal()
+        for center in centers:
+            if center is not None:
+                extent.combineExtentWith(center.x(), center.y())
+        cells = max(1, math.ceil(math.sqrt(threads * self.TILES_PER_THREAD)))
+        width = extent.width() / cells or 1
+        height = extent.height() / cells or 1
+        tiles = {}
+        for i, center in enumerate(centers):
+            if center is None:
+                key = (0, 0)
+            else:
+                key = (min(int((center.x() - extent.xMinimum()) / width), cells - 1),
+                       min(int((center.y() - extent.yMinimum()) / height), cells - 1))
+            tiles.setdefault(key, []).append(i)
+        return list(tiles.values())
+
+    def tilePairs(self, index, tile_ids, feedback):
+        """
+        Returns the touching pairs for the features of a tile. Each pair is
+        only tested from its smaller id, so no pair is tested twice.
+        """
+        pairs = []
+        for fid in tile_ids:
+            if feedback.isCanceled():
+                break
+            geometry = index.geometry(fid)
+            if geometry.isEmpty():
                 continue
-            visited.add(current_id)
-            feature = layer.getFeature(current_id)
-            neighbors = get_neighbors(feature)
-            new_neighbors = set(neighbors) - visited
-            to_visit.update(new_neighbors)
+            engine = None
+            for candidate in index.intersects(geometry.boundingBox().buffered(self.tolerance)):
+                if candidate <= fid:
+                    continue
+                if engine is None:
+                    engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+                    engine.prepareGeometry()
+                if self.touches(engine, index.geometry(candidate)):
+                    pairs.append((fid, candidate))
+        return pairs
 
-        layer.selectByIds(list(visited))
-        feedback.pushInfo(f"{len(visited)} features selected from {len(selected_ids)} seed(s).")
-        return {}
+    def find(self, parent, i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, parent, a, b):
+        a = self.find(parent, a)
+        b = self.find(parent, b)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
 
     def name(self):
         return 'recursive_neighbor_selection'
@@ -63,6 +352,20 @@ class RecursiveNeighborSelection(QgsProcessingAlgorithm):
     def displayName(self):
         return 'Recursive Neighbor Selection'
 
+    def shortHelpString(self):
+        return ('Grows the selection of the input layer to every feature '
+                'connected to the selected ones through touching features, or '
+                'labels every connected component of the layer. Features closer '
+                'than the touching tolerance count as touching.\n'
+                'When growing the selection, the output gets the number of hops '
+                'from the nearest seed, the search can stop after a maximum '
+                'number of hops and only features matching the filter are '
+                'traversed.\n'
+                'When labelling components, only features matching the filter '
+                'are connected and labelled, the others get no component. The '
+                'maximum number of hops does not apply to components and is '
+                'ignored with a warning.')
+
     def group(self):
         return ''
 
@@ -0,0 +1,144 @@
+import numpy as np
+from PyQt5.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingFeatureBasedAlgorithm,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterDistance,
+                       QgsFeatureRequest,
+                       QgsGeometry,
+                       QgsSpatialIndex,
+                       QgsLineString,
+                       QgsPolygon,
+                       QgsMultiPolygon,
+                       QgsWkbTypes)
+
+
+class SmoothPolygons(QgsProcessingFeatureBasedAlgorithm):
+    """
+    This processing algorithm smooths polygons, typically voronoi polygons,
+    by densifying their boundaries, moving every vertex randomly within the
+    tolerance, buffering the result by the tolerance and clipping it to the
+    area covered by the input layer.
+
+    This is the chain of the Smooth Polygons model (buffer, densify, extract
+    vertices, points to path, lines to polygons, join and clip), applied to
+    one feature at a time in memory. Like the model, the smoothed polygons
+    may overlap their neighbors and are only clipped to the area of the
+    input layer, that is to the union of the input polygons meeting their
+    bounding box, which are found in a spatial index built once before the
+    features are processed. The vertices of each ring are moved as one
+    NumPy array instead of being written out as a point layer, so
+    detailed polygons such as coastlines do not need memory for a point
+    feature per vertex.
+    """
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return SmoothPolygons()
+
+    def name(self):
+        return 'smooth_polygons'
+
+    def displayName(self):
+        return self.tr('Smooth Polygons')
+
+    def group(self):
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        return ''
+
+    def outputName(self):
+        return self.tr('Smoothed')
+
+    def shortHelpString(self):
+        return self.tr('Smooths polygons, such as voronoi polygons. Vertices are '
+                       'added to every segment, each vertex is moved randomly by '
+                       'up to the tolerance, and the result is buffered by the '
+                       'tolerance and clipped to the area of the input layer. Set '
+                       'a random seed for repeatable results.')
+
+    def inputLayerTypes(self):
+        return [QgsProcessing.TypeVectorPolygon]
+
+    def outputWkbType(self, input_wkb_type):
+        return QgsWkbTypes.MultiPolygon
+
+    def initParameters(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'VERTICES',
+                self.tr('Vertices to add per segment'),
+                QgsProcessingParameterNumber.Integer,
+                5, False, 1, 100))
+
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                'TOLERANCE',
+                self.tr('Tolerance'),
+                0.05, 'INPUT', False, 0.0))
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                'SEED',
+                self.tr('Random seed'),
+                QgsProcessingParameterNumber.Integer,
+                optional=True, minValue=0))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        self.vertices = self.parameterAsInt(parameters, 'VERTICES', context)
+        self.tolerance = self.parameterAsDouble(parameters, 'TOLERANCE', context)
+        seed = None
+        if parameters.get('SEED') is not None:
+            seed = self.parameterAsInt(parameters, 'SEED', context)
+        # Without a seed every run draws fresh entropy, shared by all features
+        self.entropy = seed if seed is not None else np.random.SeedSequence().entropy
+        self.buildClipIndex(self.parameterAsSource(parameters, 'INPUT', context), feedback)
+        return super().prepareAlgorithm(parameters, context, feedback)
+
+    def buildClipIndex(self, source, feedback):
+        """Indexes the input polygons with their geometries to clip the smoothed polygons to"""
+        feedback.pushInfo(self.tr('Indexing input polygons'))
+        self.clip_index = QgsSpatialIndex(
+            source.getFeatures(QgsFeatureRequest().setNoAttributes()), feedback,
+            QgsSpatialIndex.FlagStoreFeatureGeometries)
+
+    def processFeature(self, feature, context, feedback):
+        geometry = feature.geometry()
+        if geometry.isEmpty():
+            return [feature]
+        if QgsWkbTypes.isCurvedType(geometry.wkbType()):
+            geometry = QgsGeometry(geometry.constGet().segmentize())
+        # Seeded by the feature id, so the result does not depend on the order
+        # or thread the features are processed in. Seed sequences only take
+        # non-negative numbers, and unsaved features have negative ids.
+        rng = np.random.default_rng(np.random.SeedSequence(
+            [self.entropy, feature.id() & 0xFFFFFFFFFFFFFFFF]))
+
+        jittered = QgsMultiPolygon()
+        for part in geometry.densifyByCount(self.vertices).constParts():
+            polygon = QgsPolygon()
+            polygon.setExteriorRing(self.jitterRing(part.exteriorRing(), rng))
+            for i in range(part.numInteriorRings()):
+                polygon.addInteriorRing(self.jitterRing(part.interiorRing(i), rng))
+            jittered.addGeometry(polygon)
+
+        smoothed = QgsGeometry(jittered).buffer(self.tolerance, 5)
+        # Only the input polygons near the smoothed polygon can clip it
+        clip = QgsGeometry.unaryUnion([self.clip_index.geometry(i) for i in
+                                       self.clip_index.intersects(smoothed.boundingBox())])
+        smoothed = smoothed.intersection(clip)
+        if smoothed.isEmpty():
+            return []
+        smoothed.convertToMultiType()
+        feature.setGeometry(smoothed)
+        return [feature]
+
+    def jitterRing(self, ring, rng):
+        """Moves every vertex of the ring randomly by up to the tolerance, keeping it closed"""
+        xy = np.column_stack([ring.xVector(), ring.yVector()])
+        xy += rng.uniform(-self.tolerance, self.tolerance, xy.shape)
+        xy[-1] = xy[0]
+        return QgsLineString(xy[:, 0].tolist(), xy[:, 1].tolist())
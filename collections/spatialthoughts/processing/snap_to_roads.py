@@ -1,19 +1,104 @@
+import hashlib
+import json
+import math
+import os
 import requests
-from PyQt5.QtCore import QCoreApplication
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from PyQt5.QtCore import QCoreApplication, QVariant, QDateTime, QDate, Qt
 from qgis.core import (QgsProcessing, QgsProcessingAlgorithm, 
     QgsProcessingParameterFeatureSource, QgsProcessingParameterFeatureSink,
     QgsProcessingParameterString, QgsProcessingParameterNumber, QgsWkbTypes,
-    QgsGeometry, QgsFeatureSink, QgsFields, QgsPoint, QgsFeature)
+    QgsGeometry, QgsFeatureSink, QgsFields, QgsPoint, QgsFeature,
+    QgsPointXY, QgsLineString, QgsProcessingException,
+    QgsProcessingParameterField, QgsField, QgsFeatureRequest, NULL,
+    QgsProcessingParameterFile, QgsApplication, QgsProcessingParameterBoolean)
 from PyQt5.QtXml import QDomDocument
+
+
+class ResponseCache:
+    """
+    Map matching responses stored compressed in a SQLite database, keyed by a
+    hash of the request. Least recently used responses are evicted when the
+    database grows over its size limit.
+    """
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses '
+                                '(key TEXT PRIMARY KEY, response BLOB, size INTEGER, accessed REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.connection.commit()
+
+    @staticmethod
+    def key(url, payload):
+        request = json.dumps([url, sorted(payload.items())])
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute(
+                'UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def put(self, key, results):
+        response = zlib.compress(json.dumps(results).encode('utf-8'))
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                (key, response, len(response), time.time()))
+
+    def close(self):
+        """Evicts the least recently used responses over the size limit and closes the database"""
+        with self.lock:
+            total = self.connection.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total > self.max_bytes:
+                evicted = []
+                for key, size in self.connection.execute(
+                        'SELECT key, size FROM responses ORDER BY accessed'):
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((key,))
+                    total -= size
+                self.connection.executemany('DELETE FROM responses WHERE key = ?', evicted)
+            self.connection.commit()
+            self.connection.close()
+
+
 class ExportLayoutAlgorithm(QgsProcessingAlgorithm):
     """Exports the current map view to PDF"""
     INPUT = 'INPUT'
     OUTPUT = 'OUTPUT'
     SERVICE = 'SERVICE'
     TOLERANCE = 'TOLERANCE'
+    CHUNK_SIZE = 'CHUNK_SIZE'
+    OVERLAP = 'OVERLAP'
+    THREADS = 'THREADS'
+    RETRIES = 'RETRIES'
+    TRACK_FIELD = 'TRACK_FIELD'
+    TIMESTAMP_FIELD = 'TIMESTAMP_FIELD'
+    CACHE = 'CACHE'
+    CACHE_SIZE = 'CACHE_SIZE'
+    STREAMING = 'STREAMING'
+    MAX_TIME_GAP = 'MAX_TIME_GAP'
+    MAX_DISTANCE_GAP = 'MAX_DISTANCE_GAP'
      
-    def flags(self):
-          return super().flags() | QgsProcessingAlgorithm.FlagNoThreading
     def initAlgorithm(self, config=None):
         self.addParameter(
             QgsProcessingParameterFeatureSource(
@@ -23,6 +108,50 @@ class ExportLayoutAlgorithm(QgsProcessingAlgorithm):
             )
         )
          
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.TRACK_FIELD,
+                self.tr('Track ID Field'),
+                parentLayerParameterName=self.INPUT,
+                optional=True
+            )
+        )
+         
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.TIMESTAMP_FIELD,
+                self.tr('Timestamp Field'),
+                parentLayerParameterName=self.INPUT,
+                optional=True
+            )
+        )
+         
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.STREAMING,
+                self.tr('Input is already ordered by track and time (streaming)'),
+                False
+            )
+        )
+         
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_TIME_GAP,
+                self.tr('Split Traces at Time Gaps Longer Than (seconds, 0 to disable)'),
+                QgsProcessingParameterNumber.Double,
+                0, False, 0
+            )
+        )
+         
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_DISTANCE_GAP,
+                self.tr('Split Traces at Distance Gaps Longer Than (meters, 0 to disable)'),
+                QgsProcessingParameterNumber.Double,
+                0, False, 0
+            )
+        )
+         
         self.addParameter(
             QgsProcessingParameterString(
                 self.SERVICE,
@@ -40,6 +169,61 @@ class ExportLayoutAlgorithm(QgsProcessingAlgorithm):
             )
         )
          
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CHUNK_SIZE,
+                self.tr('Points per Request'),
+                QgsProcessingParameterNumber.Integer,
+                100, False, 2
+            )
+        )
+         
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.OVERLAP,
+                self.tr('Overlapping Points between Requests'),
+                QgsProcessingParameterNumber.Integer,
+                10, False, 0
+            )
+        )
+         
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.THREADS,
+                self.tr('Concurrent Requests'),
+                QgsProcessingParameterNumber.Integer,
+                4, False, 1
+            )
+        )
+         
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.RETRIES,
+                self.tr('Retries per Request'),
+                QgsProcessingParameterNumber.Integer,
+                3, False, 0
+            )
+        )
+         
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.CACHE,
+                self.tr('Response Cache Database (default in the profile folder)'),
+                QgsProcessingParameterFile.File,
+                'sqlite',
+                optional=True
+            )
+        )
+         
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CACHE_SIZE,
+                self.tr('Response Cache Size in MB (0 to disable)'),
+                QgsProcessingParameterNumber.Integer,
+                100, False, 0
+            )
+        )
+         
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 self.OUTPUT,
@@ -51,54 +235,389 @@ class ExportLayoutAlgorithm(QgsProcessingAlgorithm):
         source = self.parameterAsSource(parameters, self.INPUT, context)
         service = self.parameterAsString(parameters, self.SERVICE, context)
         tolerance = self.parameterAsInt(parameters, self.TOLERANCE, context)
+        chunk_size = self.parameterAsInt(parameters, self.CHUNK_SIZE, context)
+        overlap = self.parameterAsInt(parameters, self.OVERLAP, context)
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        retries = self.parameterAsInt(parameters, self.RETRIES, context)
+        track_field = self.parameterAsString(parameters, self.TRACK_FIELD, context)
+        time_field = self.parameterAsString(parameters, self.TIMESTAMP_FIELD, context)
+        cache_path = self.parameterAsFile(parameters, self.CACHE, context)
+        cache_size = self.parameterAsInt(parameters, self.CACHE_SIZE, context)
+        streaming = self.parameterAsBool(parameters, self.STREAMING, context)
+        max_time_gap = self.parameterAsDouble(parameters, self.MAX_TIME_GAP, context)
+        max_distance_gap = self.parameterAsDouble(parameters, self.MAX_DISTANCE_GAP, context)
+        if overlap >= chunk_size:
+            raise QgsProcessingException(
+                self.tr('The overlap must be smaller than the number of points per request'))
+        
+        fields = QgsFields()
+        if track_field:
+            track_id = QgsField(source.fields().field(track_field))
+            track_id.setName('track_id')
+            fields.append(track_id)
+        fields.append(QgsField('confidence', QVariant.Double))
+        fields.append(QgsField('distance', QVariant.Double))
+        fields.append(QgsField('duration', QVariant.Double))
+        self.with_track = bool(track_field)
          
         sink, dest_id = self.parameterAsSink(
             parameters,
             self.OUTPUT,
             context,
-            QgsFields(),
+            fields,
             QgsWkbTypes.LineString,
             source.sourceCrs()
             )
-         
-        # Compute the number of steps to display within the progress bar and
-        # get features from source
+        
+        points = self.readPoints(source, track_field, time_field, feedback)
+        if not streaming:
+            tracks = {}
+            for track, point in points:
+                tracks.setdefault(track, []).append(point)
+            # The sort is stable, so points with equal timestamps keep feature order
+            points = ((track, point) for track, track_points in tracks.items()
+                      for point in sorted(track_points, key=lambda p: p[2]))
+        jobs = self.traceWindows(points, chunk_size, overlap, max_time_gap, max_distance_gap)
+        session = self.createSession(threads, retries)
+        url = service.rstrip('/') + '/match/v1/driving/'
+        cache = None
+        if cache_size:
+            if not cache_path:
+                cache_path = os.path.join(QgsApplication.qgisSettingsDirPath(),
+                                          'snap_to_roads_cache.sqlite')
+            cache = ResponseCache(cache_path, cache_size * 1024 * 1024)
+        
+        def match(job):
+            if feedback.isCanceled():
+                return None
+            return self.matchWindow(session, cache, url, job[3], tolerance,
+                                    bool(time_field))
+        
         total = 100.0 / source.featureCount() if source.featureCount() else 0
-        features = source.getFeatures()
-         
-        coordinate_list = []
-        for current, f in enumerate(features):
+        traces = 0
+        requests_sent = 0
+        try:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                # Windows of all traces share the pool, so tracks are matched
+                # in parallel. Results come back in order, so every window is
+                # stitched to the previous window of its trace and written as
+                # soon as both are available.
+                previous = None
+                previous_seam = None
+                open_line = None
+                for job, result in self.orderedResults(executor, match, jobs, 2 * threads):
+                    if feedback.isCanceled():
+                        break
+                    trace, track, window, window_points, read = job
+                    requests_sent += 1
+                    if previous is not None:
+                        seam = None
+                        if previous[0] == trace:
+                            seam = self.seam(previous[2], previous[3], window, result)
+                        open_line = self.writePieces(
+                            sink, previous[1],
+                            self.pieces(previous[2], previous[3], previous_seam, seam),
+                            open_line)
+                        if seam is None:
+                            self.writeLine(sink, previous[1], open_line)
+                            open_line = None
+                        previous_seam = seam
+                    if previous is None or previous[0] != trace:
+                        traces += 1
+                    previous = (trace, track, window, result)
+                    feedback.setProgress(int(read * total))
+                if previous is not None and not feedback.isCanceled():
+                    open_line = self.writePieces(
+                        sink, previous[1],
+                        self.pieces(previous[2], previous[3], previous_seam, None),
+                        open_line)
+                    self.writeLine(sink, previous[1], open_line)
+        finally:
+            session.close()
+            if cache is not None:
+                cache.close()
+        feedback.pushInfo(self.tr('Matched {} traces in {} requests').format(
+            traces, requests_sent))
+        if cache is not None:
+            feedback.pushInfo(self.tr('Response cache: {} hits, {} misses').format(
+                cache.hits, cache.misses))
+             
+        return {self.OUTPUT: dest_id}
+    
+    def readPoints(self, source, track_field, time_field, feedback):
+        """
+        Yields (track, (x, y, timestamp)) for every trace point in feature
+        order, reading the features one at a time. Points without a timestamp
+        are skipped.
+        """
+        request = QgsFeatureRequest()
+        attributes = [name for name in (track_field, time_field) if name]
+        if attributes:
+            request.setSubsetOfAttributes(attributes, source.fields())
+        else:
+            request.setNoAttributes()
+        skipped = 0
+        for f in source.getFeatures(request):
             # Stop the algorithm if cancel button has been clicked
             if feedback.isCanceled():
                 break
             geom = f.geometry().asPoint()
-            coordinates = '{},{}'.format(geom.x(), geom.y())
-            coordinate_list.append(coordinates)
-            feedback.setProgress(int(current * total))
-        coordinate_str = ';'.join(coordinate_list)
-        radius = ['{}'.format(tolerance)]
-        radius_str = ';'.join(radius*len(coordinate_list))
-        service_url = '/match/v1/driving/{}'.format(coordinate_str)
-        request_url = service + service_url
-        payload = {'geometries': 'geojson', 'steps': 'false', 'radiuses': radius_str}
-        r = requests.get(request_url, params=payload)
-        results = r.json()
-         
-        for match in results['matchings']:
-            coords = match['geometry']['coordinates']
-            point_list = [QgsPoint(coord[0], coord[1]) for coord in coords]
-            out_f = QgsFeature()
-            out_f.setGeometry(QgsGeometry.fromPolyline(point_list))
-            sink.addFeature(out_f, QgsFeatureSink.FastInsert)
-             
-        return {self.OUTPUT: sink} 
+            track = f[track_field] if track_field else None
+            if time_field:
+                timestamp = self.timeValue(f[time_field])
+                if timestamp is None:
+                    skipped += 1
+                    continue
+            else:
+                timestamp = 0
+            yield track, (geom.x(), geom.y(), timestamp)
+        if skipped:
+            feedback.pushInfo(self.tr('{} points without a timestamp were skipped').format(skipped))
+    
+    def timeValue(self, value):
+        """Converts a date/time, number or ISO formatted string to seconds since the epoch"""
+        if value is None or value == NULL:
+            return None
+        if isinstance(value, QDate):
+            value = QDateTime(value)
+        if isinstance(value, QDateTime):
+            return value.toMSecsSinceEpoch() / 1000.0 if value.isValid() else None
+        if isinstance(value, str):
+            parsed = QDateTime.fromString(value, Qt.ISODate)
+            if parsed.isValid():
+                return parsed.toMSecsSinceEpoch() / 1000.0
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    
+    def traceWindows(self, points, size, overlap, max_time_gap, max_distance_gap):
+        """
+        Splits the ordered (track, point) pairs into traces at track changes,
+        at gaps longer than the limits and where time goes backwards, and
+        yields windows of at most size points overlapping their neighbours by
+        overlap points, as (trace, track, (start, end), points, points read).
+        Only the points of the current window are kept in memory.
+        """
+        trace = 0
+        window_points = []
+        start = 0
+        fresh = 0
+        read = 0
+        previous = None
+        for track, point in points:
+            read += 1
+            if previous is not None and (track != previous[0] or self.isGap(
+                    previous[1], point, max_time_gap, max_distance_gap)):
+                if fresh:
+                    yield (trace, previous[0], (start, start + len(window_points)),
+                           window_points, read)
+                trace += 1
+                window_points = []
+                start = 0
+                fresh = 0
+            window_points.append(point)
+            fresh += 1
+            if len(window_points) == size:
+                yield (trace, track, (start, start + size), window_points, read)
+                window_points = window_points[size - overlap:]
+                start += size - overlap
+                fresh = 0
+            previous = (track, point)
+        if fresh:
+            yield (trace, previous[0], (start, start + len(window_points)),
+                   window_points, read)
+    
+    def isGap(self, previous, point, max_time_gap, max_distance_gap):
+        """Whether a trace has to be split between two consecutive points"""
+        if point[2] < previous[2]:
+            return True
+        if max_time_gap and point[2] - previous[2] > max_time_gap:
+            return True
+        if max_distance_gap:
+            # Haversine distance between the WGS84 coordinates, in meters
+            lon1, lat1, lon2, lat2 = map(math.radians, (previous[0], previous[1], point[0], point[1]))
+            a = math.sin((lat2 - lat1) / 2) ** 2 + \
+                math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+            return 2 * 6371008.8 * math.asin(math.sqrt(a)) > max_distance_gap
+        return False
+    
+    def orderedResults(self, executor, function, jobs, ahead):
+        """
+        Yields (job, result) in job order while at most `ahead` jobs are
+        queued or running, so the jobs are consumed lazily
+        """
+        pending = deque()
+        for job in jobs:
+            pending.append((job, executor.submit(function, job)))
+            if len(pending) >= ahead:
+                job, future = pending.popleft()
+                yield job, future.result()
+        while pending:
+            job, future = pending.popleft()
+            yield job, future.result()
+    
+    def createSession(self, threads, retries):
+        """HTTP session keeping one connection per thread alive and retrying failed requests with backoff"""
+        session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5,
+                      status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=threads, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+    
+    def matchWindow(self, session, cache, url, points, tolerance, timestamps):
+        """
+        Sends one map matching request, unless the response is in the cache,
+        returning the OSRM response or None if nothing matched
+        """
+        if len(points) < 2:
+            return None
+        radius_str = ';'.join(['{}'.format(tolerance)] * len(points))
+        payload = {'geometries': 'geojson', 'overview': 'full', 'steps': 'false',
+                   'radiuses': radius_str}
+        if timestamps:
+            payload['timestamps'] = ';'.join('{}'.format(int(p[2])) for p in points)
+        request_url = url + ';'.join('{},{}'.format(p[0], p[1]) for p in points)
+        key = ResponseCache.key(request_url, payload) if cache is not None else None
+        results = cache.get(key) if cache is not None else None
+        if results is None:
+            try:
+                r = session.get(request_url, params=payload)
+                results = r.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                # Raised once the retries have run out, or for a response which is not JSON
+                raise QgsProcessingException(self.tr('OSRM request failed: {}').format(e))
+            if results.get('code') not in ('Ok', 'NoMatch'):
+                raise QgsProcessingException(self.tr('OSRM request failed: {}').format(
+                    results.get('message', r.status_code)))
+            if cache is not None:
+                cache.put(key, results)
+        if results.get('code') == 'NoMatch':
+            return None
+        return results
+    
+    def seam(self, window, result, next_window, next_result):
+        """
+        Picks the trace point where two overlapping windows are joined: the one
+        closest to the middle of the overlap which is matched in both windows.
+        Returns (index, joined), where joined is False if there is no such
+        point and the windows are split in the middle of the overlap instead.
+        """
+        start, end = next_window[0], window[1]
+        middle = (start + end - 1) / 2.0
+        if result is not None and next_result is not None:
+            shared = [i for i in range(start, end)
+                      if result['tracepoints'][i - window[0]] is not None and
+                      next_result['tracepoints'][i - start] is not None]
+            if shared:
+                return (min(shared, key=lambda i: abs(i - middle)), True)
+        return (int(middle), False)
+    
+    def pieces(self, window, result, first_seam, last_seam):
+        """
+        Cuts the matchings of a window to the trace points it owns: from the seam
+        with the previous window to the seam with the next one. Returns tuples
+        of (line, starts at a joined seam, ends at a joined seam, confidence,
+        distance, duration), with the distance and duration of the matching
+        shared out by the length of the cut.
+        """
+        if result is None:
+            return []
+        low = window[0]
+        if first_seam is not None:
+            low = first_seam[0] if first_seam[1] else first_seam[0] + 1
+        high = window[1] - 1 if last_seam is None else last_seam[0]
+        # Runs of owned trace points matched to the same matching
+        runs = []
+        for i in range(low, high + 1):
+            tracepoint = result['tracepoints'][i - window[0]]
+            if tracepoint is None:
+                continue
+            if runs and runs[-1][0] == tracepoint['matchings_index']:
+                runs[-1][2] = i
+            else:
+                runs.append([tracepoint['matchings_index'], i, i])
+        pieces = []
+        for matching, first, last in runs:
+            matched = result['matchings'][matching]
+            line, share = self.cutMatching(
+                matched['geometry']['coordinates'],
+                result['tracepoints'][first - window[0]]['location'],
+                result['tracepoints'][last - window[0]]['location'])
+            pieces.append((line,
+                           first_seam is not None and first_seam[1] and first == low,
+                           last_seam is not None and last_seam[1] and last == high,
+                           matched['confidence'],
+                           matched['distance'] * share,
+                           matched['duration'] * share))
+        return pieces
+    
+    def cutMatching(self, coordinates, start, end):
+        """
+        Returns the part of a matched line between two snapped trace point
+        locations, and the share of the line's length it makes up
+        """
+        line = QgsLineString([QgsPoint(x, y) for x, y in coordinates])
+        geometry = QgsGeometry(line.clone())
+        a = geometry.lineLocatePoint(QgsGeometry.fromPointXY(QgsPointXY(*start)))
+        b = geometry.lineLocatePoint(QgsGeometry.fromPointXY(QgsPointXY(*end)))
+        length = line.length()
+        return line.curveSubstring(a, max(a, b)), (max(a, b) - a) / length if length else 0
+    
+    def writePieces(self, sink, track, pieces, open_line):
+        """
+        Writes the pieces of a window, continuing the line left open by the
+        previous window at a joined seam. Returns the line left open at the end
+        as [line, confidence, distance, duration]. A joined line keeps the
+        lowest confidence of its pieces.
+        """
+        for line, joined_start, joined_end, confidence, distance, duration in pieces:
+            if joined_start and open_line is not None:
+                open_line[0].append(line)
+                open_line[1] = min(open_line[1], confidence)
+                open_line[2] += distance
+                open_line[3] += duration
+            else:
+                self.writeLine(sink, track, open_line)
+                open_line = [line, confidence, distance, duration]
+            if not joined_end:
+                self.writeLine(sink, track, open_line)
+                open_line = None
+        return open_line
+    
+    def writeLine(self, sink, track, open_line):
+        if open_line is None:
+            return
+        geometry = QgsGeometry(open_line[0])
+        geometry.removeDuplicateNodes()
+        if geometry.constGet().numPoints() < 2:
+            return
+        out_f = QgsFeature()
+        out_f.setGeometry(geometry)
+        out_f.setAttributes(([track] if self.with_track else []) + open_line[1:])
+        sink.addFeature(out_f, QgsFeatureSink.FastInsert)
+        
     def name(self):
         return 'snap_to_roads'
     def displayName(self):
         return self.tr('Snap to Roads')
          
     def shortHelpString(self):
-        return self.tr('Snaps GPS Trackpoints to OSM roads using OSRM service')
+        return self.tr('Snaps GPS Trackpoints to OSM roads using OSRM service. '
+                       'Long traces are split into overlapping requests which are '
+                       'sent concurrently, and the matched lines are joined again '
+                       'at a trace point matched in both overlapping requests.\n'
+                       'Points can be grouped into tracks by a track ID field and '
+                       'ordered by a timestamp field. Each line gets the OSRM '
+                       'confidence and its share of the matched distance and '
+                       'duration.\n'
+                       'Traces are split at time or distance gaps and timestamps '
+                       'are sent to OSRM. In streaming mode the input has to be '
+                       'ordered by track and time already: points are then read, '
+                       'matched and written as they come, so memory use does not '
+                       'grow with the number of points.')
     def group(self):
         return self.tr(self.groupId())
     def groupId(self):
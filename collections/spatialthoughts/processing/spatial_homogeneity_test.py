@@ -0,0 +1,340 @@
+import numpy as np
+from array import array
+from PyQt5.QtCore import QCoreApplication, QVariant
+
+from qgis.core import (QgsProcessing, QgsProcessingAlgorithm,
+    QgsProcessingParameterFeatureSource, QgsProcessingParameterNumber,
+    QgsProcessingParameterFeatureSink, QgsProcessingParameterField,
+    QgsFields, QgsField, QgsFeatureSink, QgsProcessingUtils,
+    QgsProcessingMultiStepFeedback, QgsFeatureRequest, NULL)
+
+
+class SpatialHomogeneityTestAlgorithm(QgsProcessingAlgorithm):
+    """
+    Flags stations whose value deviates from the values of their neighbors,
+    like the Spatial Homogeneity Test model.
+
+    The model computes each statistic with a field calculator step which
+    rewrites the layer and looks up every neighbor with get_feature. Here the
+    coordinates, values and neighbor lists are read once into NumPy arrays,
+    the statistics of all stations are computed together, and the results
+    are written in a second pass over the layer.
+    """
+    INPUT = 'INPUT'
+    NAME_FIELD = 'NAME_FIELD'
+    VALUE_FIELD = 'VALUE_FIELD'
+    NEIGHBORS_FIELD = 'NEIGHBORS_FIELD'
+    DEVIATION = 'DEVIATION'
+    PERMUTATIONS = 'PERMUTATIONS'
+    SEED = 'SEED'
+    OUTPUT = 'OUTPUT'
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr('Stations'),
+                types=[QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.NAME_FIELD,
+                self.tr('Station Name Field'),
+                parentLayerParameterName=self.INPUT
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.VALUE_FIELD,
+                self.tr('Precipitation Field'),
+                parentLayerParameterName=self.INPUT,
+                type=QgsProcessingParameterField.Numeric
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.NEIGHBORS_FIELD,
+                self.tr('Neighbors Field (comma separated station names)'),
+                parentLayerParameterName=self.INPUT,
+                type=QgsProcessingParameterField.String
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.DEVIATION,
+                self.tr('Acceptable Deviation (mm)'),
+                QgsProcessingParameterNumber.Double,
+                75, False, 0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PERMUTATIONS,
+                self.tr('Number of Permutations for p-values (0 for none)'),
+                QgsProcessingParameterNumber.Integer,
+                0, False, 0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SEED,
+                self.tr('Random Seed'),
+                QgsProcessingParameterNumber.Integer,
+                optional=True,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Stations with Neighbors'),
+                QgsProcessing.TypeVectorPoint
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        name_field = self.parameterAsString(parameters, self.NAME_FIELD, context)
+        value_field = self.parameterAsString(parameters, self.VALUE_FIELD, context)
+        neighbors_field = self.parameterAsString(parameters, self.NEIGHBORS_FIELD, context)
+        deviation = self.parameterAsDouble(parameters, self.DEVIATION, context)
+        permutations = self.parameterAsInt(parameters, self.PERMUTATIONS, context)
+        seed = None
+        if parameters.get(self.SEED) is not None:
+            seed = self.parameterAsInt(parameters, self.SEED, context)
+
+        newFields = QgsFields()
+        newFields.append(QgsField('N', QVariant.Int))
+        newFields.append(QgsField('P_est', QVariant.Double, len=20, prec=3))
+        newFields.append(QgsField('mean', QVariant.Double, len=20, prec=3))
+        newFields.append(QgsField('stdev', QVariant.Double, len=20, prec=3))
+        newFields.append(QgsField('absdiff', QVariant.Double, len=20, prec=3))
+        newFields.append(QgsField('suspect', QVariant.String))
+        if permutations:
+            newFields.append(QgsField('p_value', QVariant.Double))
+        outputFields = QgsProcessingUtils.combineFields(source.fields(), newFields)
+        sink, dest_id = self.parameterAsSink(
+            parameters,
+            self.OUTPUT,
+            context,
+            outputFields,
+            source.wkbType(),
+            source.sourceCrs()
+        )
+        steps = QgsProcessingMultiStepFeedback(3 if permutations else 2, feedback)
+
+        # First pass: ids, coordinates and values go to compact typed arrays,
+        # names and neighbor lists to lists until the names are resolved
+        feedback.pushInfo(self.tr('Reading stations'))
+        request = QgsFeatureRequest().setSubsetOfAttributes(
+            [name_field, value_field, neighbors_field], source.fields())
+        ids = array('q')
+        coords = array('d')
+        values = array('d')
+        names = []
+        neighbor_names = []
+        total = 100.0 / source.featureCount() if source.featureCount() else 0
+        for current, f in enumerate(source.getFeatures(request)):
+            if feedback.isCanceled():
+                return {}
+            geometry = f.geometry()
+            if geometry.isEmpty():
+                continue
+            point = geometry.asPoint() if not geometry.isMultipart() else geometry.centroid().asPoint()
+            ids.append(f.id())
+            coords.append(point.x())
+            coords.append(point.y())
+            value = f[value_field]
+            values.append(np.nan if value == NULL else float(value))
+            names.append(str(f[name_field]))
+            neighbors = f[neighbors_field]
+            neighbor_names.append([] if neighbors == NULL else
+                                  [name.strip() for name in str(neighbors).split(',') if name.strip()])
+            steps.setProgress(int(current * total))
+        ids = np.frombuffer(ids, dtype=np.int64)
+        xy = np.frombuffer(coords, dtype=float).reshape(-1, 2)
+        values = np.frombuffer(values, dtype=float)
+
+        # Neighbor lists as one index array with the offsets of each station
+        rows = {name: row for row, name in enumerate(names)}
+        counts = array('q')
+        neighbors = array('q')
+        unknown = 0
+        for station_neighbors in neighbor_names:
+            found = [rows[name] for name in station_neighbors if name in rows]
+            unknown += len(station_neighbors) - len(found)
+            neighbors.extend(found)
+            counts.append(len(found))
+        if unknown:
+            feedback.pushInfo(self.tr('Skipped {} neighbor names which are not '
+                                      'station names').format(unknown))
+        del names, neighbor_names, rows
+        counts = np.frombuffer(counts, dtype=np.int64)
+        neighbors = np.frombuffer(neighbors, dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        feedback.pushInfo(self.tr('Computing statistics'))
+        P_est, mean, stdev, absdiff = homogeneity_statistics(xy, values, neighbors, offsets)
+        if permutations:
+            steps.setCurrentStep(1)
+            feedback.pushInfo(self.tr('Running {} permutations').format(permutations))
+            p_values = permutation_pvalues(xy, values, neighbors, offsets, absdiff,
+                                           permutations, seed, steps)
+            if feedback.isCanceled():
+                return {}
+
+        # Second pass: features are read again and written one at a time, the
+        # position of each id is looked up in the sorted ids
+        steps.setCurrentStep(2 if permutations else 1)
+        feedback.pushInfo(self.tr('Writing results'))
+        order = np.argsort(ids)
+        sorted_ids = ids[order]
+        for current, out_f in enumerate(source.getFeatures()):
+            if feedback.isCanceled():
+                break
+            attributes = out_f.attributes()
+            found = np.searchsorted(sorted_ids, out_f.id())
+            index = order[found] if found < len(ids) and sorted_ids[found] == out_f.id() else None
+            if index is None:
+                # Features without geometry are not tested
+                attributes.extend([NULL] * newFields.count())
+            else:
+                n = counts[index].item()
+                attributes.append(n)
+                attributes.extend(number(column[index]) for column in (P_est, mean, stdev, absdiff))
+                if n <= 2:
+                    attributes.append('No')
+                elif np.isnan(absdiff[index]):
+                    attributes.append(NULL)
+                elif absdiff[index] <= deviation and absdiff[index] <= 2 * stdev[index]:
+                    attributes.append('No')
+                else:
+                    attributes.append('Yes')
+                if permutations:
+                    attributes.append(number(p_values[index]))
+
+            out_f.setAttributes(attributes)
+            sink.addFeature(out_f, QgsFeatureSink.FastInsert)
+            steps.setProgress(int(current * total))
+        return {self.OUTPUT: dest_id}
+
+    def name(self):
+        return 'spatial_homogeneity_test'
+
+    def displayName(self):
+        return self.tr('Spatial Homogeneity Test')
+
+    def shortHelpString(self):
+        return self.tr('Spatial homogeneity test of raingauge data. For every '
+                       'station, the neighbors field lists the names of its '
+                       'neighboring stations. The precipitation is estimated '
+                       'from the neighbors by inverse distance squared weighting '
+                       '(P_est), together with the mean and standard deviation '
+                       'of the neighbor values. A station is suspect when the '
+                       'absolute difference between its value and the estimate '
+                       '(absdiff) is more than the acceptable deviation or more '
+                       'than twice the standard deviation, unless it has 2 '
+                       'neighbors or less.\n'
+                       'Unlike the model, N only counts the neighbor names '
+                       'which match a station, the other names are skipped '
+                       'instead of making the statistics NULL. A station '
+                       'without a value, or with a neighbor at the same '
+                       'location, gets a NULL suspect flag where the model '
+                       'flags it with Yes.\n'
+                       'With permutations, p_value is the share of random '
+                       'permutations, where the neighbor values are drawn from '
+                       'the other stations, with an absdiff at least as large '
+                       'as the observed one. Set a random seed for repeatable '
+                       'p-values.')
+
+    def group(self):
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        return ''
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return SpatialHomogeneityTestAlgorithm()
+
+
+# Number of neighbor values drawn at once for the permutations
+CHUNK_ELEMENTS = 2 ** 22
+
+
+def number(value):
+    """Returns the NumPy value as a float, or NULL when it is not a number"""
+    return NULL if np.isnan(value) else value.item()
+
+
+def neighbor_weights(xy, neighbors, offsets):
+    """Inverse squared distance weights of the neighbors, and the station of each neighbor"""
+    owner = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    squared = ((xy[owner] - xy[neighbors]) ** 2).sum(axis=1)
+    with np.errstate(divide='ignore'):
+        weights = 1 / squared
+    return owner, weights
+
+
+def homogeneity_statistics(xy, values, neighbors, offsets):
+    """
+    Computes, for every station, the inverse distance weighted estimate, mean
+    and standard deviation of the values of its neighbors and the absolute
+    difference between its value and the estimate. Stations without
+    neighbors, or with a neighbor at the same location, get NaN.
+    """
+    owner, weights = neighbor_weights(xy, neighbors, offsets)
+    n = len(values)
+    counts = np.diff(offsets)
+    neighbor_values = values[neighbors]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        P_est = np.bincount(owner, weights * neighbor_values, n) / np.bincount(owner, weights, n)
+        mean = np.bincount(owner, neighbor_values, n) / counts
+        stdev = np.sqrt(np.bincount(owner, (neighbor_values - mean[owner]) ** 2, n) / counts)
+    P_est[counts == 0] = np.nan
+    return P_est, mean, stdev, np.abs(P_est - values)
+
+
+def permutation_pvalues(xy, values, neighbors, offsets, absdiff, permutations, seed=None, feedback=None):
+    """
+    Monte Carlo p-values of the absolute differences. In every permutation the
+    value of each neighbor is replaced by the value of a random other station,
+    keeping the distance weights, and the estimate is computed again. A batch
+    of permutations is computed at once, as one array per batch.
+    """
+    owner, weights = neighbor_weights(xy, neighbors, offsets)
+    n = len(values)
+    rng = np.random.default_rng(seed)
+    tested = np.flatnonzero(np.diff(offsets) > 0)
+    starts = offsets[tested]
+    total_weights = np.add.reduceat(weights, starts)
+    exceed = np.zeros(len(tested), dtype=np.int64)
+    batch = max(1, CHUNK_ELEMENTS // max(len(neighbors), 1))
+    done = 0
+    while done < permutations and len(tested) and n > 1:
+        if feedback is not None and feedback.isCanceled():
+            break
+        size = min(batch, permutations - done)
+        # Draw from the n - 1 other stations by skipping the station itself
+        drawn = rng.integers(0, n - 1, size=(size, len(neighbors)))
+        drawn += drawn >= owner
+        with np.errstate(invalid='ignore'):
+            estimates = np.add.reduceat(weights * values[drawn], starts, axis=1) / total_weights
+            exceed += (np.abs(estimates - values[tested]) >= absdiff[tested]).sum(axis=0)
+        done += size
+        if feedback is not None:
+            feedback.setProgress(100 * done / permutations)
+    p_values = np.full(n, np.nan)
+    p_values[tested] = (exceed + 1) / (done + 1)
+    p_values[np.isnan(absdiff)] = np.nan
+    return p_values
@@ -0,0 +1,268 @@
+import importlib.util
+import math
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing, QgsProcessingAlgorithm,
+    QgsProcessingParameterFeatureSource, QgsProcessingParameterNumber,
+    QgsProcessingParameterFeatureSink, QgsProcessingUtils,
+    QgsFields, QgsField, QgsFeature, QgsFeatureSink, QgsGeometry,
+    QgsPointXY, QgsWkbTypes)
+
+# The balanced k-means is shared with the Constrained K-Means script, which
+# is installed in the same folder
+_spec = importlib.util.spec_from_file_location('constrainted_kmeans', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'constrainted_kmeans.py'))
+constrainted_kmeans = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(constrainted_kmeans)
+
+
+class SplitPolygonsAlgorithm(QgsProcessingAlgorithm):
+    """
+    Splits every polygon into a number of parts of roughly equal area.
+
+    Each polygon is covered with a jittered grid of sample points, the
+    points are grouped into equal sized clusters with the balanced k-means
+    of the Constrained K-Means script. Every part is the union of the Voronoi
+    cells of the sample points of one cluster, clipped to the polygon, so the
+    parts have about the same number of sample points and hence about the
+    same area. This follows the Split Polygons model (random points, k-means,
+    Voronoi polygons and intersection) per polygon in memory, with equal
+    sized clusters.
+    Polygons are split independently in a thread pool and the parts are
+    written in input order.
+    """
+    INPUT = 'INPUT'
+    PARTS = 'PARTS'
+    POINTS = 'POINTS'
+    THREADS = 'THREADS'
+    SEED = 'SEED'
+    OUTPUT = 'OUTPUT'
+    # Number of polygons read before dispatching them to the pool
+    BATCH_SIZE = 1000
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr('Polygons'),
+                types=[QgsProcessing.TypeVectorPolygon]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PARTS,
+                self.tr('Number of Parts'),
+                QgsProcessingParameterNumber.Integer,
+                3, False, 1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.POINTS,
+                self.tr('Sample Points per Polygon'),
+                QgsProcessingParameterNumber.Integer,
+                1000, False, 10
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.THREADS,
+                self.tr('Number of Threads'),
+                QgsProcessingParameterNumber.Integer,
+                1, False, 1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SEED,
+                self.tr('Random Seed'),
+                QgsProcessingParameterNumber.Integer,
+                optional=True,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Split Polygons'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        parts = self.parameterAsInt(parameters, self.PARTS, context)
+        samples = self.parameterAsInt(parameters, self.POINTS, context)
+        threads = self.parameterAsInt(parameters, self.THREADS, context)
+        seed = None
+        if parameters.get(self.SEED) is not None:
+            seed = self.parameterAsInt(parameters, self.SEED, context)
+        # Without a seed every run draws fresh entropy, shared by all polygons
+        entropy = seed if seed is not None else np.random.SeedSequence().entropy
+
+        newFields = QgsFields()
+        newFields.append(QgsField('PART_ID', QVariant.Int))
+        outputFields = QgsProcessingUtils.combineFields(source.fields(), newFields)
+        sink, dest_id = self.parameterAsSink(
+            parameters,
+            self.OUTPUT,
+            context,
+            outputFields,
+            QgsWkbTypes.MultiPolygon,
+            source.sourceCrs()
+        )
+
+        def split(feature):
+            # Seeded by the feature id, so the result does not depend on threads.
+            # Seed sequences only take non-negative numbers, and unsaved
+            # features have negative ids.
+            rng = np.random.default_rng(np.random.SeedSequence(
+                [entropy, feature.id() & 0xFFFFFFFFFFFFFFFF]))
+            return split_polygon(feature.geometry(), parts, samples, rng)
+
+        total = 100.0 / source.featureCount() if source.featureCount() else 0
+        batch = []
+        current = 0
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for feature in source.getFeatures():
+                if feedback.isCanceled():
+                    break
+                batch.append(feature)
+                if len(batch) == self.BATCH_SIZE:
+                    current += self.writeBatch(batch, executor.map(split, batch), sink)
+                    batch = []
+                    feedback.setProgress(int(current * total))
+            if batch and not feedback.isCanceled():
+                current += self.writeBatch(batch, executor.map(split, batch), sink)
+                feedback.setProgress(int(current * total))
+        return {self.OUTPUT: dest_id}
+
+    def writeBatch(self, features, results, sink):
+        for feature, geometries in zip(features, results):
+            for part, geometry in enumerate(geometries):
+                out_f = QgsFeature()
+                geometry.convertToMultiType()
+                out_f.setGeometry(geometry)
+                out_f.setAttributes(feature.attributes() + [part + 1])
+                sink.addFeature(out_f, QgsFeatureSink.FastInsert)
+        return len(features)
+
+    def name(self):
+        return 'split_polygons'
+
+    def displayName(self):
+        return self.tr('Split Polygons into Equal Parts')
+
+    def shortHelpString(self):
+        return self.tr('Splits every polygon into the given number of parts of '
+                       'roughly equal area. Each polygon is sampled with a '
+                       'jittered grid of points which are grouped into equal '
+                       'sized clusters, and each part is made of the Voronoi '
+                       'cells of the points of one cluster, so the parts have '
+                       'jagged borders. More sample points give more equal areas '
+                       'and smoother borders. Set a random seed for repeatable '
+                       'results.')
+
+    def group(self):
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        return ''
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return SplitPolygonsAlgorithm()
+
+
+def split_polygon(geometry, parts, samples, rng):
+    """Returns the parts of the polygon, or the polygon itself when it cannot be split"""
+    if geometry.isEmpty() or parts < 2:
+        return [geometry]
+    data = sample_polygon(geometry, samples, rng)
+    if len(data) < parts:
+        return [geometry]
+    demand = [len(data) // parts] * parts
+    limit = [math.ceil(len(data) / parts)] * parts
+    _, M, _ = constrainted_kmeans.constrained_kmeans(
+        data, demand, maxiter=10, solver='prices', limit=limit, seed=rng)
+
+    # Each sample point stands for its Voronoi cell, so a part is the union
+    # of the cells of one cluster and the parts follow the balanced
+    # assignment instead of the nearest cluster center
+    box = geometry.boundingBox()
+    box.grow(max(box.width(), box.height()))
+    points = QgsGeometry.fromMultiPointXY([QgsPointXY(x, y) for x, y in data])
+    cells = points.voronoiDiagram(QgsGeometry.fromRect(box)).asGeometryCollection()
+    # The Voronoi cells do not come in the order of the points, but every
+    # cell is convex, so its centroid is closest to the point of the cell
+    centroids = np.array([(c.x(), c.y()) for c in (cell.centroid().asPoint() for cell in cells)])
+    labels = M[nearest_points(centroids, data)]
+
+    engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+    engine.prepareGeometry()
+    result = []
+    for i in range(parts):
+        cluster = QgsGeometry.unaryUnion([cells[j] for j in np.flatnonzero(labels == i)])
+        part = QgsGeometry(engine.intersection(cluster.constGet()))
+        if not part.isEmpty():
+            result.append(part)
+    return result
+
+
+def nearest_points(points, data):
+    """Returns the index of the nearest data point of every point, in chunks of CHUNK_ELEMENTS distances"""
+    nearest = np.empty(len(points), dtype=int)
+    chunk = max(1, CHUNK_ELEMENTS // len(data))
+    for start in range(0, len(points), chunk):
+        d = ((points[start:start + chunk, np.newaxis, :] - data[np.newaxis, :, :]) ** 2).sum(axis=2)
+        nearest[start:start + chunk] = d.argmin(axis=1)
+    return nearest
+
+
+def sample_polygon(geometry, samples, rng):
+    """
+    Covers the polygon with a grid of about `samples` points, each moved
+    randomly within its grid cell, and keeps the points inside the polygon
+    with a vectorized even-odd test against all ring edges.
+    """
+    box = geometry.boundingBox()
+    spacing = math.sqrt(geometry.area() / samples)
+    if spacing <= 0:
+        return np.empty((0, 2))
+    if QgsWkbTypes.isCurvedType(geometry.wkbType()):
+        geometry = QgsGeometry(geometry.constGet().segmentize())
+    xs = np.arange(box.xMinimum(), box.xMaximum(), spacing)
+    ys = np.arange(box.yMinimum(), box.yMaximum(), spacing)
+    grid = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+    points = grid + rng.random(grid.shape) * spacing
+
+    edges = []
+    for polygon in geometry.asMultiPolygon() if geometry.isMultipart() else [geometry.asPolygon()]:
+        for ring in polygon:
+            ring = np.array([(p.x(), p.y()) for p in ring])
+            edges.append(np.hstack([ring[:-1], ring[1:]]))
+    edges = np.vstack(edges)
+    x1, y1, x2, y2 = edges.T
+    inside = np.zeros(len(points), dtype=bool)
+    chunk = max(1, CHUNK_ELEMENTS // len(edges))
+    for start in range(0, len(points), chunk):
+        px = points[start:start + chunk, 0, np.newaxis]
+        py = points[start:start + chunk, 1, np.newaxis]
+        straddles = (y1 > py) != (y2 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing = px < x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside[start:start + chunk] = np.count_nonzero(straddles & crossing, axis=1) % 2 == 1
+    return points[inside]
+
+
+# Number of point-sample distances computed at once
+CHUNK_ELEMENTS = 2 ** 22
@@ -0,0 +1,37 @@
+"""
+Fixtures for testing the processing scripts with QGIS in offscreen mode.
+
+Test modules skip themselves when the QGIS Python bindings are not installed.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(REPOSITORY_DIR, 'collections', 'spatialthoughts', 'processing')
+sys.path.insert(0, os.path.join(REPOSITORY_DIR, 'benchmarks'))
+
+
+@pytest.fixture(scope='session')
+def qgis_app():
+    from qgis.core import QgsApplication
+    application = QgsApplication([], False)
+    application.initQgis()
+    yield application
+    application.exitQgis()
+
+
+@pytest.fixture(scope='session')
+def load_script(qgis_app):
+    """Returns a function importing a processing script by file name"""
+    def load(script):
+        name = os.path.splitext(script)[0]
+        spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS_DIR, script))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
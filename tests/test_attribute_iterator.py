@@ -0,0 +1,78 @@
+"""
+Tests of the fields chosen for indexing by Attribute Iterator.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+
+
+@pytest.fixture(scope='module')
+def iterator(load_script):
+    return load_script('attribute_iterator.py')
+
+
+def test_fields_are_selected_by_distinct_values(iterator):
+    from qgis.PyQt.QtCore import QVariant
+    from qgis.core import QgsFeature, QgsField, QgsProcessingFeedback, QgsVectorLayer
+    layer = QgsVectorLayer('Point?crs=EPSG:4326&field=code:integer&field=kind:string',
+                           'points', 'memory')
+    features = []
+    for i in range(10):
+        feature = QgsFeature(layer.fields())
+        feature.setAttributes([i, 'shop' if i % 2 else 'house'])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    # Virtual fields are not stored in the data source and cannot be indexed
+    layer.addExpressionField('"code" * 2', QgsField('twice', QVariant.Int))
+    algorithm = iterator.AttributeIterator()
+    algorithm.report = []
+    assert algorithm.selectFields(layer, 0.5, QgsProcessingFeedback()) == ['code']
+    assert algorithm.report == [('kind', 'attribute', 'skipped', 0.0)]
+    layer.setSubsetString('"kind" = \'shop\'')
+    assert algorithm.selectFields(layer, 0.5, QgsProcessingFeedback()) == ['code', 'kind']
+
+
+def test_geopackage_is_prepared(iterator, tmp_path):
+    import sqlite3
+    from qgis.core import (QgsCoordinateTransformContext, QgsFeature, QgsGeometry,
+                           QgsPointXY, QgsProcessingFeedback, QgsVectorFileWriter,
+                           QgsVectorLayer)
+    memory = QgsVectorLayer('Point?crs=EPSG:4326&field=code:integer', 'points', 'memory')
+    features = []
+    for i in range(10):
+        feature = QgsFeature(memory.fields())
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(i, i)))
+        feature.setAttributes([i])
+        features.append(feature)
+    memory.dataProvider().addFeatures(features)
+    path = str(tmp_path / 'points.gpkg')
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = 'points'
+    error = QgsVectorFileWriter.writeAsVectorFormatV2(
+        memory, path, QgsCoordinateTransformContext(), options)
+    assert error[0] == QgsVectorFileWriter.NoError
+    layer = QgsVectorLayer(path + '|layername=points', 'points', 'ogr')
+
+    algorithm = iterator.AttributeIterator()
+    algorithm.report = []
+    feedback = QgsProcessingFeedback()
+    target = algorithm.sqliteTable(layer)
+    assert target == (path, 'points')
+    algorithm.createSqliteIndexes(target[0], target[1], ['code', 'fid'], feedback)
+    algorithm.createSqliteIndexes(target[0], target[1], ['code'], feedback)
+    algorithm.collectStatistics(layer, target, feedback)
+    assert [row[:3] for row in algorithm.report] == [
+        ('code', 'attribute', 'created'),
+        # The fid is the primary key and needs no index
+        ('fid', 'attribute', 'exists'),
+        ('code', 'attribute', 'exists'),
+        ('statistics', 'statistics', 'created')]
+    connection = sqlite3.connect(path)
+    try:
+        indexes = [row[1] for row in connection.execute('PRAGMA index_list("points")')]
+        assert 'idx_points_code' in indexes
+        assert connection.execute(
+            "SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()[0] == 1
+    finally:
+        connection.close()
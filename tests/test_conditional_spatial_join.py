@@ -0,0 +1,101 @@
+"""
+Tests of the attributes joined by Conditional Spatial Join.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+
+
+@pytest.fixture(scope='module')
+def join(load_script):
+    return load_script('conditional_spatial_join.py')
+
+
+def memory_layer(uri, rows):
+    from qgis.core import QgsFeature, QgsGeometry, QgsVectorLayer
+    layer = QgsVectorLayer(uri, 'layer', 'memory')
+    features = []
+    for wkt, *attributes in rows:
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        feature.setAttributes(attributes)
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def squares():
+    return memory_layer('Polygon?crs=EPSG:3857&field=id:integer', [
+        ('POLYGON((0 0, 10 0, 10 10, 0 10, 0 0))', 1),
+        ('POLYGON((20 20, 30 20, 30 30, 20 30, 20 20))', 2),
+        ('POLYGON((40 40, 50 40, 50 50, 40 50, 40 40))', 3)])
+
+
+def run(join, layer, join_layer, **parameters):
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback, QgsProcessingUtils
+    algorithm = join.ConditionalSpatialJoin().create()
+    parameters = dict({'INPUT': layer, 'JOIN': join_layer, 'PREDICATE': 0,
+                       'JOINFIELD': 'name', 'CONDITION': 0, 'CONDITION_FIELD': 'value',
+                       'THREADS': 1, 'OUTPUT': 'TEMPORARY_OUTPUT'}, **parameters)
+    context = QgsProcessingContext()
+    results, ok = algorithm.run(parameters, context, QgsProcessingFeedback())
+    assert ok
+    output = QgsProcessingUtils.mapLayerFromString(results['OUTPUT'], context)
+    return {f['id']: f for f in output.getFeatures()}
+
+
+def test_largest_overlap_joins_the_largest_and_aggregates_all(join):
+    from qgis.core import NULL
+    parts = memory_layer('Polygon?crs=EPSG:3857&field=name:string&field=value:double', [
+        ('POLYGON((-5 -5, 6 -5, 6 15, -5 15, -5 -5))', 'west', 1.0),
+        ('POLYGON((6 -5, 15 -5, 15 15, 6 15, 6 -5))', 'east', 5.0),
+        ('POLYGON((1 1, 2 1, 2 2, 1 2, 1 1))', 'inner', 9.0)])
+    output = run(join, squares(), parts, PREDICATE=4, AGGREGATES=[0, 1])
+    assert output[1]['name'] == 'west'
+    assert output[1]['join_count'] == 3
+    assert output[1]['sum_value'] == pytest.approx(15.0)
+    assert output[2]['name'] == NULL
+    assert output[2]['join_count'] == 0
+    # The condition picks the highest value among all intersecting features
+    output = run(join, squares(), parts, PREDICATE=0)
+    assert output[1]['name'] == 'inner'
+    output = run(join, squares(), parts, PREDICATE=1, AGGREGATES=[0])
+    assert output[1]['name'] == 'inner'
+    assert output[1]['join_count'] == 1
+
+
+def places():
+    return memory_layer('Point?crs=EPSG:3857&field=name:string&field=value:double', [
+        ('POINT(2 2)', 'a', 5.0),
+        ('POINT(5 5)', 'b', 10.0),
+        ('POINT(8 8)', 'c', None),
+        ('POINT(9 1)', 'd', 2.0),
+        ('POINT(25 25)', 'e', 1.0)])
+
+
+@pytest.mark.parametrize('threads', [1, 2])
+def test_highest_and_lowest_condition(join, threads):
+    from qgis.core import NULL
+    highest = run(join, squares(), places(), CONDITION=0, THREADS=threads)
+    assert [highest[i]['name'] for i in (1, 2, 3)] == ['b', 'e', NULL]
+    # Features without a condition value are never picked
+    lowest = run(join, squares(), places(), CONDITION=1, THREADS=threads)
+    assert [lowest[i]['name'] for i in (1, 2, 3)] == ['d', 'e', NULL]
+
+
+def test_aggregates_of_matching_features(join):
+    from qgis.core import NULL
+    output = run(join, squares(), places(), AGGREGATES=[0, 1, 2, 3, 4], TOPN=2)
+    first = output[1]
+    assert first['join_count'] == 4
+    # Sum and mean only use the features with a condition value
+    assert first['sum_value'] == pytest.approx(17.0)
+    assert first['mean_value'] == pytest.approx(17.0 / 3)
+    assert first['top2_name'] == 'b,a'
+    assert first['nearest_name'] == 'b'
+    empty = output[3]
+    assert empty['join_count'] == 0
+    assert [empty[name] for name in ('sum_value', 'mean_value', 'top2_name', 'nearest_name')] \
+        == [NULL] * 4
+    lowest = run(join, squares(), places(), AGGREGATES=[3], TOPN=2, CONDITION=1)
+    assert lowest[1]['top2_name'] == 'd,a'
@@ -0,0 +1,62 @@
+"""
+Tests of the connectors made by Connect to Nearest Node.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+
+
+@pytest.fixture(scope='module')
+def connect(load_script):
+    return load_script('connect_to_nearest_node.py')
+
+
+def memory_layer(uri, rows):
+    from qgis.core import QgsFeature, QgsGeometry, QgsVectorLayer
+    layer = QgsVectorLayer(uri, 'layer', 'memory')
+    features = []
+    for wkt, *attributes in rows:
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        feature.setAttributes(attributes)
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def run(connect, layer, **parameters):
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback, QgsProcessingUtils
+    # Node a is nearest to the polygon, but b is nearest to an edge midpoint
+    nodes = memory_layer('Point?crs=EPSG:3857&field=name:string', [
+        ('POINT(2 -1)', 'a'), ('POINT(50 -5)', 'b'), ('POINT(50 40)', 'c')])
+    algorithm = connect.ConnectToNearestNode().create()
+    parameters = dict({'INPUT': layer, 'NODES': nodes, 'OUTPUT': 'TEMPORARY_OUTPUT'},
+                      **parameters)
+    context = QgsProcessingContext()
+    results, ok = algorithm.run(parameters, context, QgsProcessingFeedback())
+    assert ok
+    output = QgsProcessingUtils.mapLayerFromString(results['OUTPUT'], context)
+    return sorted(((f['id'], f['rank'], f['name'], f['distance']) for f in output.getFeatures()),
+                  key=lambda row: row[:2])
+
+
+def polygon():
+    return memory_layer('Polygon?crs=EPSG:3857&field=id:integer', [
+        ('POLYGON((0 0, 100 0, 100 10, 0 10, 0 0))', 1)])
+
+
+def test_nearest_connector_beyond_the_nearest_node(connect):
+    assert run(connect, polygon(), NEIGHBORS=1) == [(1, 1, 'b', pytest.approx(5.0))]
+    assert run(connect, polygon(), NEIGHBORS=2) == [
+        (1, 1, 'b', pytest.approx(5.0)), (1, 2, 'a', pytest.approx(40 ** 0.5))]
+
+
+def test_connectors_within_maximum_distance(connect):
+    assert run(connect, polygon(), NEIGHBORS=3, MAX_DISTANCE=7) == [
+        (1, 1, 'b', pytest.approx(5.0)), (1, 2, 'a', pytest.approx(40 ** 0.5))]
+    assert run(connect, polygon(), MAX_DISTANCE=4) == []
+
+
+def test_points_connect_from_themselves(connect):
+    points = memory_layer('Point?crs=EPSG:3857&field=id:integer', [('POINT(50 30)', 7)])
+    assert run(connect, points, NEIGHBORS=1) == [(7, 1, 'c', pytest.approx(10.0))]
@@ -0,0 +1,130 @@
+"""
+Tests of the assignments and clusters of Constrained K-Means Clustering.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+pytest.importorskip('networkx')
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture(scope='module')
+def kmeans(load_script):
+    return load_script('constrainted_kmeans.py')
+
+
+def cost(data, C, M):
+    return np.linalg.norm(data - C[M], axis=1).sum()
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_prices_match_flow_cost(kmeans, seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(50, 300))
+    k = int(rng.integers(2, 12))
+    # Clustered points, so that the minimum sizes move many points
+    data = rng.normal(size=(n, 2)) + rng.normal(scale=5, size=(3, 2))[rng.integers(3, size=n)]
+    C = data[rng.choice(n, k, replace=False)]
+    demand = [int(rng.integers(1, n // k + 1))] * k
+    limit = [n // k + 5] * k if seed % 2 else None
+    M_flow, _ = kmeans.flow_assignment(data, C, demand, limit=limit)
+    M, _ = kmeans.price_assignment(data, C.copy(), demand, limit)
+    sizes = np.bincount(M, minlength=k)
+    assert (sizes >= demand).all()
+    if limit is not None:
+        assert (sizes <= limit).all()
+    assert cost(data, C, M) <= cost(data, C, M_flow) * (1 + 1e-3)
+
+
+def point_layer(points, weights=None):
+    from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer
+    layer = QgsVectorLayer('Point?crs=EPSG:3857&field=id:integer&field=visits:double',
+                           'points', 'memory')
+    features = []
+    for i, (x, y) in enumerate(points):
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(float(x), float(y))))
+        feature.setAttributes([i, float(weights[i]) if weights is not None else 1.0])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def run(kmeans, layer, **parameters):
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback, QgsProcessingUtils
+    algorithm = kmeans.ConstrainedKMeansAlgorithm().create()
+    parameters = dict({'INPUT': layer, 'SEED': 1, 'OUTPUT': 'TEMPORARY_OUTPUT'}, **parameters)
+    context = QgsProcessingContext()
+    results, ok = algorithm.run(parameters, context, QgsProcessingFeedback())
+    if not ok:
+        return None
+    output = QgsProcessingUtils.mapLayerFromString(results['OUTPUT'], context)
+    return {f['id']: f for f in output.getFeatures()}
+
+
+def clustered_points():
+    rng = np.random.default_rng(0)
+    return np.vstack([rng.normal(size=(24, 2)), rng.normal(size=(6, 2)) + 20])
+
+
+@pytest.mark.parametrize('solver', [0, 1])
+def test_cluster_sizes_within_limits(kmeans, solver):
+    output = run(kmeans, point_layer(clustered_points()), CLUSTERS=3, MINPOINTS=8,
+                 MAXPOINTS=12, SOLVER=solver)
+    sizes = np.bincount([f['CLUSTER_ID'] for f in output.values()])[1:]
+    assert len(sizes) == 3
+    assert (sizes >= 8).all() and (sizes <= 12).all()
+    assert all(f['CLUSTER_SIZE'] == sizes[f['CLUSTER_ID'] - 1] for f in output.values())
+
+
+def test_cluster_weights_within_capacity(kmeans):
+    weights = np.where(np.arange(30) % 3 == 0, 2.0, 1.0)
+    output = run(kmeans, point_layer(clustered_points(), weights), CLUSTERS=3,
+                 MINPOINTS=5, WEIGHT_FIELD='visits', CAPACITY=15, SOLVER=1)
+    loads = np.bincount([f['CLUSTER_ID'] for f in output.values()],
+                        weights=[f['visits'] for f in output.values()])[1:]
+    assert loads.sum() == pytest.approx(weights.sum())
+    assert (loads <= 15).all()
+
+
+def test_unmet_capacity_fails(kmeans):
+    # Every weight and the total fit, but 3, 3 and 2 cannot be packed in two
+    # clusters of at most 4
+    layer = point_layer([(0, 0), (1, 0), (2, 0)], [3, 3, 2])
+    assert run(kmeans, layer, CLUSTERS=2, WEIGHT_FIELD='visits', CAPACITY=4,
+               SOLVER=1) is None
+
+
+def test_same_seed_gives_same_clusters(kmeans):
+    layer = point_layer(np.random.default_rng(2).random((60, 2)) * 100)
+    parameters = dict(CLUSTERS=4, MINPOINTS=10, SOLVER=1, RESTARTS=3, THREADS=2, SEED=7)
+    first = run(kmeans, layer, **parameters)
+    second = run(kmeans, layer, **parameters)
+    assert {i: f['CLUSTER_ID'] for i, f in first.items()} == \
+        {i: f['CLUSTER_ID'] for i, f in second.items()}
+
+
+def test_empty_clusters_get_centers(kmeans):
+    # Without a minimum size, centers on the same point leave clusters empty
+    data = np.array([[0, 0]] * 5 + [[10, 10]] * 5, dtype=float)
+    C, M, _ = kmeans.constrained_kmeans(data, [0] * 4, maxiter=5, seed=0)
+    assert np.isfinite(C).all()
+
+
+def test_clusters_written_to_their_features(kmeans):
+    from qgis.core import NULL, QgsFeature
+    rng = np.random.default_rng(3)
+    points = np.vstack([rng.random((5, 2)), rng.random((5, 2)) + 100])
+    layer = point_layer(points)
+    # Ids with a gap, and a feature without geometry in between
+    layer.dataProvider().deleteFeatures([3])
+    feature = QgsFeature(layer.fields())
+    feature.setAttributes([99, 1.0])
+    layer.dataProvider().addFeatures([feature])
+    output = run(kmeans, layer, CLUSTERS=2, MINPOINTS=4)
+    assert output[99]['CLUSTER_ID'] == NULL
+    assert output[99]['CLUSTER_SIZE'] == NULL
+    near = {output[i]['CLUSTER_ID'] for i in range(5) if i != 2}
+    far = {output[i]['CLUSTER_ID'] for i in range(5, 10)}
+    assert len(near) == len(far) == 1 and near != far
+    assert output[0]['CLUSTER_SIZE'] == 4 and output[5]['CLUSTER_SIZE'] == 5
@@ -0,0 +1,51 @@
+"""
+Tests of the buffers made by Equidistance Buffer.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture(scope='module')
+def buffer(load_script):
+    return load_script('equidistance_buffer.py')
+
+
+@pytest.mark.parametrize('lat', [0.0, 45.0, -70.0, 85.0])
+@pytest.mark.parametrize('distance', [100.0, 10000.0, 500000.0])
+def test_geodesic_rings_match_projected_buffer(buffer, lat, distance):
+    from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform,
+                           QgsGeometry, QgsPointXY, QgsProject)
+    lons, lats = buffer.geodesic_rings(np.array([10.0]), np.array([lat]), distance, 20)
+    aeqd = QgsCoordinateReferenceSystem(
+        'PROJ4:+proj=aeqd +ellps=WGS84 +lat_0={} +lon_0=10 +x_0=0 +y_0=0'.format(lat))
+    xform = QgsCoordinateTransform(
+        QgsCoordinateReferenceSystem('EPSG:4326'), aeqd, QgsProject.instance())
+    ring = [xform.transform(QgsPointXY(x, y)) for x, y in zip(lons[0], lats[0])]
+    # The projection keeps the distances from its center
+    radii = np.hypot([p.x() for p in ring], [p.y() for p in ring])
+    assert radii == pytest.approx(distance, rel=1e-7, abs=1e-3)
+    # The projected buffer of the point has as many vertices on the same circle
+    reference = QgsGeometry.fromPointXY(QgsPointXY(0, 0)).buffer(distance, 5)
+    assert QgsGeometry.fromPolygonXY([ring]).area() == pytest.approx(reference.area(), rel=1e-6)
+
+
+def test_point_buffers_follow_feature_order(buffer):
+    from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsProcessingFeedback
+    algorithm = buffer.EquidistanceBuffer()
+    algorithm.distances = [1000.0]
+    algorithm.segments = 5
+    algorithm.accuracy_checked = True
+    features = []
+    for lon in [0.0, 20.0, 40.0]:
+        feature = QgsFeature()
+        # Features from different sources can share an id
+        feature.setId(1)
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(lon, 0.0)))
+        features.append(feature)
+    features.insert(1, QgsFeature())
+    buffered = algorithm.bufferPoints(features, False, QgsProcessingFeedback())
+    assert buffered[1][1] is None
+    centers = [b[0].centroid().asPoint().x() for f, b in buffered if b is not None]
+    assert centers == pytest.approx([0.0, 20.0, 40.0], abs=1e-6)
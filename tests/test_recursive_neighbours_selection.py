@@ -0,0 +1,82 @@
+"""
+Tests of the features reached by Recursive Neighbor Selection.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+
+
+@pytest.fixture(scope='module')
+def neighbours(load_script):
+    return load_script('recursive_neighbours_selection.py')
+
+
+def square(x, y=0):
+    return 'POLYGON(({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'.format(x, y, x + 1, y + 1)
+
+
+def square_layer():
+    """A row of three touching squares, two more touching squares further away
+    and one square on its own, with the memory provider ids 1 to 6"""
+    from qgis.core import QgsFeature, QgsGeometry, QgsVectorLayer
+    layer = QgsVectorLayer('Polygon?crs=EPSG:3857&field=name:string', 'squares', 'memory')
+    features = []
+    for name, x in [('a', 0), ('b', 1), ('c', 2), ('d', 5), ('e', 6), ('f', 10)]:
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromWkt(square(x)))
+        feature.setAttributes([name])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def run(neighbours, layer, **parameters):
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback, QgsProcessingUtils
+    algorithm = neighbours.RecursiveNeighborSelection().create()
+    parameters = dict({'INPUT': layer, 'OUTPUT': 'TEMPORARY_OUTPUT'}, **parameters)
+    context = QgsProcessingContext()
+    results, ok = algorithm.run(parameters, context, QgsProcessingFeedback())
+    assert ok
+    output = QgsProcessingUtils.mapLayerFromString(results['OUTPUT'], context)
+    return {f['name']: f for f in output.getFeatures()}
+
+
+@pytest.mark.parametrize('threads', [1, 3])
+def test_components_are_labelled(neighbours, threads):
+    output = run(neighbours, square_layer(), MODE=1, THREADS=threads)
+    labels = {name: f['COMPONENT_ID'] for name, f in output.items()}
+    assert labels['a'] == labels['b'] == labels['c']
+    assert labels['d'] == labels['e']
+    assert len({labels['a'], labels['d'], labels['f']}) == 3
+    assert [output[name]['COMPONENT_SIZE'] for name in 'acdf'] == [3, 3, 2, 1]
+
+
+def test_filter_applies_to_components(neighbours):
+    from qgis.core import NULL
+    output = run(neighbours, square_layer(), MODE=1, FILTER='"name" <> \'b\'')
+    assert output['b']['COMPONENT_ID'] == NULL
+    assert output['a']['COMPONENT_ID'] != output['c']['COMPONENT_ID']
+    assert output['a']['COMPONENT_SIZE'] == 1
+    assert output['d']['COMPONENT_SIZE'] == 2
+
+
+def test_selection_grows_with_hop_counts(neighbours):
+    layer = square_layer()
+    layer.selectByIds([1])
+    output = run(neighbours, layer)
+    assert {name: f['HOPS'] for name, f in output.items()} == {'a': 0, 'b': 1, 'c': 2}
+    assert sorted(layer.selectedFeatureIds()) == [1, 2, 3]
+
+
+def test_bounded_selection(neighbours):
+    layer = square_layer()
+    layer.selectByIds([1])
+    assert set(run(neighbours, layer, MAX_HOPS=1)) == {'a', 'b'}
+    # The filter blocks the path through b
+    layer.selectByIds([1])
+    assert set(run(neighbours, layer, FILTER='"name" <> \'b\'')) == {'a'}
+    # With a tolerance, squares up to 2.5 units apart touch as well
+    layer.selectByIds([1])
+    output = run(neighbours, layer, TOLERANCE=2.5)
+    assert {name: f['HOPS'] for name, f in output.items()} == \
+        {'a': 0, 'b': 1, 'c': 1, 'd': 2, 'e': 3}
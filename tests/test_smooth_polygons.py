@@ -0,0 +1,61 @@
+"""
+Tests of the output of Smooth Polygons.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+pytest.importorskip('numpy')
+
+
+@pytest.fixture(scope='module')
+def smooth(load_script):
+    return load_script('smooth_polygons.py')
+
+
+def polygon_layer(wkts):
+    from qgis.core import QgsFeature, QgsGeometry, QgsVectorLayer
+    layer = QgsVectorLayer('Polygon?crs=EPSG:3857&field=id:integer', 'polygons', 'memory')
+    features = []
+    for i, wkt in enumerate(wkts):
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        feature.setAttributes([i])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def run(smooth, layer, **parameters):
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback, QgsProcessingUtils
+    algorithm = smooth.SmoothPolygons().create()
+    parameters = dict({'INPUT': layer, 'VERTICES': 5, 'TOLERANCE': 2.0, 'SEED': 1,
+                       'OUTPUT': 'TEMPORARY_OUTPUT'}, **parameters)
+    context = QgsProcessingContext()
+    results, ok = algorithm.run(parameters, context, QgsProcessingFeedback())
+    assert ok
+    output = QgsProcessingUtils.mapLayerFromString(results['OUTPUT'], context)
+    return {f['id']: f.geometry() for f in output.getFeatures()}
+
+
+SQUARES = ['POLYGON((0 0, 50 0, 50 50, 0 50, 0 0))',
+           'POLYGON((50 0, 100 0, 100 50, 50 50, 50 0))']
+
+
+def test_shared_boundary_is_smoothed(smooth):
+    from qgis.core import QgsGeometry
+    layer = polygon_layer(SQUARES)
+    output = run(smooth, layer)
+    extent = QgsGeometry.fromWkt('POLYGON((0 0, 100 0, 100 50, 0 50, 0 0))')
+    for i, wkt in enumerate(SQUARES):
+        original = QgsGeometry.fromWkt(wkt)
+        assert output[i].symDifference(original).area() > 1.0
+        # Clipped to the input layer, not to the original polygon
+        assert output[i].difference(extent).area() < 1e-6
+        assert output[i].difference(original).area() > 1.0
+
+
+def test_same_seed_gives_same_output(smooth):
+    layer = polygon_layer(SQUARES)
+    first = run(smooth, layer)
+    second = run(smooth, layer)
+    assert [g.asWkt() for g in first.values()] == [g.asWkt() for g in second.values()]
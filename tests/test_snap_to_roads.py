@@ -0,0 +1,102 @@
+"""
+Tests of the window stitching of Snap to Roads, run against the local OSRM
+stub of the benchmarks.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+pytest.importorskip('requests')
+
+
+@pytest.fixture(scope='module')
+def snap(load_script):
+    return load_script('snap_to_roads.py')
+
+
+@pytest.fixture(scope='module')
+def service():
+    import osrm_stub
+    server, url = osrm_stub.start()
+    yield url
+    server.shutdown()
+
+
+def trace_layer(tracks):
+    """Memory layer of the points of {track id: [(lon, lat)]}, timestamped every 5 seconds"""
+    from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer
+    layer = QgsVectorLayer('Point?crs=EPSG:4326&field=track:integer&field=time:integer',
+                           'trace', 'memory')
+    features = []
+    for track, points in tracks.items():
+        for i, (x, y) in enumerate(points):
+            feature = QgsFeature(layer.fields())
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            feature.setAttributes([track, 1600000000 + 5 * i])
+            features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def straight(count, lat=51.5):
+    return [(0.001 * i, lat) for i in range(count)]
+
+
+def run(snap, layer, service, **parameters):
+    """Runs the algorithm and returns the output features in writing order, or None if it failed"""
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback, QgsProcessingUtils
+    algorithm = snap.ExportLayoutAlgorithm().create()
+    parameters = dict({'INPUT': layer, 'TIMESTAMP_FIELD': 'time', 'SERVICE': service,
+                       'THREADS': 2, 'RETRIES': 0, 'CACHE_SIZE': 0,
+                       'OUTPUT': 'TEMPORARY_OUTPUT'}, **parameters)
+    context = QgsProcessingContext()
+    results, ok = algorithm.run(parameters, context, QgsProcessingFeedback())
+    if not ok:
+        return None
+    output = QgsProcessingUtils.mapLayerFromString(results['OUTPUT'], context)
+    return list(output.getFeatures())
+
+
+def vertex_count(feature):
+    return feature.geometry().constGet().numPoints()
+
+
+def test_overlapping_windows_are_joined(snap, service):
+    import osrm_stub
+    points = straight(25)
+    features = run(snap, trace_layer({1: points}), service, CHUNK_SIZE=10, OVERLAP=3)
+    assert len(features) == 1
+    assert vertex_count(features[0]) == 25
+    expected = sum(osrm_stub.haversine(a, b) for a, b in zip(points[:-1], points[1:]))
+    assert features[0]['distance'] == pytest.approx(expected)
+
+
+def test_windows_without_overlap_are_not_joined(snap, service):
+    features = run(snap, trace_layer({1: straight(25)}), service, CHUNK_SIZE=10, OVERLAP=0)
+    assert [vertex_count(f) for f in features] == [10, 10, 5]
+
+
+def test_no_match_window_is_skipped(snap, service):
+    points = straight(25)
+    points[10:20] = [(x, 86.0) for x, y in points[10:20]]
+    features = run(snap, trace_layer({1: points}), service, CHUNK_SIZE=10, OVERLAP=0)
+    assert [vertex_count(f) for f in features] == [10, 5]
+
+
+def test_unmatched_point_splits_line(snap, service):
+    points = straight(25)
+    points[5] = (points[5][0], 86.0)
+    features = run(snap, trace_layer({1: points}), service, CHUNK_SIZE=10, OVERLAP=3)
+    assert [vertex_count(f) for f in features] == [5, 19]
+
+
+def test_tracks_are_not_joined(snap, service):
+    layer = trace_layer({1: straight(15), 2: straight(15, lat=52.0)})
+    features = run(snap, layer, service, TRACK_FIELD='track', CHUNK_SIZE=10, OVERLAP=3)
+    assert [f['track_id'] for f in features] == [1, 2]
+    assert [vertex_count(f) for f in features] == [15, 15]
+    assert features[1].geometry().boundingBox().yMinimum() == pytest.approx(52.0)
+
+
+def test_unreachable_service_fails_cleanly(snap):
+    # Nothing listens on port 9 of the local host
+    assert run(snap, trace_layer({1: straight(5)}), 'http://127.0.0.1:9') is None
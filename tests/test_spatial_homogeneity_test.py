@@ -0,0 +1,71 @@
+"""
+Tests of the statistics and flags of Spatial Homogeneity Test.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+pytest.importorskip('numpy')
+
+
+@pytest.fixture(scope='module')
+def homogeneity(load_script):
+    return load_script('spatial_homogeneity_test.py')
+
+
+def station_layer(center_value):
+    """Four stations on the corners of a square around a fifth one"""
+    from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer
+    layer = QgsVectorLayer(
+        'Point?crs=EPSG:3857&field=name:string&field=rain:double&field=neighbors:string',
+        'stations', 'memory')
+    features = []
+    for name, x, y, value, neighbors in [
+            ('a', 0, 0, 90.0, 'b,e'), ('b', 2000, 0, 110.0, 'a,e'),
+            ('c', 2000, 2000, 90.0, 'b,d'), ('d', 0, 2000, 110.0, 'c,e'),
+            ('e', 1000, 1000, center_value, 'a, b, c, d, nowhere')]:
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+        feature.setAttributes([name, value, neighbors])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return layer
+
+
+def run(homogeneity, layer):
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback, QgsProcessingUtils
+    algorithm = homogeneity.SpatialHomogeneityTestAlgorithm().create()
+    parameters = {'INPUT': layer, 'NAME_FIELD': 'name', 'VALUE_FIELD': 'rain',
+                  'NEIGHBORS_FIELD': 'neighbors', 'DEVIATION': 75,
+                  'OUTPUT': 'TEMPORARY_OUTPUT'}
+    context = QgsProcessingContext()
+    results, ok = algorithm.run(parameters, context, QgsProcessingFeedback())
+    assert ok
+    output = QgsProcessingUtils.mapLayerFromString(results['OUTPUT'], context)
+    return {f['name']: f for f in output.getFeatures()}
+
+
+@pytest.mark.parametrize('value, absdiff, suspect', [
+    (115.0, 15.0, 'No'),
+    # More than twice the standard deviation of 10 away from the estimate
+    (130.0, 30.0, 'Yes'),
+    (300.0, 200.0, 'Yes'),
+])
+def test_stations_are_flagged(homogeneity, value, absdiff, suspect):
+    output = run(homogeneity, station_layer(value))
+    center = output['e']
+    # The unknown neighbor name is not counted
+    assert center['N'] == 4
+    assert center['P_est'] == pytest.approx(100.0)
+    assert center['mean'] == pytest.approx(100.0)
+    assert center['stdev'] == pytest.approx(10.0)
+    assert center['absdiff'] == pytest.approx(absdiff)
+    assert center['suspect'] == suspect
+    # Two neighbors are too few to flag a station
+    assert output['a']['suspect'] == 'No'
+
+
+def test_station_without_value_is_not_flagged(homogeneity):
+    from qgis.core import NULL
+    output = run(homogeneity, station_layer(NULL))
+    assert output['e']['absdiff'] == NULL
+    assert output['e']['suspect'] == NULL
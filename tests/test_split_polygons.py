@@ -0,0 +1,37 @@
+"""
+Tests of the parts made by Split Polygons into Equal Parts.
+"""
+import pytest
+
+pytest.importorskip('qgis.core')
+pytest.importorskip('networkx')
+np = pytest.importorskip('numpy')
+
+
+@pytest.fixture(scope='module')
+def split(load_script):
+    return load_script('split_polygons.py')
+
+
+@pytest.mark.parametrize('wkt', [
+    'POLYGON((0 0, 100 0, 100 100, 0 100, 0 0))',
+    'POLYGON((0 0, 300 0, 300 40, 40 40, 40 200, 0 200, 0 0))',
+    'POLYGON((0 0, 100 0, 100 100, 0 100, 0 0), (40 40, 60 40, 60 60, 40 60, 40 40))',
+])
+def test_parts_have_equal_areas(split, wkt):
+    from qgis.core import QgsGeometry
+    polygon = QgsGeometry.fromWkt(wkt)
+    parts = split.split_polygon(polygon, 4, 2000, np.random.default_rng(1))
+    assert len(parts) == 4
+    areas = [part.area() for part in parts]
+    assert sum(areas) == pytest.approx(polygon.area())
+    assert max(areas) - min(areas) < 0.05 * polygon.area() / 4
+    assert QgsGeometry.unaryUnion(parts).symDifference(polygon).area() < 1e-6 * polygon.area()
+
+
+def test_same_seed_gives_same_parts(split):
+    from qgis.core import QgsGeometry
+    polygon = QgsGeometry.fromWkt('POLYGON((0 0, 100 0, 100 50, 0 50, 0 0))')
+    first = split.split_polygon(polygon, 3, 500, np.random.default_rng(7))
+    second = split.split_polygon(polygon, 3, 500, np.random.default_rng(7))
+    assert [part.asWkt() for part in first] == [part.asWkt() for part in second]